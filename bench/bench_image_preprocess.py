@@ -0,0 +1,160 @@
+"""
+Benchmark tiền xử lý ảnh bài làm cho /auto-grading/image.
+
+Chạy từ thư mục gốc của repo (cần Pillow):
+    python -m bench.bench_image_preprocess [--dir ./scans] [--count 6] [--bandwidth-mbps 20] [--output result.json]
+
+Không có --dir thì sinh ảnh chụp giả lập (giấy trắng có chữ trên nền bàn, 12 MP, EXIF xoay 90°).
+Ảnh được phục vụ qua FakeFileHost và xử lý qua đúng đường của server (tải + process pool).
+
+Thời gian đầu-cuối ước lượng cho mỗi ảnh:
+- trước: chỉ truyền ảnh gốc tới vision model (bytes / băng thông)
+- sau: tải ảnh + tiền xử lý (đo thật) + truyền data URL base64 (bytes / băng thông)
+Số image token tính theo công thức detail=high của OpenAI (ô 512px, 170 token/ô + 85).
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import random
+import statistics
+
+from PIL import Image, ImageDraw, ImageFont
+
+from bench.fake_file_host import FakeFileHost, load_directory
+from file_fetcher import FileFetcher
+from image_preprocess import IMAGE_SOURCE_MAX_BYTES, ImagePreprocessor
+
+_EXIF_ORIENTATION = 0x0112
+
+
+def synthetic_scan(seed: int, size=(4032, 3024)) -> bytes:
+    """
+    Ảnh chụp bài làm giả lập: nền bàn tối, tờ giấy sáng có nhiều dòng chữ, nhiễu cảm biến.
+    Lưu nằm ngang kèm EXIF orientation=6 như ảnh điện thoại chụp dọc.
+    """
+    rng = random.Random(seed)
+    width, height = size
+    img = Image.new("RGB", size, (92, 70, 52))
+    draw = ImageDraw.Draw(img)
+    paper = (int(width * 0.12), int(height * 0.06), int(width * 0.9), int(height * 0.95))
+    draw.rectangle(paper, fill=(238, 236, 228))
+
+    font = ImageFont.load_default(size=56)
+    y = paper[1] + 120
+    while y < paper[3] - 120:
+        words = " ".join(rng.choice(["x =", "5", "2x + 3", "= 13", "vậy", "đáp án", "(a+b)^2", "suy ra"])
+                         for _ in range(rng.randint(4, 10)))
+        draw.text((paper[0] + 100, y), words, fill=(30, 35, 60), font=font)
+        y += rng.randint(90, 130)
+
+    noise = Image.effect_noise(size, 24).convert("RGB")
+    img = Image.blend(img, noise, 0.08)
+
+    exif = Image.Exif()
+    exif[_EXIF_ORIENTATION] = 6
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=92, exif=exif)
+    return output.getvalue()
+
+
+def vision_tokens(size) -> int:
+    """
+    Số token ảnh ước lượng (detail=high): thu về khung 2048, cạnh ngắn 768, đếm ô 512px.
+    """
+    width, height = size
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def oriented_size(content: bytes):
+    with Image.open(io.BytesIO(content)) as img:
+        if img.getexif().get(_EXIF_ORIENTATION) in (5, 6, 7, 8):
+            return img.size[1], img.size[0]
+        return img.size
+
+
+async def run(files: dict, bandwidth_mbps: float, repeat: int) -> list:
+    bytes_per_second = bandwidth_mbps * 1_000_000 / 8
+    preprocessor = ImagePreprocessor()
+    fetcher = FileFetcher(max_bytes=IMAGE_SOURCE_MAX_BYTES, cache_max_entries=0)
+    rows = []
+    try:
+        with FakeFileHost(files) as host:
+            # Khởi động process pool trước để không tính vào ảnh đầu tiên
+            await preprocessor.preprocess(next(iter(files.values()))[0])
+            for path, (content, _) in files.items():
+                timings = []
+                for _ in range(repeat):
+                    start = asyncio.get_running_loop().time()
+                    fetched = await fetcher.fetch(host.url(path))
+                    prepared = await preprocessor.preprocess(fetched.content)
+                    timings.append(asyncio.get_running_loop().time() - start)
+                local_seconds = statistics.median(timings)
+
+                payload_bytes = math.ceil(prepared.final_bytes / 3) * 4  # base64
+                before = len(content) / bytes_per_second
+                after = local_seconds + payload_bytes / bytes_per_second
+                rows.append({
+                    "name": path.lstrip("/"),
+                    "original_bytes": len(content),
+                    "final_bytes": prepared.final_bytes,
+                    "payload_bytes": payload_bytes,
+                    "bytes_saved_pct": round(100 * (1 - prepared.final_bytes / len(content)), 1),
+                    "original_size": list(oriented_size(content)),
+                    "final_size": list(prepared.final_size),
+                    "tokens_before": vision_tokens(oriented_size(content)),
+                    "tokens_after": vision_tokens(prepared.final_size),
+                    "preprocess_ms": round(local_seconds * 1000, 1),
+                    "e2e_before_ms": round(before * 1000, 1),
+                    "e2e_after_ms": round(after * 1000, 1),
+                })
+    finally:
+        await fetcher.aclose()
+        preprocessor.shutdown()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", help="thư mục ảnh scan thật (jpg/png)")
+    parser.add_argument("--count", type=int, default=6, help="số ảnh giả lập khi không có --dir")
+    parser.add_argument("--bandwidth-mbps", type=float, default=20.0, help="băng thông tới vision model")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    if args.dir:
+        files = load_directory(args.dir)
+    else:
+        files = {f"/scan-{i}.jpg": (synthetic_scan(i), "image/jpeg") for i in range(args.count)}
+
+    rows = asyncio.run(run(files, args.bandwidth_mbps, args.repeat))
+
+    header = (f"{'image':20} {'orig KB':>9} {'new KB':>8} {'saved':>7} {'size':>11} {'tokens':>11} "
+              f"{'prep ms':>8} {'e2e before':>11} {'e2e after':>10}")
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        size = "x".join(str(v) for v in r["final_size"])
+        print(f"{r['name']:20} {r['original_bytes'] / 1024:>9.0f} {r['final_bytes'] / 1024:>8.0f} "
+              f"{r['bytes_saved_pct']:>6.1f}% {size:>11} {r['tokens_before']:>5}->{r['tokens_after']:<5} "
+              f"{r['preprocess_ms']:>8.1f} {r['e2e_before_ms']:>11.1f} {r['e2e_after_ms']:>10.1f}")
+    total_before = sum(r["original_bytes"] for r in rows)
+    total_after = sum(r["final_bytes"] for r in rows)
+    print(f"\nTổng: {total_before / 1024:.0f} KB -> {total_after / 1024:.0f} KB "
+          f"({100 * (1 - total_after / total_before):.1f}% nhỏ hơn); "
+          f"e2e trung vị {statistics.median(r['e2e_before_ms'] for r in rows):.0f} ms -> "
+          f"{statistics.median(r['e2e_after_ms'] for r in rows):.0f} ms @ {args.bandwidth_mbps} Mbps")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
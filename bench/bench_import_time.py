@@ -0,0 +1,126 @@
+"""
+Đo thời gian import main.py (khởi động worker) bằng python -X importtime.
+
+Chạy từ thư mục gốc của repo:
+    python -m bench.bench_import_time [--repeat 7] [--output result.json] [--compare old.json]
+
+Mỗi lần đo chạy một tiến trình Python mới: "import main" rồi lấy main.app (như uvicorn main:app).
+Kết quả: tổng thời gian import main (median), thời gian tới khi có app, và các package tốn nhiều nhất.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+# Các package đáng theo dõi: có mặt hay không sau khi import main
+WATCHED = ("openai", "cloudinary", "requests", "PIL", "fastapi", "pydantic", "httpx", "dotenv")
+
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+_CHILD = (
+    "import time; start = time.perf_counter(); import main; main.app; "
+    "print(round((time.perf_counter() - start) * 1000, 1))"
+)
+
+
+def parse_importtime(stderr: str) -> dict:
+    """
+    {module: thời gian import tích lũy (µs)} cho các module import lần đầu.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            modules[match.group(4)] = int(match.group(2))
+    return modules
+
+
+def measure_once(env: dict) -> dict:
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _CHILD],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    modules = parse_importtime(completed.stderr)
+    return {
+        "import_main_ms": modules.get("main", 0) / 1000,
+        "app_ready_ms": float(completed.stdout.strip().splitlines()[-1]),
+        "modules": modules,
+    }
+
+
+def run(repeat: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "OPENAI_API_KEY": "bench",
+            # Bản cũ mở SQLite ngay khi import: ghi vào thư mục tạm
+            "RESPONSE_CACHE_PATH": str(Path(tmp) / "response_cache.sqlite3"),
+            "IMAGE_INGEST_CACHE_PATH": str(Path(tmp) / "image_ingest.sqlite3"),
+            "QUESTION_BANK_PATH": str(Path(tmp) / "question_bank.sqlite3"),
+            "JOBS_PATH": str(Path(tmp) / "jobs.sqlite3"),
+        }
+        measure_once(env)  # lần đầu biên dịch .pyc, không tính
+        samples = [measure_once(env) for _ in range(repeat)]
+
+    last = samples[-1]["modules"]
+    top = sorted(
+        (name for name in last if "." not in name and name != "main"),
+        key=lambda name: last[name], reverse=True,
+    )[:10]
+    return {
+        "repeat": repeat,
+        "import_main_ms": round(statistics.median(s["import_main_ms"] for s in samples), 1),
+        "app_ready_ms": round(statistics.median(s["app_ready_ms"] for s in samples), 1),
+        "modules_imported": len(last),
+        "watched": {name: name in last for name in WATCHED},
+        "top_packages_ms": {name: round(last[name] / 1000, 1) for name in top},
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=REPO_ROOT, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result: dict, baseline: dict | None):
+    for key, label in (("import_main_ms", "import main"), ("app_ready_ms", "import main + app")):
+        line = f"{label:22} {result[key]:>9.1f} ms"
+        if baseline:
+            old = baseline[key]
+            line += f"   (trước: {old:.1f} ms, {result[key] - old:+.1f} ms, {(old - result[key]) / old:.0%} nhanh hơn)"
+        print(line)
+    print(f"{'số module':22} {result['modules_imported']:>9}")
+    print("package nặng nhất: " + ", ".join(f"{k} {v} ms" for k, v in result["top_packages_ms"].items()))
+    print("đã import: " + ", ".join(f"{k}={'có' if v else 'không'}" for k, v in result["watched"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--output", help="ghi kết quả ra file JSON")
+    parser.add_argument("--compare", help="file JSON kết quả cũ để so sánh")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"So sánh với {args.compare} (commit {baseline.get('commit')})")
+
+    result = {"commit": _git_commit(), **run(args.repeat)}
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Micro-benchmark: extract_json_from_text (quét một lần) so với bản regex cũ.
+
+Chạy từ thư mục gốc của repo:
+    python -m bench.bench_json_extract [--repeat 200] [--timeout 5] [--output result.json]
+
+Bản cũ được chạy trong tiến trình con có timeout vì regex array của nó
+backtrack theo cấp số nhân trên output bị cắt cụt.
+"""
+import argparse
+import json
+import multiprocessing
+import re
+import statistics
+import time
+from pathlib import Path
+
+from json_extract import locate_json
+
+CORPUS_PATH = Path(__file__).parent / "corpus" / "model_outputs.jsonl"
+
+
+def legacy_extract_json_from_text(text):
+    """
+    Hàm helper để extract JSON từ text response.
+    Thử nhiều pattern khác nhau để tìm JSON hợp lệ.
+    """
+    # Thử 1: Parse trực tiếp
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    
+    # Thử 2: Tìm JSON trong code block (```json...```)
+    json_match = re.search(r'```json\s*([\[\{].*?[\]\}])\s*```', text, re.DOTALL)
+    if json_match:
+        try:
+            return json.loads(json_match.group(1))
+        except json.JSONDecodeError:
+            pass
+    
+    # Thử 3: Tìm JSON array [...]
+    array_match = re.search(r'\[\s*\{.*?\}\s*(?:,\s*\{.*?\}\s*)*\]', text, re.DOTALL)
+    if array_match:
+        try:
+            return json.loads(array_match.group(0))
+        except json.JSONDecodeError:
+            pass
+    
+    # Thử 4: Tìm JSON object {...}
+    object_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', text, re.DOTALL)
+    if object_match:
+        try:
+            return json.loads(object_match.group(0))
+        except json.JSONDecodeError:
+            pass
+    
+    # Thử 5: Xử lý trường hợp có trailing comma
+    cleaned_text = re.sub(r',\s*(\]|\})', r'\1', text)
+    try:
+        return json.loads(cleaned_text)
+    except json.JSONDecodeError:
+        pass
+    
+    return None
+
+
+def _grading_item(i: int) -> str:
+    return json.dumps({"question_number": i, "isCorrect": True, "score": 8, "comments": "Tốt",
+                       "correct_answer": "x"}, ensure_ascii=False)
+
+
+def synthetic_truncated(n_items: int) -> str:
+    """
+    Output /recent-test-grading bị cắt ở max_tokens: array các object chưa đóng.
+    """
+    return "Đây là kết quả:\n[" + ",".join(_grading_item(i) for i in range(n_items))
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _time_call(func, text, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def _legacy_worker(text, repeat, queue):
+    queue.put((_time_call(legacy_extract_json_from_text, text, repeat),
+               legacy_extract_json_from_text(text)))
+
+
+def time_legacy(text, repeat, timeout):
+    """
+    Trả về (median giây, kết quả) của bản cũ, hoặc (None, None) nếu quá timeout.
+    """
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_legacy_worker, args=(text, repeat, queue))
+    proc.start()
+    proc.join(timeout)
+    if proc.is_alive():
+        proc.terminate()
+        proc.join()
+        return None, None
+    return queue.get()
+
+
+def _summary(value):
+    if isinstance(value, list):
+        return f"list[{len(value)}]"
+    if isinstance(value, dict):
+        return "dict"
+    return type(value).__name__
+
+
+def run_case(name, text, repeat, timeout):
+    new_seconds = _time_call(lambda t: locate_json(t), text, repeat)
+    new_value, tier = locate_json(text)
+    legacy_seconds, legacy_value = time_legacy(text, repeat, timeout)
+    return {
+        "name": name,
+        "chars": len(text),
+        "new_us": round(new_seconds * 1e6, 1),
+        "new_tier": tier,
+        "new_result": _summary(new_value),
+        "legacy_us": round(legacy_seconds * 1e6, 1) if legacy_seconds is not None else None,
+        "legacy_result": _summary(legacy_value) if legacy_seconds is not None else f"timeout>{timeout}s",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=5.0, help="giới hạn thời gian cho bản cũ mỗi case")
+    parser.add_argument("--output", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    rows = [run_case(c["name"], c["text"], args.repeat, args.timeout) for c in load_corpus()]
+    for n_items in (8, 12, 16, 20, 40):
+        text = synthetic_truncated(n_items)
+        rows.append(run_case(f"synthetic_truncated_{n_items}", text, max(1, args.repeat // 20), args.timeout))
+
+    header = f"{'case':40} {'chars':>7} {'new µs':>10} {'tier':>10} {'new':>9} {'legacy µs':>12} {'legacy':>14}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        legacy_us = f"{r['legacy_us']:.1f}" if r["legacy_us"] is not None else "-"
+        print(f"{r['name']:40} {r['chars']:>7} {r['new_us']:>10.1f} {r['new_tier']:>10} {r['new_result']:>9} "
+              f"{legacy_us:>12} {r['legacy_result']:>14}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Máy chủ HTTP cục bộ giả lập nơi lưu file bài làm (thay cho Cloudinary / S3 khi đo đạc).
+Hỗ trợ ETag + If-None-Match (304), Content-Length (có thể tắt: body kết thúc khi đóng kết nối), charset
+và độ trễ giả lập.
+
+Dùng trong code:
+    with FakeFileHost({"/bai-lam.txt": ("x = 5".encode(), "text/plain; charset=utf-8")}) as host:
+        url = host.url("/bai-lam.txt")
+
+Chạy độc lập, phục vụ một thư mục:
+    python -m bench.fake_file_host --dir ./samples --port 8766 --latency-ms 50
+"""
+import argparse
+import hashlib
+import mimetypes
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+class FakeFileHost:
+    def __init__(self, files: dict | None = None, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 content_length: bool = True):
+        """
+        files: path -> (bytes, content_type)
+        """
+        self.files = dict(files or {})
+        self.latency = latency
+        self.content_length = content_length
+        self.requests = []  # (method, path, status)
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, path: str) -> str:
+        return self.base_url + path
+
+    def add_file(self, path: str, content: bytes, content_type: str = "text/plain; charset=utf-8"):
+        self.files[path] = (content, content_type)
+
+    def _handler_class(self):
+        host = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if host.latency:
+                    time.sleep(host.latency)
+                entry = host.files.get(self.path)
+                if entry is None:
+                    self._reply(404, b"not found", "text/plain")
+                    return
+                content, content_type = entry
+                etag = '"' + hashlib.sha1(content).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    host.requests.append(("GET", self.path, 304))
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self._reply(200, content, content_type, etag)
+
+            def _reply(self, status, content, content_type, etag=None):
+                host.requests.append(("GET", self.path, status))
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                if host.content_length:
+                    self.send_header("Content-Length", str(len(content)))
+                if etag:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def load_directory(directory: str) -> dict:
+    files = {}
+    for path in Path(directory).rglob("*"):
+        if path.is_file():
+            content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            files["/" + path.relative_to(directory).as_posix()] = (path.read_bytes(), content_type)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Máy chủ file giả lập")
+    parser.add_argument("--dir", required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    host = FakeFileHost(load_directory(args.dir), args.host, args.port, args.latency_ms / 1000)
+    print(f"Serving {len(host.files)} files at {host.base_url}")
+    host._server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
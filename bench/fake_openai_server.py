@@ -0,0 +1,571 @@
+"""
+Server giả lập OpenAI chat completions (/v1/chat/completions) để đo tải không tốn tiền API.
+
+- Độ trễ: thời gian tới token đầu theo phân phối cấu hình (constant / uniform / lognormal)
+  cộng thời gian sinh token (--tokens-per-second)
+- Số token completion lấy quanh --completion-tokens, usage trả về đầy đủ
+- Tỉ lệ lỗi (429 / 500) và tỉ lệ JSON hỏng (bọc văn bản, dấu phẩy thừa, bị cắt cụt);
+  với response_format json_schema, output theo đúng schema và chỉ có thể hỏng do bị cắt cụt
+- Hỗ trợ stream=True (SSE) và stream_options.include_usage
+- Hạn mức RPM / TPM (--rpm-limit / --tpm-limit): trả header x-ratelimit-*
+  như OpenAI và 429 kèm retry-after-ms khi vượt
+- Nội dung trả về đúng format mà prompt của từng endpoint yêu cầu
+- Prompt caching như OpenAI: prompt từ 1024 token, phần đầu trùng với prompt trước được báo trong
+  usage.prompt_tokens_details.cached_tokens (theo bước 128 token)
+- logprobs=True: logprob cho từng token của output; token true/false (isCorrect) có độ tự tin thấp
+  với tỉ lệ --uncertain-rate (để thử leo thang model theo độ tự tin)
+- Batch API tối giản (/v1/files, /v1/batches): batch được xử lý ngay sau --batch-latency giây
+
+Chạy độc lập:
+    python -m bench.fake_openai_server --port 8765 --latency lognormal:0.8:0.4 --failure-rate 0.01
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=bench uvicorn main:app
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from bench.threaded_server import ThreadedServer
+
+# Số token ước lượng cho mỗi ảnh gửi kèm (detail=high, ảnh cỡ trang giấy)
+_IMAGE_TOKENS = 765
+# Prompt caching: độ dài tối thiểu, bước tính phần trùng và số tiền tố nhớ tối đa
+_CACHE_MIN_TOKENS = 1024
+_CACHE_STEP_TOKENS = 128
+_CACHE_MAX_PREFIXES = 100_000
+
+
+def parse_latency(spec: str):
+    """
+    "constant:0.5" | "uniform:0.2:1.5" | "lognormal:<trung vị>:<sigma>" -> hàm sinh số giây.
+    """
+    kind, *values = spec.split(":")
+    values = [float(v) for v in values]
+    if kind == "constant":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1])
+    raise ValueError(f"Phân phối độ trễ không hợp lệ: {spec}")
+
+
+@dataclass
+class FakeOpenAIConfig:
+    latency: str = "lognormal:0.6:0.4"
+    tokens_per_second: float = 0.0  # 0: không cộng thời gian sinh token
+    completion_tokens: int = 150
+    failure_rate: float = 0.0
+    malformed_rate: float = 0.0
+    rpm_limit: int = 0  # 0: không giới hạn
+    tpm_limit: int = 0
+    batch_latency: float = 0.0  # thời gian từ lúc tạo batch tới khi completed
+    prompt_cache: bool = True
+    uncertain_rate: float = 0.05  # tỉ lệ token true/false có logprob thấp khi request xin logprobs
+    seed: int | None = None
+
+
+@dataclass
+class FakeOpenAIStats:
+    requests: int = 0
+    failures: int = 0
+    malformed: int = 0
+    rate_limited: int = 0
+    streams: int = 0
+    batches: int = 0
+    batch_requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    by_kind: dict = field(default_factory=dict)
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__, by_kind=dict(self.by_kind))
+
+
+def _message_text(messages) -> tuple[str, int]:
+    texts, images = [], 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    texts.append(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    images += 1
+    return "\n".join(texts), images
+
+
+def _filler(rng, tokens: int) -> str:
+    words = ["Bài làm", "đúng hướng", "cần trình bày", "rõ ràng hơn", "lập luận", "hợp lý", "kết quả", "chính xác"]
+    out = []
+    while len(" ".join(out)) < tokens * 4:
+        out.append(rng.choice(words))
+    return " ".join(out)
+
+
+def _count(pattern: str, text: str, default: int) -> int:
+    match = re.search(pattern, text)
+    return int(match.group(1)) if match else default
+
+
+def _verdict(rng: random.Random) -> tuple[bool, int]:
+    # isCorrect và điểm khớp nhau: đúng 6-10 điểm, sai 0-5 điểm
+    is_correct = rng.random() < 0.7
+    return is_correct, rng.randint(6, 10) if is_correct else rng.randint(0, 5)
+
+
+def token_logprobs(content: str, rng: random.Random, uncertain_rate: float) -> list[dict]:
+    """
+    logprobs.content giả lập: mỗi từ / dấu là một token; token true/false có xác suất 0.5-0.8
+    với tỉ lệ uncertain_rate, còn lại gần 1.
+    """
+    tokens = []
+    for token in re.findall(r"\w+|\s+|[^\w\s]", content):
+        probability = 0.999
+        if token in ("true", "false"):
+            probability = rng.uniform(0.5, 0.8) if rng.random() < uncertain_rate else rng.uniform(0.95, 0.999)
+        tokens.append({"token": token, "logprob": math.log(probability), "bytes": list(token.encode()),
+                       "top_logprobs": []})
+    return tokens
+
+
+def build_reply(prompt: str, rng: random.Random, completion_tokens: int) -> tuple[str, str]:
+    """
+    Sinh nội dung trả về theo format prompt yêu cầu; trả về (loại, text).
+    """
+    comment = _filler(rng, completion_tokens)
+
+    if re.search(r'"question_number": (\d+|<[^>]*>),\s*"isCorrect"', prompt):
+        # Chấm theo nhóm: giữ đúng số thứ tự câu có trong prompt
+        numbers = [int(n) for n in re.findall(r"^(\d+)\. Câu hỏi:", prompt, re.MULTILINE)]
+        numbers = numbers or list(range(1, _count(r"ĐÚNG (\d+) kết quả", prompt, 1) + 1))
+        per_item = _filler(rng, max(10, completion_tokens // len(numbers)))
+        items = []
+        for number in numbers:
+            is_correct, score = _verdict(rng)
+            items.append({"question_number": number, "isCorrect": is_correct, "score": score,
+                          "comments": per_item, "correct_answer": "Đáp án mẫu"})
+        return "test_grading", json.dumps(items, ensure_ascii=False)
+
+    if '"rubric_scores"' in prompt:
+        criteria = re.findall(r"^\d+\. (.+?) \(Trọng số: (\d+)%\)", prompt.replace("\\n", "\n"), re.MULTILINE)
+        criteria = criteria or [("Tiêu chí 1", "100")]
+        numbers = [int(n) for n in re.findall(r"^Câu (\d+):", prompt, re.MULTILINE)]
+        rubric_scores = []
+        for name, weight in criteria:
+            score = rng.randint(5, 10)
+            rubric_scores.append({"criteria_name": name, "weight": int(weight), "score": score,
+                                  "weighted_score": round(score * int(weight) / 100, 2), "comment": "Ổn"})
+        result = {
+            "rubric_scores": rubric_scores,
+            "question_scores": [
+                {"question_number": number, "max_score": 1, "student_score": 1, "is_correct": True, "feedback": "Tốt"}
+                for number in numbers
+            ],
+            "total_score": round(sum(r["weighted_score"] for r in rubric_scores), 2),
+            "overall_comment": comment,
+            "strengths": ["Trình bày rõ"],
+            "weaknesses": ["Thiếu bước giải"],
+            "improvement_suggestions": "Ôn lại lý thuyết",
+        }
+        return "rubric", json.dumps(result, ensure_ascii=False)
+
+    if '"topic": "<tên chủ đề' in prompt:
+        n = _count(r"Trả về ĐÚNG (\d+) câu hỏi", prompt, 1)
+        items = [{"topic": f"Chủ đề {i + 1}", "question": _filler(rng, 30), "difficulty": "medium"} for i in range(n)]
+        return "recent_test", json.dumps(items, ensure_ascii=False)
+
+    if '"improvement_suggestions"' in prompt:
+        result = {"question": _filler(rng, 40), "answer": comment, "ai_score": 0,
+                  "improvement_suggestions": "Em cần ôn lại phần đã học"}
+        return "performance", json.dumps(result, ensure_ascii=False)
+
+    if '"improve_suggestion"' in prompt:
+        result = {"exercise_question": _filler(rng, 30), "improve_suggestion": comment}
+        return "teacher_feedback", json.dumps(result, ensure_ascii=False)
+
+    if '"criteria_scores"' in prompt:
+        result = {"grade": rng.randint(5, 10), "comments": comment,
+                  "criteria_scores": {"Nội dung": 8, "Phân tích & lập luận": 7,
+                                      "Diễn đạt & ngôn ngữ": 8, "Sáng tạo": 6}}
+        return "essay", json.dumps(result, ensure_ascii=False)
+
+    if '"question": "câu hỏi"' in prompt:
+        result = {"question": _filler(rng, 30), "answer": comment, "difficulty": "easy"}
+        return "question", json.dumps(result, ensure_ascii=False)
+
+    if '"isCorrect"' in prompt:
+        is_correct, score = _verdict(rng)
+        result = {"isCorrect": is_correct, "comments": comment, "score": score}
+        return "grading", json.dumps(result, ensure_ascii=False)
+
+    return "text", comment
+
+
+def apply_schema(content: str, response_format: dict | None) -> str:
+    """
+    Structured output: schema là object nên array ở cấp cao nhất được bọc vào field array duy nhất của schema.
+    """
+    schema = ((response_format or {}).get("json_schema") or {}).get("schema") or {}
+    properties = schema.get("properties") or {}
+    if len(properties) != 1:
+        return content
+    (name, prop), = properties.items()
+    value = json.loads(content)
+    if prop.get("type") == "array" and isinstance(value, list):
+        return json.dumps({name: value}, ensure_ascii=False)
+    return content
+
+
+def malform(text: str, rng: random.Random, structured: bool = False) -> tuple[str, str]:
+    """
+    Làm hỏng JSON theo các kiểu hay gặp ở output thật; trả về (text, finish_reason).
+    Structured output chỉ có thể hỏng do bị cắt ở max_tokens (cùng tỉ lệ cắt cụt như output thường).
+    """
+    kind = rng.choice(("prose", "trailing_comma", "truncated"))
+    if structured and kind != "truncated":
+        return text, "stop"
+    if kind == "prose":
+        return f"Dưới đây là kết quả chấm:\n```json\n{text}\n```\nHy vọng hữu ích!", "stop"
+    if kind == "trailing_comma":
+        return re.sub(r"([}\]])\s*$", r",\1", text), "stop"
+    return text[: max(1, int(len(text) * 0.85))], "length"
+
+
+class PromptCache:
+    """
+    Tiền tố prompt đã gặp (ước lượng 4 ký tự / token); trả về số token đầu prompt trùng với prompt trước.
+    """
+
+    def __init__(self):
+        self._prefixes = {}
+
+    def lookup(self, prompt: str) -> int:
+        cached = 0
+        for tokens in range(_CACHE_MIN_TOKENS, len(prompt) // 4 + 1, _CACHE_STEP_TOKENS):
+            key = hash(prompt[:tokens * 4])
+            if key in self._prefixes:
+                cached = tokens
+            else:
+                self._prefixes[key] = None
+                if len(self._prefixes) > _CACHE_MAX_PREFIXES:
+                    del self._prefixes[next(iter(self._prefixes))]
+        return cached
+
+
+class RateLimitBuckets:
+    """
+    Hạn mức RPM / TPM dạng bucket nạp lại liên tục như OpenAI
+    (token = prompt ước lượng + max_tokens, trừ ngay khi nhận request).
+    """
+
+    def __init__(self, rpm_limit: int, tpm_limit: int):
+        self.limits = {"requests": rpm_limit, "tokens": tpm_limit}
+        self.levels = {"requests": float(rpm_limit), "tokens": float(tpm_limit)}
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        for kind, limit in self.limits.items():
+            self.levels[kind] = min(limit, self.levels[kind] + elapsed * limit / 60.0)
+
+    def admit(self, tokens: int) -> tuple[bool, dict]:
+        self._refill(time.monotonic())
+        cost = {"requests": 1, "tokens": tokens}
+        limited = {kind for kind, limit in self.limits.items() if limit and self.levels[kind] < min(cost[kind], limit)}
+        if not limited:
+            for kind, limit in self.limits.items():
+                if limit:
+                    self.levels[kind] -= min(cost[kind], limit)
+
+        headers = {}
+        for kind, limit in self.limits.items():
+            if limit:
+                level = max(0.0, self.levels[kind])
+                headers.update({
+                    f"x-ratelimit-limit-{kind}": str(limit),
+                    f"x-ratelimit-remaining-{kind}": str(int(level)),
+                    f"x-ratelimit-reset-{kind}": f"{(limit - level) * 60.0 / limit:.3f}s",
+                })
+        if limited:
+            wait = max((min(cost[k], self.limits[k]) - self.levels[k]) * 60.0 / self.limits[k] for k in limited)
+            headers["retry-after-ms"] = str(int(wait * 1000) + 1)
+        return not limited, headers
+
+
+def create_app(config: FakeOpenAIConfig) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(config.seed)
+    sample_latency = parse_latency(config.latency)
+    stats = FakeOpenAIStats()
+    app.state.stats = stats
+    window = RateLimitBuckets(config.rpm_limit, config.tpm_limit)
+    prompt_cache = PromptCache() if config.prompt_cache else None
+
+    def generate(body: dict, prompt: str, images: int):
+        target = max(1, int(rng.gauss(config.completion_tokens, config.completion_tokens * 0.2)))
+        target = min(target, body.get("max_tokens") or target)
+        kind, content = build_reply(prompt, rng, target)
+        stats.by_kind[kind] = stats.by_kind.get(kind, 0) + 1
+        response_format = body.get("response_format") or {}
+        structured = response_format.get("type") == "json_schema"
+        if structured and kind != "text":
+            content = apply_schema(content, response_format)
+        finish_reason = "stop"
+        if kind != "text" and rng.random() < config.malformed_rate:
+            stats.malformed += 1
+            content, finish_reason = malform(content, rng, structured)
+
+        usage = {
+            "prompt_tokens": len(prompt) // 4 + images * _IMAGE_TOKENS,
+            "completion_tokens": max(1, len(content) // 4),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        cached = prompt_cache.lookup(prompt) if prompt_cache is not None else 0
+        usage["prompt_tokens_details"] = {"cached_tokens": cached}
+        stats.prompt_tokens += usage["prompt_tokens"]
+        stats.cached_tokens += cached
+        stats.completion_tokens += usage["completion_tokens"]
+        return kind, content, finish_reason, usage
+
+    def completion(body: dict, content: str, finish_reason: str, usage: dict) -> dict:
+        choice = {"index": 0, "finish_reason": finish_reason, "message": {"role": "assistant", "content": content}}
+        if body.get("logprobs"):
+            choice["logprobs"] = {"content": token_logprobs(content, rng, config.uncertain_rate), "refusal": None}
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [choice],
+            "usage": usage,
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats.requests += 1
+        ttft = sample_latency(rng)
+
+        prompt, images = _message_text(body.get("messages", []))
+        admitted, limit_headers = window.admit(
+            len(prompt) // 4 + images * _IMAGE_TOKENS + (body.get("max_tokens") or 0)
+        )
+        if not admitted:
+            stats.rate_limited += 1
+            error = {"error": {"message": "Rate limit reached (fake)", "type": "requests", "code": "rate_limit_exceeded"}}
+            return JSONResponse(error, status_code=429, headers=limit_headers)
+
+        if rng.random() < config.failure_rate:
+            stats.failures += 1
+            await asyncio.sleep(ttft / 4)
+            status = rng.choice((429, 500))
+            error = {"error": {"message": "fake upstream error", "type": "server_error", "code": str(status)}}
+            return JSONResponse(error, status_code=status)
+
+        kind, content, finish_reason, usage = generate(body, prompt, images)
+        generation = usage["completion_tokens"] / config.tokens_per_second if config.tokens_per_second else 0.0
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = body.get("model", "gpt-4o-mini")
+
+        if body.get("stream"):
+            stats.streams += 1
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+            return StreamingResponse(
+                _stream(completion_id, created, model, content, finish_reason, usage if include_usage else None,
+                        ttft, generation),
+                media_type="text/event-stream",
+                headers=limit_headers,
+            )
+
+        await asyncio.sleep(ttft + generation)
+        return JSONResponse(completion(body, content, finish_reason, usage), headers=limit_headers)
+
+    files, batches = {}, {}
+
+    @app.post("/v1/files")
+    async def upload_file(request: Request):
+        filename, content = _multipart_file(await request.body(), request.headers.get("content-type", ""))
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        files[file_id] = content
+        return {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": "batch"}
+
+    @app.get("/v1/files/{file_id}/content")
+    async def file_content(file_id: str):
+        if file_id not in files:
+            return JSONResponse({"error": {"message": "No such file"}}, status_code=404)
+        return Response(files[file_id], media_type="application/jsonl")
+
+    async def run_batch(batch: dict):
+        await asyncio.sleep(config.batch_latency)
+        lines = []
+        for line in files[batch["input_file_id"]].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            body = item["body"]
+            prompt, images = _message_text(body.get("messages", []))
+            _, content, finish_reason, usage = generate(body, prompt, images)
+            stats.batch_requests += 1
+            lines.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                "custom_id": item["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex,
+                             "body": completion(body, content, finish_reason, usage)},
+                "error": None,
+            }, ensure_ascii=False))
+        output_id = f"file-{uuid.uuid4().hex[:12]}"
+        files[output_id] = ("\n".join(lines) + "\n").encode("utf-8")
+        batch.update(status="completed", output_file_id=output_id, completed_at=int(time.time()),
+                     request_counts={"total": len(lines), "completed": len(lines), "failed": 0})
+
+    @app.post("/v1/batches")
+    async def create_batch(request: Request):
+        body = await request.json()
+        if body.get("input_file_id") not in files:
+            return JSONResponse({"error": {"message": "No such file"}}, status_code=400)
+        stats.batches += 1
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:12]}",
+            "object": "batch",
+            "endpoint": body.get("endpoint"),
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        batches[batch["id"]] = batch
+        asyncio.get_running_loop().create_task(run_batch(batch))
+        return batch
+
+    @app.get("/v1/batches/{batch_id}")
+    async def retrieve_batch(batch_id: str):
+        if batch_id not in batches:
+            return JSONResponse({"error": {"message": "No such batch"}}, status_code=404)
+        return batches[batch_id]
+
+    return app
+
+
+def _multipart_file(body: bytes, content_type: str) -> tuple[str, bytes]:
+    """
+    Lấy phần "file" trong body multipart/form-data (không cần python-multipart).
+    """
+    boundary = re.search(r"boundary=\"?([^\";]+)", content_type).group(1).encode()
+    for part in body.split(b"--" + boundary):
+        head, _, content = part.partition(b"\r\n\r\n")
+        if b'name="file"' in head:
+            filename = re.search(rb'filename="([^"]*)"', head)
+            return (filename.group(1).decode() if filename else "file"), content[:-2]  # bỏ \r\n cuối phần
+    raise ValueError("multipart body không có file")
+
+
+async def _stream(completion_id, created, model, content, finish_reason, usage, ttft, generation):
+    def chunk(delta, finish=None, chunk_usage=None, choices=True):
+        payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                   "choices": [{"index": 0, "delta": delta, "finish_reason": finish}] if choices else []}
+        if chunk_usage is not None:
+            payload["usage"] = chunk_usage
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    await asyncio.sleep(ttft)
+    pieces = [content[i:i + 16] for i in range(0, len(content), 16)] or [""]
+    delay = generation / len(pieces)
+    yield chunk({"role": "assistant", "content": ""})
+    for piece in pieces:
+        if delay:
+            await asyncio.sleep(delay)
+        yield chunk({"content": piece})
+    yield chunk({}, finish=finish_reason)
+    if usage is not None:
+        yield chunk(None, chunk_usage=usage, choices=False)
+    yield "data: [DONE]\n\n"
+
+
+class FakeOpenAIServer(ThreadedServer):
+    """
+    Server giả lập chạy trong thread riêng; base_url dùng cho OPENAI_BASE_URL.
+    """
+
+    def __init__(self, config: FakeOpenAIConfig | None = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeOpenAIConfig()
+        super().__init__(create_app(self.config), host, port)
+
+    @property
+    def openai_base_url(self) -> str:
+        return self.base_url + "/v1"
+
+    @property
+    def stats(self) -> FakeOpenAIStats:
+        return self.app.state.stats
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", default=FakeOpenAIConfig.latency,
+                        help="constant:S | uniform:A:B | lognormal:MEDIAN:SIGMA (giây tới token đầu)")
+    parser.add_argument("--tokens-per-second", type=float, default=FakeOpenAIConfig.tokens_per_second)
+    parser.add_argument("--completion-tokens", type=int, default=FakeOpenAIConfig.completion_tokens)
+    parser.add_argument("--failure-rate", type=float, default=FakeOpenAIConfig.failure_rate)
+    parser.add_argument("--malformed-rate", type=float, default=FakeOpenAIConfig.malformed_rate)
+    parser.add_argument("--rpm-limit", type=int, default=0, help="hạn mức request/phút giả lập (0: tắt)")
+    parser.add_argument("--tpm-limit", type=int, default=0, help="hạn mức token/phút giả lập (0: tắt)")
+    parser.add_argument("--batch-latency", type=float, default=0.0, help="giây từ lúc tạo batch tới khi xong")
+    parser.add_argument("--no-prompt-cache", dest="prompt_cache", action="store_false",
+                        help="tắt giả lập prompt caching (cached_tokens luôn 0)")
+    parser.add_argument("--uncertain-rate", type=float, default=FakeOpenAIConfig.uncertain_rate,
+                        help="tỉ lệ token true/false có logprob thấp (khi request xin logprobs)")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args) -> FakeOpenAIConfig:
+    return FakeOpenAIConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        failure_rate=args.failure_rate,
+        malformed_rate=args.malformed_rate,
+        rpm_limit=args.rpm_limit,
+        tpm_limit=args.tpm_limit,
+        batch_latency=args.batch_latency,
+        prompt_cache=args.prompt_cache,
+        uncertain_rate=args.uncertain_rate,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server OpenAI giả lập")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = FakeOpenAIServer(config_from_args(args), args.host, args.port)
+    print(f"Fake OpenAI at {server.openai_base_url}")
+    server.start()
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+Đo tải toàn bộ API mà không tốn tiền OpenAI / Cloudinary.
+
+- OpenAI: server giả lập (bench.fake_openai_server), trỏ tới bằng OPENAI_BASE_URL
+- Cloudinary: FakeImageHost (IMAGE_HOST=fake) với độ trễ upload cấu hình được
+- File bài làm / ảnh: FakeFileHost
+- App chạy bằng uvicorn trong thread riêng, có bộ đo độ trễ event loop
+
+Chạy từ thư mục gốc của repo:
+    python -m bench.load_test --concurrency 1,8,32 --requests 64 --output bench-results.json
+    python -m bench.load_test --endpoints auto-grading,recent-test-grading --latency constant:0.5
+    python -m bench.load_test --compare bench-results-old.json --output bench-results.json
+
+Mỗi dòng kết quả: p50/p95/p99 latency, requests/giây, tỉ lệ thành công, độ trễ event loop
+và tỉ lệ token prompt lấy từ prompt cache (giả lập) theo từng endpoint x mức đồng thời. File JSON kèm commit hiện tại để so sánh giữa các commit.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from bench.fake_file_host import FakeFileHost
+from bench.fake_openai_server import FakeOpenAIServer, add_arguments, config_from_args
+from bench.threaded_server import ThreadedServer
+
+SUBJECTS = ("math", "van", "english", "physics", "chemistry", "biology", "geography", "history", "civics", "informatics")
+COMMON_TOPICS = ("Phương trình bậc nhất", "Hệ phương trình", "Định lý Pythagore", "Tỉ lệ thức")
+_ANSWER_FILE = "Bài làm: 2x + 3 = 13 => 2x = 10 => x = 5".encode("utf-8")
+
+
+def _subject(i: int) -> str:
+    return SUBJECTS[i % len(SUBJECTS)]
+
+
+def _questions(i: int, n: int) -> list:
+    return [
+        {"question": f"Câu {k + 1} của bài {i}", "student_answer": f"Đáp án {k}", "topic": "Phương trình",
+         "difficulty": "medium"}
+        for k in range(n)
+    ]
+
+
+def build_endpoints(file_url: str, image_urls: list) -> dict:
+    """
+    name -> (method, path, hàm sinh payload theo chỉ số request)
+    """
+    return {
+        "auto-grading": ("POST", "/auto-grading", lambda i: {
+            "exercise_question": "Giải phương trình 2x + 3 = 13", "subject": _subject(i),
+            "student_answer": f"x = 5 (bài {i})"}),
+        "auto-grading-batch": ("POST", "/auto-grading/batch", lambda i: {
+            "items": [{"exercise_question": "Giải phương trình 2x + 3 = 13", "subject": _subject(i + k),
+                       "student_answer": f"x = {k} (bài {i})"} for k in range(10)]}),
+        "auto-grading-file": ("POST", "/auto-grading/file", lambda i: {
+            "exercise_question": "Giải phương trình 2x + 3 = 13", "subject": _subject(i), "fileUrl": file_url}),
+        "auto-grading-image": ("POST", "/auto-grading/image", lambda i: {
+            "exercise_question": "Giải phương trình 2x + 3 = 13", "subject": "math",
+            "fileUrl": image_urls[i % len(image_urls)]}),
+        # Bài ba trang: các trang được tiếp nhận song song và chấm trong một lời gọi vision
+        "auto-grading-image-pages": ("POST", "/auto-grading/image", lambda i: {
+            "exercise_question": "Giải phương trình 2x + 3 = 13", "subject": "math",
+            "fileUrls": [image_urls[(i + k) % len(image_urls)] for k in range(3)]}),
+        "grade-essay": ("POST", "/grade-essay", lambda i: {
+            "exercise_question": "Phân tích bài thơ Sang thu", "subject": "van",
+            "student_answer": "Bài thơ thể hiện cảm nhận tinh tế về thời khắc giao mùa. " * 20 + str(i)}),
+        "generate-question": ("POST", "/generate_question", lambda i: {
+            "prompt": f"Phương trình bậc nhất ({i})", "subject": _subject(i)}),
+        # Chủ đề lặp lại giữa các học sinh: phần lớn request được phục vụ từ ngân hàng câu hỏi
+        "generate-question-common": ("POST", "/generate_question", lambda i: {
+            "prompt": COMMON_TOPICS[i % len(COMMON_TOPICS)], "subject": "math", "student_id": f"hs-{i}"}),
+        "recent-test": ("POST", "/recent-test", lambda i: {
+            "recent_tests": [{"title": f"Bài kiểm tra {k}", "score": 6} for k in range(5)],
+            "questionTypes": ["Tự luận"], "subject": _subject(i)}),
+        "recent-test-stream": ("POST", "/recent-test?stream=true", lambda i: {
+            "recent_tests": [{"title": f"Bài kiểm tra {k}", "score": 6} for k in range(5)],
+            "questionTypes": ["Tự luận"], "subject": _subject(i)}),
+        "recent-test-grading": ("POST", "/recent-test-grading", lambda i: {
+            "subject": _subject(i), "questions": _questions(i, 10)}),
+        "recent-test-grading-stream": ("POST", "/recent-test-grading?stream=true", lambda i: {
+            "subject": _subject(i), "questions": _questions(i, 10)}),
+        "grade-with-rubric": ("POST", "/grade-with-rubric", lambda i: {
+            "test_title": f"Kiểm tra 15 phút ({i})", "subject": _subject(i),
+            "questions_and_answers": [
+                {"question": f"Câu {k}", "questionType": "essay", "solution": "x = 5", "grade": 1,
+                 "studentAnswer": "x = 5", "isCorrect": True} for k in range(5)],
+            "rubric_criteria": [{"name": "Độ chính xác", "weight": 60}, {"name": "Trình bày", "weight": 40}]}),
+        "analyze-teacher-feedback": ("POST", "/analyze-teacher-feedback", lambda i: {
+            "teacher_comment": f"Em cần cẩn thận hơn khi chuyển vế ({i})", "subject": _subject(i),
+            "lesson": "Phương trình bậc nhất", "test_answers": [{"question": "2x = 4", "answer": "x = 2"}]}),
+        "performance-question": ("POST", "/performance/question-generation", lambda i: {
+            "subject": _subject(i),
+            "recent_tests": [{"subject": _subject(i), "title": f"Chương 1, Bài {k}", "score": 4 + k,
+                              "submissionTime": "2024-01-01"} for k in range(3)]}),
+        "generate": ("POST", "/generate", lambda i: {"prompt": f"Giới thiệu về truyện Kiều ({i})"}),
+        "health": ("GET", "/health", None),
+    }
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """
+    Percentile theo nearest-rank trên danh sách đã sắp xếp.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), round(q / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[rank - 1]
+
+
+def _is_success(response: httpx.Response) -> bool:
+    if response.status_code != 200:
+        return False
+    if response.headers.get("content-type", "").startswith("text/event-stream"):
+        return "event: result" in response.text and "event: error" not in response.text
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    return not isinstance(body, dict) or body.get("success", True) is not False
+
+
+async def run_level(client, endpoint, concurrency: int, total: int, app_server: ThreadedServer) -> dict:
+    method, path, payload = endpoint
+    latencies, failures, errors = [], 0, {}
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal failures
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                if method == "GET":
+                    response = await client.get(path)
+                else:
+                    response = await client.post(path, json=payload(i))
+                ok = _is_success(response)
+                if not ok:
+                    key = str(response.status_code)
+                    errors[key] = errors.get(key, 0) + 1
+            except httpx.HTTPError as e:
+                ok = False
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                failures += 1
+
+    app_server.lag_samples.clear()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    lag = sorted(app_server.lag_samples)
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "failures": failures,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 1),
+            "p95": round(percentile(latencies, 95) * 1000, 1),
+            "p99": round(percentile(latencies, 99) * 1000, 1),
+            "max": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        },
+        "loop_lag_ms": {
+            "p50": round(percentile(lag, 50) * 1000, 2),
+            "p99": round(percentile(lag, 99) * 1000, 2),
+            "max": round(lag[-1] * 1000, 2) if lag else 0.0,
+        },
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _sample_images(count: int) -> dict:
+    try:
+        from bench.bench_image_preprocess import synthetic_scan
+    except ImportError:  # chưa cài Pillow: ảnh giả không decode được, app gửi URL như cũ
+        return {f"/scan-{i}.jpg": (b"\xff\xd8 not a real jpeg", "image/jpeg") for i in range(count)}
+    return {f"/scan-{i}.jpg": (synthetic_scan(i), "image/jpeg") for i in range(count)}
+
+
+def print_report(rows: list, baseline: dict | None):
+    header = (f"{'endpoint':28} {'conc':>5} {'req':>5} {'fail':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} "
+              f"{'lag p99':>8} {'cached':>7}")
+    if baseline:
+        header += f" {'Δp50':>8} {'Δrps':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        line = (f"{r['endpoint']:28} {r['concurrency']:>5} {r['requests']:>5} {r['failures']:>5} {r['rps']:>8.1f} "
+                f"{r['latency_ms']['p50']:>8.1f} {r['latency_ms']['p95']:>8.1f} {r['latency_ms']['p99']:>8.1f} "
+                f"{r['loop_lag_ms']['p99']:>8.2f} {r.get('cached_ratio', 0):>7.0%}")
+        old = (baseline or {}).get((r["endpoint"], r["concurrency"]))
+        if old is not None:
+            line += f" {r['latency_ms']['p50'] - old['latency_ms']['p50']:>+8.1f} {r['rps'] - old['rps']:>+8.1f}"
+        print(line)
+
+
+def load_baseline(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    print(f"So sánh với {path} (commit {data.get('commit')})")
+    return {(r["endpoint"], r["concurrency"]): r for r in data["results"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", help="danh sách endpoint, phân tách bằng dấu phẩy (mặc định: tất cả)")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=64, help="số request mỗi endpoint x mức đồng thời")
+    parser.add_argument("--cloudinary-latency-ms", type=float, default=300.0)
+    parser.add_argument("--file-latency-ms", type=float, default=20.0)
+    parser.add_argument("--response-cache", default="none", help="RESPONSE_CACHE_BACKEND cho app")
+    parser.add_argument("--probe-interval-ms", type=float, default=10.0)
+    parser.add_argument("--output", help="ghi kết quả ra file JSON")
+    parser.add_argument("--compare", help="file JSON kết quả cũ để so sánh")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(",")]
+    baseline = load_baseline(args.compare) if args.compare else None
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            FakeOpenAIServer(config_from_args(args)) as openai_server, \
+            FakeFileHost({"/bai-lam.txt": (_ANSWER_FILE, "text/plain; charset=utf-8")},
+                         latency=args.file_latency_ms / 1000) as file_host:
+        for path, (content, content_type) in _sample_images(4).items():
+            file_host.add_file(path, content, content_type)
+
+        # Cấu hình app trước khi import main
+        os.environ.update({
+            "OPENAI_BASE_URL": openai_server.openai_base_url,
+            "OPENAI_API_KEY": "bench",
+            "RESPONSE_CACHE_BACKEND": args.response_cache,
+            "RESPONSE_CACHE_PATH": str(Path(tmp) / "response_cache.sqlite3"),
+            "IMAGE_HOST": "fake",
+            "IMAGE_INGEST_CACHE_PATH": str(Path(tmp) / "image_ingest.sqlite3"),
+            "QUESTION_BANK_PATH": str(Path(tmp) / "question_bank.sqlite3"),
+            "QUESTION_BANK_REFILL": "0",
+        })
+        sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+        import main as app_module
+
+        app_module.app.state.services.image_ingestor.host.latency = args.cloudinary_latency_ms / 1000
+
+        endpoints = build_endpoints(file_host.url("/bai-lam.txt"),
+                                    [file_host.url(p) for p in file_host.files if p.startswith("/scan-")])
+        selected = args.endpoints.split(",") if args.endpoints else list(endpoints)
+
+        rows = []
+        with ThreadedServer(app_module.app, probe_interval=args.probe_interval_ms / 1000) as app_server:
+            async def run_all():
+                limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+                async with httpx.AsyncClient(base_url=app_server.base_url, limits=limits, timeout=300) as client:
+                    for name in selected:
+                        for level in levels:
+                            stats = openai_server.stats
+                            before = (stats.requests, stats.prompt_tokens, stats.cached_tokens)
+                            row = await run_level(client, endpoints[name], level, max(args.requests, level),
+                                                  app_server)
+                            prompt_tokens = stats.prompt_tokens - before[1]
+                            cached_tokens = stats.cached_tokens - before[2]
+                            row = {"endpoint": name, **row,
+                                   "model_calls": stats.requests - before[0],
+                                   "prompt_tokens": prompt_tokens,
+                                   "cached_tokens": cached_tokens,
+                                   "cached_ratio": round(cached_tokens / prompt_tokens, 3) if prompt_tokens else 0.0}
+                            rows.append(row)
+                            print(f"  {name} x{level}: p50 {row['latency_ms']['p50']} ms, {row['rps']} rps",
+                                  file=sys.stderr)
+
+            asyncio.run(run_all())
+
+        result = {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": vars(args),
+            "fake_openai": openai_server.stats.as_dict(),
+            "llm_scheduler": app_module.app.state.services.llm.scheduler.stats(),
+            "results": rows,
+        }
+
+    print_report(rows, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Chạy một ASGI app bằng uvicorn trong thread riêng (event loop riêng) cho benchmark.
+Có thể gắn bộ đo độ trễ event loop: một task ngủ đều đặn và ghi lại phần bị trễ so với lịch.
+"""
+import asyncio
+import socket
+import threading
+import time
+
+import uvicorn
+
+
+class ThreadedServer:
+    def __init__(self, app, host: str = "127.0.0.1", port: int = 0, probe_interval: float | None = None):
+        self.app = app
+        self.host = host
+        self.probe_interval = probe_interval
+        self.lag_samples = []  # giây, mỗi lần đo một mẫu
+        self.loop = None
+        # proto=IPPROTO_TCP để asyncio bật TCP_NODELAY cho kết nối nhận vào
+        # (proto=0 thì bị Nagle + delayed ACK làm chậm ~40 ms mỗi request)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((host, port))
+        self.port = self._socket.getsockname()[1]
+        self._server = uvicorn.Server(uvicorn.Config(app, log_level="warning", lifespan="on", access_log=False))
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def _probe(self):
+        interval = self.probe_interval
+        while True:
+            start = self.loop.time()
+            await asyncio.sleep(interval)
+            self.lag_samples.append(max(0.0, self.loop.time() - start - interval))
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        probe = self.loop.create_task(self._probe()) if self.probe_interval else None
+        try:
+            self.loop.run_until_complete(self._server.serve(sockets=[self._socket]))
+        finally:
+            if probe is not None:
+                probe.cancel()
+                self.loop.run_until_complete(asyncio.gather(probe, return_exceptions=True))
+            self.loop.close()
+
+    def start(self, timeout: float = 10.0):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError(f"Không khởi động được server tại {self.base_url}")
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self._server.should_exit = True
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self._socket.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,433 @@
+"""
+Chạy hàng loạt ngoại tuyến cho /performance/question-generation (câu luyện tập mỗi đêm cho từng học sinh).
+Đầu vào: file JSONL, mỗi dòng một PerformanceQuestionRequest (thêm "id" tùy ý để đối chiếu).
+Đầu ra: file JSONL, mỗi dòng {"line", "id", "student_id", ...response như endpoint}, ghi ngay khi xong từng dòng
+(thứ tự theo lúc xong, không theo đầu vào). Chạy lại với cùng file đầu ra thì bỏ qua các dòng đã có kết quả.
+
+Chạy từ thư mục gốc của repo:
+    python -m bulk run students.jsonl results.jsonl --concurrency 16
+    python -m bulk batch students.jsonl results.jsonl            # Batch API của OpenAI: giá 50%, xong trong 24h
+    python -m bulk batch-prepare students.jsonl batch-input.jsonl
+    python -m bulk batch-collect students.jsonl batch-output.jsonl results.jsonl
+
+Với server giả lập: OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=bench python -m bulk run ...
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+from pydantic import ValidationError
+
+from config import load_env
+import main
+from metrics import request_scope
+from question_bank import bank_bucket
+from scheduler import PRIORITY_BULK, priority_scope
+from services import Services
+from subjects import SUPPORTED_SUBJECTS, resolve_subject
+
+load_env()
+
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "16"))
+BULK_PROGRESS_SECONDS = float(os.getenv("BULK_PROGRESS_SECONDS", "10"))
+# Batch API: tối đa 50.000 request mỗi file, trả kết quả trong completion window
+BULK_BATCH_MAX_REQUESTS = int(os.getenv("BULK_BATCH_MAX_REQUESTS", "50000"))
+BULK_BATCH_POLL_SECONDS = float(os.getenv("BULK_BATCH_POLL_SECONDS", "60"))
+BULK_BATCH_COMPLETION_WINDOW = os.getenv("BULK_BATCH_COMPLETION_WINDOW", "24h")
+
+_ENDPOINT_LABEL = "/bulk/performance-question"
+_BATCH_DONE = {"completed", "failed", "expired", "cancelled"}
+
+
+def read_records(path):
+    """
+    (số dòng tính từ 1, record) cho từng dòng không rỗng; dòng không phải JSON cho record None.
+    """
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = None
+            yield number, record
+
+
+def completed_lines(path, retry_failed: bool = False) -> set[int]:
+    """
+    Các dòng đầu vào đã có kết quả trong file đầu ra. Dòng ghi dở (process bị dừng giữa chừng) bị cắt bỏ.
+    retry_failed: dòng lỗi được chạy lại; kết quả mới ghi thêm vào cuối, dòng sau thay cho dòng trước cùng "line".
+    """
+    path = Path(path)
+    if not path.exists():
+        return set()
+    data = path.read_bytes()
+    end = data.rfind(b"\n") + 1
+    if end < len(data):
+        with open(path, "r+b") as f:
+            f.truncate(end)
+    done = set()
+    for line in data[:end].decode("utf-8").splitlines():
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if item.get("success") or not retry_failed:
+            done.add(item["line"])
+        else:
+            done.discard(item["line"])
+    return done
+
+
+def parse_request(record):
+    """
+    (request, config, None) nếu record hợp lệ, ngược lại (None, None, response lỗi như endpoint).
+    """
+    if not isinstance(record, dict):
+        return None, None, {"success": False, "error": "Dòng không phải JSON object"}
+    try:
+        request = main.PerformanceQuestionRequest.model_validate(record)
+    except ValidationError as e:
+        return None, None, {"success": False, "error": str(e)}
+    config = resolve_subject(request.subject)
+    if config is None:
+        return None, None, {
+            "success": False,
+            "error": f"Môn học '{request.subject}' không hợp lệ. Các môn học hỗ trợ: {SUPPORTED_SUBJECTS}",
+            "subject": request.subject
+        }
+    return request, config, None
+
+
+class BulkReport:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.processed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.sources = {}
+
+    def add(self, response: dict):
+        self.processed += 1
+        if response.get("success"):
+            self.succeeded += 1
+            source = response.get("source", "model")
+            self.sources[source] = self.sources.get(source, 0) + 1
+        else:
+            self.failed += 1
+
+    def summary(self) -> dict:
+        seconds = time.perf_counter() - self.start
+        return {
+            "processed": self.processed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "sources": self.sources,
+            "seconds": round(seconds, 2),
+            "per_second": round(self.processed / seconds, 2) if seconds else 0.0,
+        }
+
+
+class ResultWriter:
+    """
+    Ghi thêm từng kết quả vào file JSONL và flush ngay, để dừng giữa chừng vẫn giữ được phần đã xong.
+    """
+
+    def __init__(self, path, report: BulkReport):
+        self.report = report
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, number: int, record, response: dict):
+        record = record if isinstance(record, dict) else {}
+        line = {"line": number, "id": record.get("id"), "student_id": record.get("student_id"), **response}
+        self._file.write(json.dumps(line, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.report.add(response)
+
+    def close(self):
+        self._file.close()
+
+
+async def _print_progress(report: BulkReport, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        print(f"bulk: {json.dumps(report.summary(), ensure_ascii=False)}", file=sys.stderr)
+
+
+async def generate_one(services: Services, record) -> dict:
+    """
+    Một record -> response giống hệt /performance/question-generation (kể cả lấy từ ngân hàng câu hỏi).
+    """
+    request, _, error = parse_request(record)
+    if error is not None:
+        return error
+    with request_scope(_ENDPOINT_LABEL), priority_scope(PRIORITY_BULK):
+        return await main.performance_question_generation(request, services)
+
+
+async def run_bulk(services: Services, input_path, output_path, concurrency: int = BULK_CONCURRENCY,
+                   retry_failed: bool = False, progress_seconds: float = BULK_PROGRESS_SECONDS) -> dict:
+    """
+    Gọi model trực tiếp cho từng dòng, tối đa concurrency dòng cùng lúc. Trả về thống kê (số dòng, dòng/giây).
+    """
+    done = completed_lines(output_path, retry_failed)
+    report = BulkReport()
+    writer = ResultWriter(output_path, report)
+
+    def pending():
+        for number, record in read_records(input_path):
+            if number in done:
+                report.skipped += 1
+            else:
+                yield number, record
+
+    records = pending()
+
+    async def worker():
+        for number, record in records:
+            try:
+                response = await generate_one(services, record)
+            except Exception as e:
+                response = {"success": False, "error": str(e)}
+            writer.write(number, record, response)
+
+    reporter = asyncio.get_running_loop().create_task(_print_progress(report, progress_seconds))
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        reporter.cancel()
+        writer.close()
+    return report.summary()
+
+
+def _part_path(path: Path, index: int) -> Path:
+    return path if index == 0 else path.with_name(f"{path.stem}-{index + 1}{path.suffix}")
+
+
+def prepare_batches(input_path, batch_path, done: set[int] = frozenset(), writer: ResultWriter | None = None,
+                    max_requests: int = BULK_BATCH_MAX_REQUESTS) -> list[Path]:
+    """
+    Ghi file đầu vào cho Batch API (mỗi dòng một lời gọi chat completions, custom_id = "line-N").
+    Quá max_requests thì tách thành batch-2.jsonl, batch-3.jsonl, ...
+    Dòng không hợp lệ được ghi thẳng vào writer (nếu có) dưới dạng lỗi.
+    """
+    batch_path = Path(batch_path)
+    parts, out, count = [], None, 0
+    try:
+        for number, record in read_records(input_path):
+            if number in done:
+                continue
+            request, config, error = parse_request(record)
+            if error is not None:
+                if writer is not None:
+                    writer.write(number, record, error)
+                continue
+            if out is None or count >= max_requests:
+                if out is not None:
+                    out.close()
+                parts.append(_part_path(batch_path, len(parts)))
+                out, count = open(parts[-1], "w", encoding="utf-8"), 0
+            prompt, *_ = main._performance_prompt(request, config)
+            out.write(json.dumps({
+                "custom_id": f"line-{number}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": main._performance_question_params(config, prompt),
+            }, ensure_ascii=False) + "\n")
+            count += 1
+    finally:
+        if out is not None:
+            out.close()
+    return parts
+
+
+def _batch_outputs(lines) -> dict[int, dict]:
+    """
+    {số dòng: response chat completion hoặc {"error": ...}} từ file output / error của Batch API.
+    """
+    outputs = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        number = int(item["custom_id"].removeprefix("line-"))
+        response = item.get("response") or {}
+        if item.get("error") or response.get("status_code") != 200:
+            error = item.get("error") or (response.get("body") or {}).get("error") or response
+            outputs[number] = {"error": error.get("message", str(error)) if isinstance(error, dict) else str(error)}
+        else:
+            outputs[number] = response["body"]
+    return outputs
+
+
+async def collect_batch(services: Services, input_path, batch_lines, output_path,
+                        retry_failed: bool = False) -> dict:
+    """
+    Đọc kết quả Batch API, ghi response như endpoint (source = "batch") vào file đầu ra
+    và lưu câu hỏi vào ngân hàng như khi gọi model trực tiếp.
+    retry_failed: batch gửi lại cả các dòng lỗi (như prepare_batches), kết quả mới của các dòng đó được ghi thêm.
+    """
+    outputs = _batch_outputs(batch_lines)
+    done = completed_lines(output_path, retry_failed)
+    report = BulkReport()
+    writer = ResultWriter(output_path, report)
+    entries = []
+    try:
+        for number, record in read_records(input_path):
+            if number not in outputs or number in done:
+                continue
+            request, config, error = parse_request(record)
+            output = outputs[number]
+            if error is None and "error" in output:
+                error = {"success": False, "error": output["error"], "subject": request.subject}
+            if error is not None:
+                writer.write(number, record, error)
+                continue
+            _, avg_score, topic, level = main._performance_prompt(request, config)
+            result = main._parse_performance_question(output["choices"][0]["message"]["content"])
+            if result is not None:
+                entries.append((bank_bucket("performance", config.key, topic, difficulty=level), result,
+                                request.student_id))
+            writer.write(number, record, main._performance_question_response(request, result, avg_score, "batch"))
+    finally:
+        writer.close()
+
+    bank = services.question_bank
+    if bank is not None:
+        for bucket, result, student_id in entries:
+            await bank.add([(bucket, result)], student_id)
+    return report.summary()
+
+
+def _load_state(path: Path) -> dict | None:
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_state(path: Path, state: dict):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+async def run_batch(services: Services, input_path, output_path, poll_seconds: float = BULK_BATCH_POLL_SECONDS,
+                    retry_failed: bool = False) -> dict:
+    """
+    Tạo file batch, upload và tạo batch trên OpenAI, chờ xong rồi ghi kết quả.
+    Id các batch đã tạo được lưu trong <output>.batch.json: chạy lại lệnh sẽ tiếp tục chờ đúng các batch đó
+    thay vì gửi lại. Dòng không có kết quả (batch hết hạn / lỗi) được gửi lại ở lần chạy sau.
+    """
+    output_path = Path(output_path)
+    state_path = output_path.with_name(output_path.name + ".batch.json")
+    client = services.llm.client
+    start = time.perf_counter()
+
+    summary = {"batches": 0, "processed": 0, "succeeded": 0, "failed": 0}
+    state = _load_state(state_path)
+    if state is None:
+        report = BulkReport()
+        writer = ResultWriter(output_path, report)
+        try:
+            parts = prepare_batches(input_path, output_path.with_name(output_path.stem + ".batch-input.jsonl"),
+                                    completed_lines(output_path, retry_failed), writer)
+        finally:
+            writer.close()
+        summary["processed"], summary["failed"] = report.processed, report.failed  # dòng không hợp lệ
+        # Lưu cùng id batch: chạy tiếp (không có --retry-failed) vẫn ghi kết quả mới của các dòng lỗi đã gửi lại
+        state = {"batches": [], "retry_failed": retry_failed}
+        for part in parts:
+            uploaded = await client.files.create(file=(part.name, part.read_bytes()), purpose="batch")
+            batch = await client.batches.create(input_file_id=uploaded.id, endpoint="/v1/chat/completions",
+                                                completion_window=BULK_BATCH_COMPLETION_WINDOW)
+            state["batches"].append({"id": batch.id, "input_file": str(part), "collected": False})
+            _save_state(state_path, state)
+            print(f"bulk: batch {batch.id} ({part})", file=sys.stderr)
+
+    summary["batches"] = len(state["batches"])
+    for entry in state["batches"]:
+        if entry["collected"]:
+            continue
+        batch = await client.batches.retrieve(entry["id"])
+        while batch.status not in _BATCH_DONE:
+            counts = batch.request_counts
+            print(f"bulk: batch {batch.id} {batch.status}"
+                  f" ({counts.completed if counts else 0}/{counts.total if counts else '?'})", file=sys.stderr)
+            await asyncio.sleep(poll_seconds)
+            batch = await client.batches.retrieve(entry["id"])
+
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines += (await client.files.content(file_id)).text.splitlines()
+        collected = await collect_batch(services, input_path, lines, output_path,
+                                        state.get("retry_failed", retry_failed))
+        for key in ("processed", "succeeded", "failed"):
+            summary[key] += collected[key]
+        entry.update(collected=True, status=batch.status)
+        _save_state(state_path, state)
+
+    state_path.unlink(missing_ok=True)
+    summary["seconds"] = round(time.perf_counter() - start, 2)
+    return summary
+
+
+async def _main(args) -> dict | None:
+    services = Services()
+    try:
+        if args.command == "run":
+            return await run_bulk(services, args.input, args.output, args.concurrency, args.retry_failed)
+        if args.command == "batch":
+            return await run_batch(services, args.input, args.output, args.poll_seconds, args.retry_failed)
+        if args.command == "batch-collect":
+            with open(args.batch_output, encoding="utf-8") as f:
+                return await collect_batch(services, args.input, f.read().splitlines(), args.output,
+                                           args.retry_failed)
+        parts = prepare_batches(args.input, args.batch_input)
+        return {"files": [str(p) for p in parts]}
+    finally:
+        await services.aclose()
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="gọi model trực tiếp, giới hạn số dòng chạy đồng thời")
+    run.add_argument("input")
+    run.add_argument("output")
+    run.add_argument("--concurrency", type=int, default=BULK_CONCURRENCY)
+    run.add_argument("--retry-failed", action="store_true", help="chạy lại các dòng đã có kết quả lỗi")
+
+    batch = commands.add_parser("batch", help="gửi qua Batch API, chờ xong rồi ghi kết quả")
+    batch.add_argument("input")
+    batch.add_argument("output")
+    batch.add_argument("--poll-seconds", type=float, default=BULK_BATCH_POLL_SECONDS)
+    batch.add_argument("--retry-failed", action="store_true", help="gửi lại các dòng đã có kết quả lỗi")
+
+    prepare = commands.add_parser("batch-prepare", help="chỉ tạo file đầu vào cho Batch API")
+    prepare.add_argument("input")
+    prepare.add_argument("batch_input")
+
+    collect = commands.add_parser("batch-collect", help="ghi kết quả từ file output của Batch API")
+    collect.add_argument("input")
+    collect.add_argument("batch_output")
+    collect.add_argument("output")
+    collect.add_argument("--retry-failed", action="store_true", help="ghi kết quả mới cho các dòng đã có kết quả lỗi")
+
+    args = parser.parse_args()
+    summary = asyncio.run(_main(args))
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    cli()
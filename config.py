@@ -0,0 +1,16 @@
+"""
+Nạp .env cho mọi module đọc cấu hình từ biến môi trường.
+Các module đọc cấu hình thành hằng số ngay lúc import, nên phải gọi load_env() trước phần hằng số đó
+(chỉ nạp một lần; biến đã có trong môi trường thật được giữ nguyên, .env không ghi đè).
+"""
+import os
+from functools import lru_cache
+
+from dotenv import find_dotenv, load_dotenv
+
+
+@lru_cache(maxsize=None)
+def load_env() -> bool:
+    # .env ở thư mục chạy (hoặc thư mục cha), không có thì .env cạnh mã nguồn
+    path = find_dotenv(usecwd=True) or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+    return load_dotenv(path)
@@ -0,0 +1,272 @@
+"""
+Tiếp nhận file bài làm cho /auto-grading/file.
+- Nhận dạng định dạng từ nội dung file (magic bytes), không tin phần mở rộng / Content-Type
+- Text thường: giải mã như trước; DOCX / PDF: tách text trong process pool (mỗi file một lời gọi, file chỉ
+  được parse một lần), PDF đọc lần lượt từng trang và dừng khi đã đủ DOCUMENT_MAX_CHARS ký tự
+- PDF scan (gần như không có text) và file ảnh: trả về ảnh từng trang để chấm bằng vision model
+- Text đã tách được cache trong SQLite theo hash nội dung: chấm lại cùng file không phải tách lại
+pypdf là phụ thuộc tùy chọn: không cài thì file PDF bị từ chối với thông báo rõ ràng.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import os
+import re
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from xml.etree import ElementTree
+
+from config import load_env
+from response_cache import SQLiteCacheBackend
+
+try:
+    import pypdf
+except ImportError:  # pragma: no cover - pypdf không bắt buộc
+    pypdf = None
+
+load_env()
+
+# File bài làm (kể cả PDF scan nhiều trang) được tải tối đa chừng này byte
+DOCUMENT_MAX_BYTES = int(os.getenv("DOCUMENT_MAX_BYTES", str(20 * 1024 * 1024)))
+# Dừng tách text khi đã đủ số ký tự này (PromptBudget cắt tiếp theo ngân sách token)
+DOCUMENT_MAX_CHARS = int(os.getenv("DOCUMENT_MAX_CHARS", "100000"))
+# PDF có trung bình ít hơn chừng này ký tự mỗi trang (tính trên tối đa DOCUMENT_SCANNED_SAMPLE_PAGES trang đầu)
+# được coi là bản scan
+DOCUMENT_SCANNED_SAMPLE_PAGES = int(os.getenv("DOCUMENT_SCANNED_SAMPLE_PAGES", "8"))
+DOCUMENT_SCANNED_MIN_CHARS_PER_PAGE = int(os.getenv("DOCUMENT_SCANNED_MIN_CHARS_PER_PAGE", "20"))
+# Số trang ảnh tối đa gửi cho vision model với PDF scan
+DOCUMENT_SCANNED_MAX_PAGES = int(os.getenv("DOCUMENT_SCANNED_MAX_PAGES", "10"))
+DOCUMENT_INGEST_WORKERS = int(os.getenv("DOCUMENT_INGEST_WORKERS", str(min(2, os.cpu_count() or 1))))
+DOCUMENT_TEXT_CACHE = os.getenv("DOCUMENT_TEXT_CACHE", "1").lower() not in ("0", "false", "no")
+DOCUMENT_TEXT_CACHE_PATH = os.getenv("DOCUMENT_TEXT_CACHE_PATH", "document_text.sqlite3")
+DOCUMENT_TEXT_CACHE_TTL_SECONDS = float(os.getenv("DOCUMENT_TEXT_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+TEXT, PDF, DOCX, IMAGE, UNSUPPORTED = "text", "pdf", "docx", "image", "unsupported"
+
+_IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+# File Office cũ (.doc, .xls) và các định dạng nén / nhị phân thường gặp khác
+_BINARY_SIGNATURES = (b"\xd0\xcf\x11\xe0", b"Rar!", b"7z\xbc\xaf", b"\x1f\x8b")
+_WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+class UnsupportedDocumentError(ValueError):
+    pass
+
+
+def image_media_type(content: bytes) -> str | None:
+    for signature, media_type in _IMAGE_SIGNATURES:
+        if content.startswith(signature):
+            return media_type
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def sniff_format(content: bytes) -> str:
+    """
+    Định dạng file theo nội dung: pdf, docx, image, text hoặc unsupported.
+    """
+    head = content[:1024]
+    if b"%PDF-" in head:
+        return PDF
+    if content.startswith(b"PK\x03\x04"):
+        try:
+            with zipfile.ZipFile(io.BytesIO(content)) as archive:
+                return DOCX if "word/document.xml" in archive.namelist() else UNSUPPORTED
+        except zipfile.BadZipFile:
+            return UNSUPPORTED
+    if image_media_type(content) is not None:
+        return IMAGE
+    if content.startswith(_BINARY_SIGNATURES):
+        return UNSUPPORTED
+    # Text: không có byte NUL (trừ UTF-16 có BOM)
+    if b"\x00" in head and not content.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return UNSUPPORTED
+    return TEXT
+
+
+def extract_docx_text(content: bytes, max_chars: int = DOCUMENT_MAX_CHARS) -> str:
+    """
+    Hàm chạy trong process con: text các đoạn của word/document.xml (kể cả trong bảng), mỗi đoạn một dòng.
+    """
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        root = ElementTree.fromstring(archive.read("word/document.xml"))
+    paragraphs, chars = [], 0
+    for paragraph in root.iter(f"{_WORD_NAMESPACE}p"):
+        parts = []
+        for node in paragraph.iter():
+            if node.tag == f"{_WORD_NAMESPACE}t" and node.text:
+                parts.append(node.text)
+            elif node.tag == f"{_WORD_NAMESPACE}tab":
+                parts.append("\t")
+            elif node.tag in (f"{_WORD_NAMESPACE}br", f"{_WORD_NAMESPACE}cr"):
+                parts.append("\n")
+        text = "".join(parts)
+        paragraphs.append(text)
+        chars += len(text) + 1
+        if chars >= max_chars:
+            break
+    return "\n".join(paragraphs).strip()
+
+
+def _page_images(reader, max_pages: int) -> list[bytes]:
+    # Ảnh lớn nhất của từng trang (bản scan thường là một ảnh mỗi trang); trang không có ảnh bị bỏ qua
+    images = []
+    for page in reader.pages[:max_pages]:
+        page_images = [image.data for image in page.images]
+        if page_images:
+            images.append(max(page_images, key=len))
+    return images
+
+
+def extract_pdf(content: bytes, max_chars: int = DOCUMENT_MAX_CHARS,
+                sample_pages: int = DOCUMENT_SCANNED_SAMPLE_PAGES,
+                min_chars_per_page: int = DOCUMENT_SCANNED_MIN_CHARS_PER_PAGE,
+                scanned_max_pages: int = DOCUMENT_SCANNED_MAX_PAGES) -> dict:
+    """
+    Hàm chạy trong process con, parse file một lần: tách text lần lượt từng trang, dừng khi đủ max_chars.
+    Nếu các trang đầu gần như không có text thì đây là bản scan: trả về ảnh của các trang (text = None).
+    """
+    reader = pypdf.PdfReader(io.BytesIO(content))
+    total = len(reader.pages)
+    texts, chars = [], 0
+    for page in reader.pages:
+        text = _normalize(page.extract_text() or "")
+        texts.append(text)
+        chars += len(text)
+        if len(texts) == min(sample_pages, total) and chars < min_chars_per_page * len(texts):
+            images = _page_images(reader, scanned_max_pages)
+            return {"text": None, "images": images, "pages_read": len(images), "total_pages": total,
+                    "truncated": False}
+        if chars >= max_chars:
+            break
+    return {"text": "\n\n".join(texts).strip(), "images": [], "pages_read": len(texts), "total_pages": total,
+            "truncated": len(texts) < total}
+
+
+def extract_pdf_images(content: bytes, max_pages: int = DOCUMENT_SCANNED_MAX_PAGES) -> list[bytes]:
+    """
+    Hàm chạy trong process con: ảnh các trang của PDF scan (text đã có trong cache, chỉ cần lấy lại ảnh).
+    """
+    return _page_images(pypdf.PdfReader(io.BytesIO(content)), max_pages)
+
+
+@dataclass(frozen=True)
+class IngestedDocument:
+    format: str
+    text: str | None  # None nếu bài làm cần chấm bằng ảnh
+    images: tuple[bytes, ...]  # ảnh từng trang (file ảnh, PDF scan)
+    pages_read: int
+    total_pages: int
+    truncated: bool  # dừng tách trước trang cuối vì đã đủ DOCUMENT_MAX_CHARS
+    status: str  # plain | extracted | cached
+    seconds: float
+
+    @property
+    def scanned(self) -> bool:
+        return self.text is None
+
+    def summary(self) -> dict:
+        return {
+            "format": self.format,
+            "scanned": self.scanned,
+            "pages_read": self.pages_read,
+            "total_pages": self.total_pages,
+            "truncated": self.truncated,
+            "chars": len(self.text) if self.text is not None else 0,
+            "images": len(self.images),
+            "status": self.status,
+            "seconds": round(self.seconds, 4),
+        }
+
+
+class DocumentIngestor:
+    def __init__(
+        self,
+        store: SQLiteCacheBackend | None = None,
+        max_chars: int = DOCUMENT_MAX_CHARS,
+        workers: int = DOCUMENT_INGEST_WORKERS,
+    ):
+        self.store = store
+        self.max_chars = max_chars
+        self.workers = workers
+        self._pool = None  # tạo khi có file PDF / DOCX đầu tiên
+
+    async def _run(self, func, *args):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return await asyncio.get_running_loop().run_in_executor(self._pool, func, *args)
+
+    async def ingest(self, fetched) -> IngestedDocument:
+        """
+        fetched: FetchedFile của file_fetcher. Lỗi UnsupportedDocumentError nếu không đọc được định dạng.
+        """
+        start = time.perf_counter()
+        content = fetched.content
+        kind = sniff_format(content)
+        if kind == TEXT:
+            return IngestedDocument(TEXT, fetched.text, (), 1, 1, False, "plain", time.perf_counter() - start)
+        if kind == IMAGE:
+            return IngestedDocument(IMAGE, None, (content,), 1, 1, False, "plain", time.perf_counter() - start)
+        if kind == UNSUPPORTED:
+            raise UnsupportedDocumentError("Định dạng file không được hỗ trợ (chỉ nhận text, PDF, DOCX hoặc ảnh)")
+        if kind == PDF and pypdf is None:
+            raise UnsupportedDocumentError("Server chưa cài pypdf nên chưa đọc được file PDF")
+
+        key = f"{kind}:{hashlib.sha256(content).hexdigest()}"
+        cached = await self.store.get(key) if self.store is not None else None
+        if cached is not None:
+            data = json.loads(cached)
+            status = "cached"
+            if data["text"] is None:
+                # PDF scan: cache chỉ lưu kết quả nhận dạng, không lưu ảnh; lấy lại ảnh các trang
+                data["images"] = await self._run(extract_pdf_images, content, DOCUMENT_SCANNED_MAX_PAGES)
+        else:
+            if kind == PDF:
+                data = await self._run(extract_pdf, content, self.max_chars)
+            else:
+                text = await self._run(extract_docx_text, content, self.max_chars)
+                data = {"text": text, "pages_read": 1, "total_pages": 1, "truncated": len(text) >= self.max_chars}
+            status = "extracted"
+            if self.store is not None:
+                record = {name: value for name, value in data.items() if name != "images"}
+                await self.store.set(key, json.dumps(record, ensure_ascii=False))
+
+        images = tuple(data.get("images") or ())
+        if data["text"] is None and not images:
+            raise UnsupportedDocumentError("File PDF không có text lẫn ảnh bài làm")
+        # pages_read: số trang thực sự dùng (trang có text, hoặc trang có ảnh gửi cho model với PDF scan)
+        pages_read = len(images) if data["text"] is None else data["pages_read"]
+        return IngestedDocument(
+            kind, data["text"], images, pages_read, data["total_pages"], data["truncated"], status,
+            time.perf_counter() - start,
+        )
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def _normalize(text: str) -> str:
+    # Bỏ khoảng trắng thừa cuối dòng và dòng trống liên tiếp mà trình tách PDF hay để lại
+    return re.sub(r"\n{3,}", "\n\n", re.sub(r"[ \t]+\n", "\n", text)).strip()
+
+
+def create_document_ingestor() -> DocumentIngestor:
+    store = None
+    if DOCUMENT_TEXT_CACHE:
+        store = SQLiteCacheBackend(
+            path=DOCUMENT_TEXT_CACHE_PATH,
+            ttl=DOCUMENT_TEXT_CACHE_TTL_SECONDS,
+            table="document_text",
+        )
+    return DocumentIngestor(store)
@@ -0,0 +1,150 @@
+"""
+Tải file bài làm từ URL: bất đồng bộ, dùng chung pool kết nối, giới hạn dung lượng.
+Kết quả được cache ngắn hạn theo URL; hết hạn thì kiểm tra lại bằng ETag (If-None-Match).
+"""
+import codecs
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import httpx
+
+from config import load_env
+
+load_env()
+
+FILE_FETCH_MAX_BYTES = int(os.getenv("FILE_FETCH_MAX_BYTES", str(2 * 1024 * 1024)))
+FILE_FETCH_TIMEOUT_SECONDS = float(os.getenv("FILE_FETCH_TIMEOUT_SECONDS", "15"))
+FILE_FETCH_MAX_CONNECTIONS = int(os.getenv("FILE_FETCH_MAX_CONNECTIONS", "20"))
+FILE_FETCH_CACHE_TTL_SECONDS = float(os.getenv("FILE_FETCH_CACHE_TTL_SECONDS", "120"))
+FILE_FETCH_CACHE_MAX_ENTRIES = int(os.getenv("FILE_FETCH_CACHE_MAX_ENTRIES", "256"))
+# File lớn hơn (PDF scan nhiều trang) không giữ trong cache theo URL để bộ nhớ cache có giới hạn
+FILE_FETCH_CACHE_MAX_FILE_BYTES = int(os.getenv("FILE_FETCH_CACHE_MAX_FILE_BYTES", str(2 * 1024 * 1024)))
+
+# Bảng mã dự phòng cho file tiếng Việt cũ không khai báo charset và không phải UTF-8
+_FALLBACK_ENCODING = "cp1258"
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+class FileTooLargeError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class FetchedFile:
+    url: str
+    content: bytes
+    content_type: str
+    encoding: str
+    etag: str | None = None
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors="replace")
+
+
+def detect_encoding(content: bytes, content_type: str = "") -> str:
+    """
+    Xác định bảng mã: charset trong Content-Type, BOM, UTF-8 hợp lệ, cuối cùng là cp1258.
+    """
+    for param in content_type.split(";")[1:]:
+        key, _, value = param.partition("=")
+        if key.strip().lower() == "charset" and value.strip():
+            try:
+                return codecs.lookup(value.strip().strip('"')).name
+            except LookupError:
+                break
+
+    for bom, encoding in _BOMS:
+        if content.startswith(bom):
+            return encoding
+
+    try:
+        content.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        return _FALLBACK_ENCODING
+
+
+class FileFetcher:
+    def __init__(
+        self,
+        max_bytes: int = FILE_FETCH_MAX_BYTES,
+        timeout: float = FILE_FETCH_TIMEOUT_SECONDS,
+        max_connections: int = FILE_FETCH_MAX_CONNECTIONS,
+        cache_ttl: float = FILE_FETCH_CACHE_TTL_SECONDS,
+        cache_max_entries: int = FILE_FETCH_CACHE_MAX_ENTRIES,
+        cache_max_file_bytes: int = FILE_FETCH_CACHE_MAX_FILE_BYTES,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.max_bytes = max_bytes
+        self.cache_ttl = cache_ttl
+        self.cache_max_entries = cache_max_entries
+        self.cache_max_file_bytes = cache_max_file_bytes
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout,
+            follow_redirects=True,
+            transport=transport,
+        )
+        self._cache = OrderedDict()  # url -> (expires_at, FetchedFile)
+
+    def _remember(self, fetched: FetchedFile):
+        if len(fetched.content) > self.cache_max_file_bytes:
+            self._cache.pop(fetched.url, None)
+            return
+        self._cache[fetched.url] = (time.monotonic() + self.cache_ttl, fetched)
+        self._cache.move_to_end(fetched.url)
+        while len(self._cache) > self.cache_max_entries:
+            self._cache.popitem(last=False)
+
+    async def fetch(self, url: str) -> FetchedFile:
+        cached = self._cache.get(url)
+        if cached is not None and cached[0] > time.monotonic():
+            self._cache.move_to_end(url)
+            return cached[1]
+
+        headers = {}
+        if cached is not None and cached[1].etag:
+            headers["If-None-Match"] = cached[1].etag
+
+        async with self._client.stream("GET", url, headers=headers) as response:
+            if response.status_code == 304 and cached is not None:
+                self._remember(cached[1])
+                return cached[1]
+            response.raise_for_status()  # báo lỗi nếu URL sai
+
+            declared = response.headers.get("content-length")
+            if declared is not None and declared.isdigit() and int(declared) > self.max_bytes:
+                raise FileTooLargeError(f"File quá lớn ({declared} bytes), giới hạn {self.max_bytes} bytes")
+
+            chunks = []
+            received = 0
+            async for chunk in response.aiter_bytes():
+                received += len(chunk)
+                if received > self.max_bytes:
+                    raise FileTooLargeError(f"File vượt quá giới hạn {self.max_bytes} bytes")
+                chunks.append(chunk)
+
+        content = b"".join(chunks)
+        content_type = response.headers.get("content-type", "")
+        fetched = FetchedFile(
+            url=url,
+            content=content,
+            content_type=content_type,
+            encoding=detect_encoding(content, content_type),
+            etag=response.headers.get("etag"),
+        )
+        self._remember(fetched)
+        return fetched
+
+    async def fetch_text(self, url: str) -> str:
+        return (await self.fetch(url)).text
+
+    async def aclose(self):
+        await self._client.aclose()
@@ -0,0 +1,140 @@
+"""
+Bước tiếp nhận ảnh bài làm cho /auto-grading/image.
+- URL đã nằm trên Cloudinary: dùng thẳng, không upload lại.
+- URL đã upload trước đó: lấy lại URL công khai từ cache SQLite (giữ được qua lần khởi động lại).
+- Còn lại: upload trong thread riêng để không chặn event loop.
+"""
+import asyncio
+import hashlib
+import os
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Protocol
+from urllib.parse import urlparse
+
+from config import load_env
+from response_cache import SQLiteCacheBackend
+
+load_env()
+
+IMAGE_HOST = os.getenv("IMAGE_HOST", "cloudinary")  # cloudinary | fake
+IMAGE_INGEST_CACHE_PATH = os.getenv("IMAGE_INGEST_CACHE_PATH", "image_ingest.sqlite3")
+IMAGE_INGEST_CACHE_TTL_SECONDS = float(os.getenv("IMAGE_INGEST_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+
+@lru_cache(maxsize=1)
+def configure_cloudinary():
+    """
+    Import và cấu hình cloudinary ở lần dùng đầu tiên (đọc key từ env sau khi đã nạp .env).
+    """
+    import cloudinary
+
+    cloudinary.config(
+        cloud_name=os.getenv("cloud_name"),
+        api_key=os.getenv("api_key"),
+        api_secret=os.getenv("api_secret"),
+        secure=True
+    )
+    return cloudinary
+
+
+class ImageHost(Protocol):
+    """
+    Nơi lưu ảnh công khai mà vision model đọc được (Cloudinary hoặc bản giả lập).
+    """
+
+    def is_hosted(self, url: str) -> bool:
+        ...
+
+    def upload(self, source_url: str) -> str:
+        """
+        Upload ảnh (blocking) và trả về URL công khai.
+        """
+        ...
+
+
+class CloudinaryImageHost:
+    HOSTNAME = "res.cloudinary.com"
+
+    def is_hosted(self, url: str) -> bool:
+        parsed = urlparse(url)
+        return parsed.scheme == "https" and parsed.hostname == self.HOSTNAME
+
+    def upload(self, source_url: str) -> str:
+        configure_cloudinary()
+        import cloudinary.uploader
+
+        upload_result = cloudinary.uploader.upload(source_url)
+        return upload_result.get("secure_url")
+
+
+class FakeImageHost:
+    """
+    Giả lập Cloudinary cho benchmark / chạy cục bộ: không gọi mạng, có thể thêm độ trễ.
+    """
+
+    BASE_URL = "https://res.cloudinary.test/demo/image/upload/"
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.uploads = []
+
+    def is_hosted(self, url: str) -> bool:
+        return url.startswith(self.BASE_URL)
+
+    def upload(self, source_url: str) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        self.uploads.append(source_url)
+        digest = hashlib.sha1(source_url.encode("utf-8")).hexdigest()[:16]
+        return f"{self.BASE_URL}{digest}.jpg"
+
+
+@dataclass(frozen=True)
+class IngestedImage:
+    url: str  # URL công khai gửi cho vision model
+    source_url: str
+    status: str  # passthrough | cached | uploaded
+    seconds: float
+
+
+class ImageIngestor:
+    def __init__(self, host: ImageHost, store: SQLiteCacheBackend | None = None):
+        self.host = host
+        self.store = store
+
+    async def ingest(self, source_url: str) -> IngestedImage:
+        start = time.perf_counter()
+
+        if self.host.is_hosted(source_url):
+            return IngestedImage(source_url, source_url, "passthrough", time.perf_counter() - start)
+
+        if self.store is not None:
+            hosted_url = await self.store.get(source_url)
+            if hosted_url is not None:
+                return IngestedImage(hosted_url, source_url, "cached", time.perf_counter() - start)
+
+        hosted_url = await asyncio.to_thread(self.host.upload, source_url)
+        if not hosted_url:
+            raise RuntimeError("Upload ảnh không trả về URL công khai")
+        if self.store is not None:
+            await self.store.set(source_url, hosted_url)
+        return IngestedImage(hosted_url, source_url, "uploaded", time.perf_counter() - start)
+
+
+def create_image_host(name: str = IMAGE_HOST) -> ImageHost:
+    if name == "cloudinary":
+        return CloudinaryImageHost()
+    if name == "fake":
+        return FakeImageHost()
+    raise ValueError(f"IMAGE_HOST không hợp lệ: {name}")
+
+
+def create_image_ingestor() -> ImageIngestor:
+    store = SQLiteCacheBackend(
+        path=IMAGE_INGEST_CACHE_PATH,
+        ttl=IMAGE_INGEST_CACHE_TTL_SECONDS,
+        table="hosted_images",
+    )
+    return ImageIngestor(create_image_host(), store)
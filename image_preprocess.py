@@ -0,0 +1,185 @@
+"""
+Tiền xử lý ảnh bài làm trước khi gửi cho vision model (/auto-grading/image).
+Xoay theo EXIF, chuyển ảnh xám, cắt sát vùng có nội dung, thu nhỏ theo cạnh dài, nén lại JPEG.
+Phần xử lý ảnh tốn CPU chạy trong process pool để không chặn event loop.
+Pillow là phụ thuộc tùy chọn: không cài thì bỏ qua bước này và gửi URL ảnh như cũ.
+"""
+import asyncio
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - Pillow không bắt buộc
+    Image = None
+    ImageOps = None
+
+from config import load_env
+
+load_env()
+
+IMAGE_PREPROCESS = os.getenv("IMAGE_PREPROCESS", "1") == "1"
+IMAGE_MAX_LONG_EDGE = int(os.getenv("IMAGE_MAX_LONG_EDGE", "1600"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "70"))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "1") == "1"
+IMAGE_PREPROCESS_WORKERS = int(os.getenv("IMAGE_PREPROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Ảnh gốc từ điện thoại (3-12 MP) thường vài MB
+IMAGE_SOURCE_MAX_BYTES = int(os.getenv("IMAGE_SOURCE_MAX_BYTES", str(20 * 1024 * 1024)))
+
+# Ngưỡng (sau autocontrast): sáng hơn là nền giấy, tối hơn là nét chữ
+_PAPER_THRESHOLD = 170
+_INK_THRESHOLD = 110
+# Tìm vùng nội dung trên ảnh thu nhỏ (nhanh hơn và lọc bớt nhiễu lấm tấm)
+_DETECT_LONG_EDGE = 512
+# Lề giữ lại quanh vùng nội dung, tính theo tỉ lệ cạnh ảnh
+_CROP_MARGIN = 0.02
+# Bỏ qua hộp quá nhỏ (thường là nhiễu hoặc ảnh trắng)
+_MIN_CONTENT_FRACTION = 0.05
+
+
+def is_available() -> bool:
+    return Image is not None
+
+
+@dataclass(frozen=True)
+class PreprocessedImage:
+    content: bytes  # JPEG đã nén lại
+    media_type: str
+    original_bytes: int
+    original_size: tuple[int, int]
+    final_size: tuple[int, int]
+    seconds: float
+
+    @property
+    def final_bytes(self) -> int:
+        return len(self.content)
+
+    def summary(self) -> dict:
+        return {
+            "original_bytes": self.original_bytes,
+            "final_bytes": self.final_bytes,
+            "original_size": list(self.original_size),
+            "final_size": list(self.final_size),
+            "seconds": round(self.seconds, 4),
+        }
+
+
+def _bbox(mask, min_area):
+    box = mask.getbbox()
+    if box is None:
+        return None
+    left, top, right, bottom = box
+    return box if (right - left) * (bottom - top) >= min_area else None
+
+
+def _content_box(gray):
+    """
+    Hộp bao vùng có nội dung: tìm tờ giấy (vùng sáng) rồi tìm nét chữ trên giấy.
+    None nếu không nên cắt.
+    """
+    width, height = gray.size
+    scale = min(1.0, _DETECT_LONG_EDGE / max(width, height))
+    small = gray.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BOX)
+    small = ImageOps.autocontrast(small, cutoff=1)
+    min_area = _MIN_CONTENT_FRACTION * small.size[0] * small.size[1]
+
+    paper = _bbox(small.point(lambda p: 255 if p > _PAPER_THRESHOLD else 0), min_area)
+    if paper is not None:
+        small = small.crop(paper)
+        offset_x, offset_y = paper[:2]
+    else:
+        offset_x = offset_y = 0
+
+    ink = _bbox(small.point(lambda p: 255 if p < _INK_THRESHOLD else 0), 0.1 * min_area)
+    box = ink if ink is not None else (0, 0) + small.size
+    if paper is None and ink is None:
+        return None
+
+    margin_x = width * _CROP_MARGIN
+    margin_y = height * _CROP_MARGIN
+    left, top, right, bottom = box
+    return (
+        max(0, int((left + offset_x) / scale - margin_x)),
+        max(0, int((top + offset_y) / scale - margin_y)),
+        min(width, int((right + offset_x) / scale + margin_x)),
+        min(height, int((bottom + offset_y) / scale + margin_y)),
+    )
+
+
+def preprocess_image_bytes(
+    data: bytes,
+    max_long_edge: int = IMAGE_MAX_LONG_EDGE,
+    quality: int = IMAGE_JPEG_QUALITY,
+    grayscale: bool = IMAGE_GRAYSCALE,
+) -> tuple[bytes, tuple[int, int], tuple[int, int]]:
+    """
+    Hàm chạy trong process con: trả về (jpeg, kích thước gốc, kích thước sau xử lý).
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        original_size = source.size
+        # JPEG: giải mã thẳng ở độ phân giải thấp hơn (1/2, 1/4, 1/8) nếu vẫn đủ cạnh dài
+        scale = max_long_edge / max(original_size)
+        if scale < 1:
+            source.draft("L" if grayscale else "RGB",
+                         (int(original_size[0] * scale), int(original_size[1] * scale)))
+        img = ImageOps.exif_transpose(source)
+        img = img.convert("L") if grayscale else img.convert("RGB")
+
+        box = _content_box(img if grayscale else img.convert("L"))
+        if box is not None:
+            img = img.crop(box)
+
+        if max(img.size) > max_long_edge:
+            img.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+
+        output = io.BytesIO()
+        img.save(output, format="JPEG", quality=quality, optimize=True)
+        return output.getvalue(), original_size, img.size
+
+
+class ImagePreprocessor:
+    def __init__(
+        self,
+        max_long_edge: int = IMAGE_MAX_LONG_EDGE,
+        quality: int = IMAGE_JPEG_QUALITY,
+        grayscale: bool = IMAGE_GRAYSCALE,
+        workers: int = IMAGE_PREPROCESS_WORKERS,
+    ):
+        self.max_long_edge = max_long_edge
+        self.quality = quality
+        self.grayscale = grayscale
+        self.workers = workers
+        self._pool = None  # tạo khi có ảnh đầu tiên
+
+    async def preprocess(self, data: bytes) -> PreprocessedImage:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        start = time.perf_counter()
+        content, original_size, final_size = await asyncio.get_running_loop().run_in_executor(
+            self._pool, preprocess_image_bytes, data, self.max_long_edge, self.quality, self.grayscale
+        )
+        return PreprocessedImage(
+            content=content,
+            media_type="image/jpeg",
+            original_bytes=len(data),
+            original_size=original_size,
+            final_size=final_size,
+            seconds=time.perf_counter() - start,
+        )
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def create_image_preprocessor() -> ImagePreprocessor | None:
+    """
+    Trả về None nếu tắt bằng IMAGE_PREPROCESS=0 hoặc chưa cài Pillow.
+    """
+    if not IMAGE_PREPROCESS or not is_available():
+        return None
+    return ImagePreprocessor()
@@ -0,0 +1,459 @@
+"""
+Job nền cho các endpoint chấm bài chạy lâu (/grade-with-rubric, /recent-test-grading, ...).
+POST /jobs/{endpoint} ghi job vào hàng đợi SQLite và trả job id ngay; worker lấy job ra chạy đúng handler
+của endpoint đó, lưu kết quả để GET /jobs/{id} đọc lại, rồi gọi callback_url (nếu có).
+Hàng đợi nằm trên đĩa nên job còn nguyên sau khi khởi động lại; nhiều process có thể dùng chung một file
+(ví dụ tầng API đặt JOBS_WORKERS=0, tầng worker chạy cùng app với JOBS_WORKERS > 0).
+"""
+import asyncio
+import ipaddress
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+
+from config import load_env
+from metrics import JOBS, JOBS_QUEUED, request_scope
+from scheduler import PRIORITY_BATCH, priority_scope
+
+load_env()
+
+JOBS_ENABLED = os.getenv("JOBS", "1") == "1"
+JOBS_PATH = os.getenv("JOBS_PATH", "jobs.sqlite3")
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "4"))  # số job chạy song song trong process này; 0 = chỉ nhận job
+JOBS_POLL_SECONDS = float(os.getenv("JOBS_POLL_SECONDS", "1"))  # chu kỳ kiểm tra job do process khác ghi vào
+# Job đang chạy gia hạn lease định kỳ; process chết giữa chừng thì hết lease job được đưa lại hàng đợi
+JOBS_LEASE_SECONDS = float(os.getenv("JOBS_LEASE_SECONDS", "120"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+JOBS_RETENTION_SECONDS = float(os.getenv("JOBS_RETENTION_SECONDS", str(7 * 24 * 3600)))  # giữ kết quả 7 ngày
+JOBS_CALLBACK_TIMEOUT_SECONDS = float(os.getenv("JOBS_CALLBACK_TIMEOUT_SECONDS", "10"))
+JOBS_CALLBACK_MAX_ATTEMPTS = int(os.getenv("JOBS_CALLBACK_MAX_ATTEMPTS", "5"))
+# Danh sách host được nhận callback (phân tách bởi dấu phẩy). Để trống: nhận mọi host có địa chỉ công khai,
+# từ chối loopback, mạng nội bộ, link-local (169.254.169.254), ... để callback không thành đường vào mạng trong
+JOBS_CALLBACK_ALLOWED_HOSTS = frozenset(
+    host.strip().lower() for host in os.getenv("JOBS_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+_COLUMNS = (
+    "id, endpoint, payload, status, result, error, callback_url, callback_status,"
+    " attempts, created_at, started_at, finished_at"
+)
+
+
+@dataclass
+class JobHandler:
+    model: type  # pydantic model của body, kiểm tra ngay khi nhận job
+    run: object  # async (request) -> dict, thường chính là hàm xử lý của endpoint
+
+
+def _iso(timestamp: float | None) -> str | None:
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="seconds")
+
+
+def valid_callback_url(url: str) -> bool:
+    try:
+        parts = urlsplit(url)
+        parts.port  # cổng sai cú pháp -> ValueError
+    except ValueError:
+        return False
+    return parts.scheme in ("http", "https") and bool(parts.hostname)
+
+
+def _public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def resolve_callback_url(url: str,
+                               allowed_hosts: frozenset = JOBS_CALLBACK_ALLOWED_HOSTS) -> tuple[str | None, str | None]:
+    """
+    (địa chỉ IP đã kiểm tra để gửi callback tới, lý do không gửi được); lý do None nếu được phép.
+    Có allowed_hosts thì chỉ nhận các host đó (không phân giải, địa chỉ None);
+    không thì mọi địa chỉ host phân giải ra phải là địa chỉ công khai.
+    """
+    if not valid_callback_url(url):
+        return None, "callback_url phải là URL http(s)"
+    parts = urlsplit(url)
+    host = parts.hostname
+    if allowed_hosts:
+        return None, None if host in allowed_hosts else f"Host {host} không nằm trong JOBS_CALLBACK_ALLOWED_HOSTS"
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, parts.port, type=socket.SOCK_STREAM)
+    except socket.gaierror:
+        return None, f"Không phân giải được host {host} của callback_url"
+    if not infos or not all(_public_address(info[4][0]) for info in infos):
+        return None, f"callback_url trỏ tới địa chỉ nội bộ ({host}), không được phép"
+    return infos[0][4][0], None
+
+
+async def check_callback_url(url: str, allowed_hosts: frozenset = JOBS_CALLBACK_ALLOWED_HOSTS) -> str | None:
+    """
+    Lý do không gửi được callback tới url; None nếu được phép.
+    """
+    return (await resolve_callback_url(url, allowed_hosts))[1]
+
+
+def pin_callback_url(url: str, address: str | None) -> tuple[str, dict, dict]:
+    """
+    (url, headers, extensions) để gửi thẳng tới địa chỉ đã kiểm tra, không phân giải DNS lần nữa
+    (tránh DNS rebinding): host trong URL thay bằng IP, Host header và SNI / kiểm tra chứng chỉ giữ tên host gốc.
+    """
+    if address is None:
+        return url, {}, {}
+    parts = urlsplit(url)
+    userinfo, _, hostport = parts.netloc.rpartition("@")
+    ip = address.split("%", 1)[0]
+    netloc = f"[{ip}]" if ":" in ip else ip
+    if parts.port is not None:
+        netloc += f":{parts.port}"
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+    extensions = {"sni_hostname": parts.hostname} if parts.scheme == "https" else {}
+    return urlunsplit(parts._replace(netloc=netloc)), {"Host": hostport}, extensions
+
+
+class JobStore:
+    """
+    Bảng jobs trong SQLite; truy vấn chạy trong thread riêng để không chặn event loop.
+    Lấy job bằng một câu UPDATE ... RETURNING nên hai worker (kể cả khác process) không nhận trùng job.
+    """
+
+    def __init__(self, path: str = JOBS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, endpoint TEXT NOT NULL, payload TEXT NOT NULL,"
+                " status TEXT NOT NULL, result TEXT, error TEXT,"
+                " callback_url TEXT, callback_status TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0, lease_until REAL,"
+                " created_at REAL NOT NULL, started_at REAL, finished_at REAL);"
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);"
+            )
+            self._conn.commit()
+
+    def _execute(self, sql: str, params=()) -> list[sqlite3.Row]:
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            self._conn.commit()
+            return rows
+
+    def create(self, endpoint: str, payload: dict, callback_url: str | None) -> dict:
+        job_id = uuid.uuid4().hex
+        rows = self._execute(
+            "INSERT INTO jobs (id, endpoint, payload, status, callback_url, callback_status, created_at)"
+            f" VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING {_COLUMNS}",
+            (job_id, endpoint, json.dumps(payload, ensure_ascii=False), QUEUED,
+             callback_url, "pending" if callback_url else None, time.time()),
+        )
+        return dict(rows[0])
+
+    def get(self, job_id: str) -> dict | None:
+        rows = self._execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,))
+        return dict(rows[0]) if rows else None
+
+    def claim(self, lease: float) -> dict | None:
+        now = time.time()
+        rows = self._execute(
+            "UPDATE jobs SET status = ?, started_at = ?, lease_until = ?, attempts = attempts + 1"
+            " WHERE id = (SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1)"
+            f" RETURNING {_COLUMNS}",
+            (RUNNING, now, now + lease, QUEUED),
+        )
+        return dict(rows[0]) if rows else None
+
+    def renew(self, job_id: str, lease: float):
+        self._execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ?",
+                      (time.time() + lease, job_id, RUNNING))
+
+    def finish(self, job_id: str, status: str, result: dict | None, error: str | None) -> dict | None:
+        rows = self._execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL"
+            f" WHERE id = ? RETURNING {_COLUMNS}",
+            (status, None if result is None else json.dumps(result, ensure_ascii=False), error, time.time(), job_id),
+        )
+        return dict(rows[0]) if rows else None
+
+    def requeue(self, job_id: str):
+        self._execute("UPDATE jobs SET status = ?, lease_until = NULL WHERE id = ? AND status = ?",
+                      (QUEUED, job_id, RUNNING))
+
+    def recover_expired(self, max_attempts: int) -> list[dict]:
+        """
+        Job đang chạy mà hết lease (process chết giữa chừng): chạy lại, hoặc báo lỗi nếu đã thử quá nhiều lần.
+        Trả về các job bị chuyển sang failed (để gọi callback).
+        """
+        now = time.time()
+        failed = self._execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_until = NULL"
+            " WHERE status = ? AND lease_until < ? AND attempts >= ?"
+            f" RETURNING {_COLUMNS}",
+            (FAILED, "Job bị gián đoạn quá nhiều lần", now, RUNNING, now, max_attempts),
+        )
+        self._execute("UPDATE jobs SET status = ?, lease_until = NULL WHERE status = ? AND lease_until < ?",
+                      (QUEUED, RUNNING, now))
+        return [dict(row) for row in failed]
+
+    def pending_callbacks(self, finished_before: float) -> list[dict]:
+        rows = self._execute(
+            f"SELECT {_COLUMNS} FROM jobs WHERE status IN (?, ?) AND callback_status = 'pending'"
+            " AND finished_at < ?",
+            (SUCCEEDED, FAILED, finished_before),
+        )
+        return [dict(row) for row in rows]
+
+    def set_callback_status(self, job_id: str, status: str):
+        self._execute("UPDATE jobs SET callback_status = ? WHERE id = ?", (status, job_id))
+
+    def purge(self, older_than: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (SUCCEEDED, FAILED, older_than)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def counts(self) -> dict:
+        rows = self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        return {status: count for status, count in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def job_view(job: dict) -> dict:
+    """
+    Job dạng response của GET /jobs/{id} (cũng là body gửi tới callback_url).
+    """
+    return {
+        "success": True,
+        "job_id": job["id"],
+        "endpoint": job["endpoint"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "created_at": _iso(job["created_at"]),
+        "started_at": _iso(job["started_at"]),
+        "finished_at": _iso(job["finished_at"]),
+        "result": json.loads(job["result"]) if job["result"] else None,
+        "error": job["error"],
+        "callback_status": job["callback_status"],
+    }
+
+
+class JobQueue:
+    """
+    Nhận job, chạy bằng một nhóm worker asyncio và gọi callback khi xong.
+    handlers: {tên endpoint: JobHandler}. Lời gọi model của job chạy với ưu tiên BATCH,
+    nhãn metrics là /jobs/{endpoint}.
+    """
+
+    def __init__(self, store: JobStore, handlers: dict, workers: int = JOBS_WORKERS,
+                 poll: float = JOBS_POLL_SECONDS, lease: float = JOBS_LEASE_SECONDS,
+                 max_attempts: int = JOBS_MAX_ATTEMPTS, transport: httpx.AsyncBaseTransport | None = None,
+                 callback_hosts: frozenset = JOBS_CALLBACK_ALLOWED_HOSTS):
+        self.store = store
+        self.handlers = handlers
+        self.workers = workers
+        self.poll = poll
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.completed = 0
+        self.failed = 0
+        self.callbacks_sent = 0
+        self.callbacks_failed = 0
+        self._transport = transport
+        self.callback_hosts = callback_hosts
+        self._client = None
+        self._wakeup = None
+        self._tasks = []
+        self._callbacks = {}  # job id -> task gửi callback
+
+    async def submit(self, endpoint: str, payload: dict, callback_url: str | None = None) -> dict:
+        """
+        Kiểm tra body theo model của endpoint rồi ghi vào hàng đợi; ValueError nếu endpoint/callback không hợp lệ,
+        pydantic.ValidationError nếu body sai.
+        """
+        handler = self.handlers.get(endpoint)
+        if handler is None:
+            raise ValueError(f"Endpoint không hỗ trợ chạy dạng job: {endpoint}. Hỗ trợ: {', '.join(sorted(self.handlers))}")
+        if callback_url is not None:
+            reason = await check_callback_url(callback_url, self.callback_hosts)
+            if reason is not None:
+                raise ValueError(reason)
+        request = handler.model.model_validate(payload)
+        job = await asyncio.to_thread(self.store.create, endpoint, request.model_dump(mode="json"), callback_url)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> dict | None:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def _keep_lease(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            await asyncio.to_thread(self.store.renew, job_id, self.lease)
+
+    async def _execute(self, job: dict) -> tuple[str, dict | None, str | None]:
+        handler = self.handlers.get(job["endpoint"])
+        if handler is None:
+            return FAILED, None, f"Endpoint không hỗ trợ chạy dạng job: {job['endpoint']}"
+        try:
+            request = handler.model.model_validate(json.loads(job["payload"]))
+            with request_scope(f"/jobs/{job['endpoint']}"), priority_scope(PRIORITY_BATCH):
+                result = await handler.run(request)
+        except Exception as e:
+            return FAILED, None, str(e)
+        # Endpoint báo lỗi theo kiểu {"success": False, "error": ...}: job failed nhưng vẫn giữ nguyên kết quả
+        if isinstance(result, dict) and result.get("success") is False:
+            return FAILED, result, str(result.get("error") or "")
+        return SUCCEEDED, result, None
+
+    async def _run(self, job: dict):
+        keeper = asyncio.get_running_loop().create_task(self._keep_lease(job["id"]))
+        try:
+            status, result, error = await self._execute(job)
+        except asyncio.CancelledError:
+            # Tắt server giữa chừng: trả job về hàng đợi để lần chạy sau làm tiếp
+            await asyncio.shield(asyncio.to_thread(self.store.requeue, job["id"]))
+            raise
+        finally:
+            keeper.cancel()
+        finished = await asyncio.to_thread(self.store.finish, job["id"], status, result, error)
+        JOBS.inc(endpoint=job["endpoint"], status=status)
+        if status == SUCCEEDED:
+            self.completed += 1
+        else:
+            self.failed += 1
+        if finished is not None:
+            self._notify(finished)
+
+    async def _worker(self):
+        while True:
+            job = await asyncio.to_thread(self.store.claim, self.lease)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job {job['id']} failed to finish: {e}")
+
+    async def _maintain(self):
+        # Đưa lại hàng đợi job của process đã chết, gửi lại callback còn dở, xóa job quá hạn lưu
+        while True:
+            try:
+                for job in await asyncio.to_thread(self.store.recover_expired, self.max_attempts):
+                    JOBS.inc(endpoint=job["endpoint"], status=FAILED)
+                    self._notify(job)
+                # Callback chưa gửi được của job xong từ hơn một lease trước (process gửi đã dừng)
+                for job in await asyncio.to_thread(self.store.pending_callbacks, time.time() - self.lease):
+                    self._notify(job)
+                await asyncio.to_thread(self.store.purge, time.time() - JOBS_RETENTION_SECONDS)
+                counts = await asyncio.to_thread(self.store.counts)
+                JOBS_QUEUED.set(counts.get(QUEUED, 0))
+            except Exception as e:
+                print(f"Job maintenance failed: {e}")
+            await asyncio.sleep(self.lease / 2)
+
+    def _notify(self, job: dict):
+        if not job["callback_url"] or job["callback_status"] != "pending":
+            return
+        if job["id"] in self._callbacks:
+            return
+        task = asyncio.get_running_loop().create_task(self._send_callback(job))
+        self._callbacks[job["id"]] = task
+        task.add_done_callback(lambda _: self._callbacks.pop(job["id"], None))
+
+    async def _send_callback(self, job: dict):
+        body = job_view(job)
+        for attempt in range(JOBS_CALLBACK_MAX_ATTEMPTS):
+            # Kiểm tra lại trước mỗi lần gửi (DNS của host có thể đã đổi sang địa chỉ nội bộ sau khi nhận job)
+            # và gửi tới đúng địa chỉ vừa kiểm tra
+            address, reason = await resolve_callback_url(job["callback_url"], self.callback_hosts)
+            if reason is not None:
+                print(f"Callback for job {job['id']} skipped: {reason}")
+                break
+            url, headers, extensions = pin_callback_url(job["callback_url"], address)
+            try:
+                response = await self._client.post(url, json=body, headers=headers, extensions=extensions)
+                if response.status_code < 400:
+                    await asyncio.to_thread(self.store.set_callback_status, job["id"], "sent")
+                    self.callbacks_sent += 1
+                    return
+                # 4xx (trừ 408/429) là lỗi phía nhận, thử lại cũng vô ích
+                if response.status_code < 500 and response.status_code not in (408, 429):
+                    break
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(min(2 ** attempt, 30))
+        await asyncio.to_thread(self.store.set_callback_status, job["id"], "failed")
+        self.callbacks_failed += 1
+
+    def start(self):
+        if self._tasks:
+            return self
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._client = httpx.AsyncClient(timeout=JOBS_CALLBACK_TIMEOUT_SECONDS, transport=self._transport)
+        self._tasks = [loop.create_task(self._maintain())]
+        self._tasks += [loop.create_task(self._worker()) for _ in range(self.workers)]
+        return self
+
+    async def stop(self):
+        tasks = self._tasks + list(self._callbacks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers if self._tasks else 0,
+            "jobs": self.store.counts(),
+            "completed": self.completed,
+            "failed": self.failed,
+            "callbacks_sent": self.callbacks_sent,
+            "callbacks_failed": self.callbacks_failed,
+        }
+
+    def close(self):
+        self.store.close()
+
+
+def create_job_queue(handlers: dict) -> JobQueue | None:
+    """
+    Tạo hàng đợi job theo JOBS_PATH; None nếu tắt (JOBS=0).
+    """
+    if not JOBS_ENABLED:
+        return None
+    return JobQueue(JobStore(), handlers)
@@ -0,0 +1,177 @@
+"""
+Tìm và parse JSON trong câu trả lời của model bằng một lần quét tuyến tính.
+Thay cho chuỗi regex + json.loads nhiều lần (có thể backtrack rất chậm
+với output dài của /recent-test-grading).
+"""
+import json
+import re
+
+import metrics
+
+_CLOSERS = {"{": "}", "[": "]"}
+_OPENER = re.compile(r"[\[{]")
+# Ký tự có ý nghĩa cấu trúc khi đang ở trong một đoạn JSON (ngoài chuỗi)
+_STRUCTURAL = re.compile(r'["\[\]{},]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+# Cho phép quét lại phần lồng bên trong một đoạn hỏng, tổng công việc vẫn <= hệ số × len(text)
+_RESCAN_FACTOR = 3
+
+_decoder = json.JSONDecoder(strict=False)
+
+
+def _skip_string(text: str, pos: int) -> int:
+    """
+    Trả về vị trí ngay sau dấu " đóng chuỗi bắt đầu trước pos, -1 nếu chuỗi bị cắt cụt.
+    """
+    while True:
+        m = _STRING_SPECIAL.search(text, pos)
+        if m is None:
+            return -1
+        if m.group() == '"':
+            return m.end()
+        pos = m.end() + 1  # bỏ qua ký tự được escape
+
+
+def _loads(candidate: str):
+    try:
+        return _decoder.decode(candidate), True
+    except (json.JSONDecodeError, RecursionError):
+        return None, False
+
+
+def _scan_spans(text: str):
+    """
+    Sinh (value, tier) cho từng đoạn JSON cấp cao nhất parse được, theo thứ tự xuất hiện.
+    tier: "scan" (parse được nguyên đoạn), "repaired" (đã bỏ dấu phẩy thừa),
+    "truncated" (array bị cắt cụt, giữ lại các phần tử đã đóng).
+    """
+    n = len(text)
+    budget = _RESCAN_FACTOR * n
+    pos = 0
+    while budget > 0:
+        m = _OPENER.search(text, pos)
+        if m is None:
+            return
+        start = m.start()
+
+        # Đoạn hợp lệ sẵn: để bộ parse C đọc luôn, không cần quét từng ký tự
+        try:
+            value, end = _decoder.raw_decode(text, start)
+        except json.JSONDecodeError as e:
+            budget -= e.pos - start
+        except RecursionError:
+            pass  # lồng quá sâu: để vòng quét bên dưới xử lý
+        else:
+            budget -= end - start
+            pos = end
+            yield value, "scan"
+            continue
+
+        stack = [_CLOSERS[text[start]]]
+        out = [text[start]]
+        pos = start + 1
+        pending_comma = None  # index trong out của dấu phẩy có thể là thừa
+        repaired = False
+        truncated = False
+        first_nested = None  # vị trí mở ngoặc lồng đầu tiên, để quét lại nếu đoạn này hỏng
+        last_element_end = None  # độ dài out sau phần tử đóng gần nhất của array ngoài cùng
+
+        while stack:
+            m = _STRUCTURAL.search(text, pos)
+            if m is None:
+                truncated = True
+                break
+            i = m.start()
+            ch = m.group()
+            if i > pos:
+                between = text[pos:i]
+                if pending_comma is not None and not between.isspace():
+                    pending_comma = None
+                out.append(between)
+            pos = i + 1
+
+            if ch == '"':
+                pending_comma = None
+                end = _skip_string(text, pos)
+                if end == -1:
+                    truncated = True
+                    break
+                out.append(text[i:end])
+                pos = end
+            elif ch in _CLOSERS:
+                pending_comma = None
+                if first_nested is None:
+                    first_nested = i
+                stack.append(_CLOSERS[ch])
+                out.append(ch)
+            elif ch == ",":
+                pending_comma = len(out)
+                out.append(ch)
+            else:
+                if ch != stack[-1]:
+                    break  # ngoặc đóng không khớp: bỏ đoạn này
+                if pending_comma is not None:
+                    out[pending_comma] = ""
+                    repaired = True
+                    pending_comma = None
+                stack.pop()
+                out.append(ch)
+                if len(stack) == 1 and stack[0] == "]":
+                    last_element_end = len(out)
+
+        budget -= pos - start
+        if not stack:
+            value, ok = _loads("".join(out))
+            if ok:
+                yield value, "repaired" if repaired else "scan"
+                continue
+        elif truncated and stack[0] == "]" and last_element_end is not None:
+            value, ok = _loads("".join(out[:last_element_end]) + "]")
+            if ok:
+                yield value, "truncated"
+                return
+
+        # Đoạn hỏng: quét lại từ ngoặc lồng đầu tiên nếu còn ngân sách
+        if first_nested is not None and pos - first_nested <= budget:
+            pos = first_nested
+
+
+def _is_structured(value) -> bool:
+    if isinstance(value, dict):
+        return True
+    return isinstance(value, list) and any(isinstance(item, (dict, list)) for item in value)
+
+
+def locate_json(text):
+    """
+    Trả về (value, tier) với tier là mức fallback đã dùng:
+    "direct", "scan", "repaired", "truncated" hoặc "none" (value = None).
+    """
+    if not isinstance(text, str):
+        return None, "none"
+
+    # Thử 1: cả response là JSON (trường hợp thường gặp khi dùng response_format)
+    stripped = text.strip()
+    if stripped[:1] in _CLOSERS and stripped[-1:] == _CLOSERS[stripped[:1]]:
+        value, ok = _loads(stripped)
+        if ok:
+            return value, "direct"
+
+    # Thử 2: quét một lần, ưu tiên object / array các object (bỏ qua "[1]" lẫn trong văn bản)
+    first = None
+    for value, tier in _scan_spans(text):
+        if _is_structured(value):
+            return value, tier
+        if first is None:
+            first = (value, tier)
+    return first if first is not None else (None, "none")
+
+
+def extract_json_from_text(text):
+    """
+    Hàm helper để extract JSON từ text response.
+    Quét text một lần (thời gian tuyến tính), bỏ dấu phẩy thừa, trả về None nếu không tìm thấy.
+    """
+    value, tier = locate_json(text)
+    metrics.count_json_tier(tier)
+    return value
@@ -0,0 +1,172 @@
+"""
+Lớp truy cập LLM bất đồng bộ dùng chung cho toàn bộ API.
+Mọi endpoint gọi model qua LLMClient để không chặn event loop.
+"""
+import importlib
+import os
+import time
+
+import httpx
+
+from config import load_env
+import metrics
+from response_cache import ResponseCache, create_response_cache, make_cache_key
+from scheduler import LLMScheduler
+from singleflight import SingleFlight, coalesce_key
+
+load_env()
+
+MODEL_NAME = "gpt-4o-mini"  # Sử dụng GPT-4o mini cho hiệu quả
+
+# Số lời gọi model tối đa chạy đồng thời trong một worker
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+# Kích thước pool kết nối HTTP tới OpenAI (dùng chung cho mọi request)
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+# Gộp các lời gọi giống hệt nhau đang chạy đồng thời (chỉ với temperature thấp như chấm điểm)
+LLM_COALESCE = os.getenv("LLM_COALESCE", "1") == "1"
+LLM_COALESCE_MAX_TEMPERATURE = float(os.getenv("LLM_COALESCE_MAX_TEMPERATURE", "0.3"))
+
+
+class LLMClient:
+    """
+    Bọc AsyncOpenAI với pool kết nối dùng chung; mọi lời gọi đi qua LLMScheduler
+    (giới hạn đồng thời, hạn mức RPM/TPM, hàng đợi ưu tiên, thử lại).
+    """
+
+    def __init__(
+        self,
+        api_key: str | None = None,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_connections: int = LLM_MAX_CONNECTIONS,
+        timeout: float = LLM_TIMEOUT_SECONDS,
+        cache: ResponseCache | None = None,
+        coalesce: bool = LLM_COALESCE,
+    ):
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=timeout,
+        )
+        self._api_key = api_key
+        self._client = None
+        self.scheduler = LLMScheduler(max_concurrency=max_concurrency)
+        self.cache = cache if cache is not None else create_response_cache()
+        self.singleflight = SingleFlight() if coalesce else None
+
+    @property
+    def client(self):
+        """
+        AsyncOpenAI, tạo ở lời gọi đầu tiên: import openai mất gần một giây nên không làm lúc khởi động.
+        """
+        if self._client is None:
+            from openai import AsyncOpenAI
+
+            # Thử lại do LLMScheduler đảm nhận (backoff chung cho cả hàng đợi)
+            self._client = AsyncOpenAI(api_key=self._api_key, http_client=self._http_client, max_retries=0)
+        return self._client
+
+    async def chat_completion(self, cache: bool = False, **kwargs):
+        """
+        Gọi chat.completions.create, chờ tới lượt nếu đã đủ số lời gọi đồng thời hoặc chạm hạn mức.
+        cache=True: dùng lại kết quả của request giống hệt (chỉ với temperature thấp).
+        Request giống hệt đang chạy dở thì chờ chung kết quả thay vì gọi model lần nữa.
+        """
+        if self.singleflight is None or kwargs.get("temperature", 1.0) > LLM_COALESCE_MAX_TEMPERATURE:
+            return await self._cached_completion(cache, kwargs)
+
+        key = coalesce_key(kwargs)
+        if self.singleflight.in_flight(key):
+            metrics.count_llm_request(kwargs.get("model", ""), "coalesced")
+        return await self.singleflight.do(key, lambda: self._cached_completion(cache, kwargs))
+
+    async def _cached_completion(self, cache: bool, kwargs: dict):
+        model = kwargs.get("model", "")
+        if not (cache and self.cache is not None and self.cache.is_cacheable(kwargs)):
+            metrics.count_llm_request(model, "off")
+            return await self._create(**kwargs)
+
+        key = make_cache_key(kwargs)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            from openai.types.chat import ChatCompletion
+
+            metrics.count_llm_request(model, "hit")
+            return ChatCompletion.model_validate_json(cached)
+
+        metrics.count_llm_request(model, "miss")
+        response = await self._create(**kwargs)
+        await self.cache.set(key, response.model_dump_json())
+        return response
+
+    async def stream_chat_completion(self, **kwargs):
+        """
+        Gọi model ở chế độ stream, sinh ra từng mảnh text ngay khi nhận được.
+        Slot đồng thời được giữ cho đến khi stream kết thúc.
+        """
+        model = kwargs.get("model", "")
+        metrics.count_llm_request(model, "off")
+        start = time.perf_counter()
+
+        async def call():
+            nonlocal start
+            start = time.perf_counter()
+            # include_usage: chunk cuối (không có choices) mang số token của cả lời gọi
+            return await self.client.chat.completions.with_raw_response.create(
+                stream=True, stream_options={"include_usage": True}, **kwargs
+            )
+
+        try:
+            raw = await self.scheduler.run(call, kwargs, hold=True)
+        except Exception:
+            metrics.count_llm_request(model, "error")
+            raise
+
+        usage = None
+        stream = raw.parse()
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception:
+            metrics.count_llm_request(model, "error")
+            raise
+        finally:
+            await stream.close()
+            self.scheduler.release()
+        metrics.observe_llm_call(model, time.perf_counter() - start, usage)
+
+    async def _create(self, **kwargs):
+        model = kwargs.get("model", "")
+        start = time.perf_counter()
+
+        async def call():
+            nonlocal start
+            start = time.perf_counter()
+            return await self.client.chat.completions.with_raw_response.create(**kwargs)
+
+        try:
+            raw = await self.scheduler.run(call, kwargs)
+        except Exception:
+            metrics.count_llm_request(model, "error")
+            raise
+        response = raw.parse()
+        metrics.observe_llm_call(model, time.perf_counter() - start, response.usage)
+        return response
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+        else:
+            await self._http_client.aclose()
+
+
+def preload_openai():
+    """
+    Import openai trước (gọi trong thread nền lúc khởi động) để request đầu tiên không phải chờ.
+    """
+    importlib.import_module("openai.types.chat")
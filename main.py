@@ -1,190 +1,162 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from config import load_env
+from functools import partial
+from fastapi import APIRouter, Body, Depends, FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from openai import OpenAI
-import json
-import re
+from llm import MODEL_NAME
+from subjects import SUPPORTED_SUBJECTS, SubjectEntry, resolve_subject
+from json_extract import extract_json_from_text
+from streaming import IncrementalArrayParser, stream_items_response, stream_json_response
+from objective_grader import grade_objective_questions
+from prompt_templates import (
+    GENERATE, GENERATE_QUESTION, GRADE_ANSWER, GRADE_ESSAY, GRADE_FILE, GRADE_IMAGE, PERFORMANCE_QUESTION,
+    RECENT_TEST, RUBRIC_GRADING, TEACHER_FEEDBACK, TEST_GRADING,
+)
+from schemas import (
+    AnswerGrading, EssayGrading, GeneratedQuestion, GradingVerdict, PerformanceQuestion, QuestionGrading,
+    QuestionGradings, RecentTestQuestions, RubricGrading, TeacherFeedback, output_format, parse_output,
+)
+from prompt_budget import (
+    PROMPT_BUDGET_ANSWER, PROMPT_BUDGET_ESSAY, PROMPT_BUDGET_FILE, PROMPT_BUDGET_RUBRIC, PROMPT_BUDGET_TEST_GRADING,
+    PromptBudget, count_tokens, count_tokens_capped,
+)
+from routing import ROUTING, TIER_MODELS, choose_route, escalation_reason
+from question_bank import QUESTION_BANK_REFILL, QuestionBankRefiller, bank_bucket, normalize_topic
+from jobs import JobHandler, job_view
+from metrics import CONTENT_TYPE_LATEST, label_subject, metrics_middleware, render_metrics, subject_scope
+from services import Services
+import asyncio
 import os
-from dotenv import load_dotenv
-import requests
+import time
 import base64
-import cloudinary
-import cloudinary.api
-import cloudinary.uploader
 
-# Load environment variables from .env file
-load_dotenv()
+load_env()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    services = app.state.services
+    # Import openai / Pillow trong thread nền: request đầu tiên không phải chờ, server vẫn nhận request ngay
+    asyncio.get_running_loop().run_in_executor(None, services.preload)
+    # Worker nạp thêm câu hỏi cho ngân hàng vào giờ thấp điểm
+    refiller = None
+    if services.question_bank is not None and QUESTION_BANK_REFILL:
+        refiller = QuestionBankRefiller(services.question_bank, {
+            "generate_question": partial(_refill_generate_question, services),
+            "recent_test": partial(_refill_recent_test, services),
+            "performance": partial(_refill_performance_question, services),
+        }).start()
+    # Worker chạy job nền (/jobs/...) từ hàng đợi SQLite
+    if services.job_queue is not None:
+        services.job_queue.start()
+    yield
+    if refiller is not None:
+        await refiller.stop()
+    # Đóng pool kết nối dùng chung, ngân hàng câu hỏi, hàng đợi job khi tắt server
+    await services.aclose()
+
+
+# Các endpoint được khai báo trên router; create_app() gắn router vào app
+router = APIRouter()
+
+def get_services(request: Request) -> Services:
+    """
+    Dependency: client dùng chung (OpenAI, tải file, ảnh, ...) của app đang xử lý request.
+    Mỗi app có Services riêng (create_app), handler và hàm phụ nhận Services qua tham số chứ không qua biến global.
+    """
+    return request.app.state.services
 
-app = FastAPI()
 
+# Số bài chấm song song tối đa trong một request /auto-grading/batch
+AUTO_GRADING_BATCH_CONCURRENCY = int(os.getenv("AUTO_GRADING_BATCH_CONCURRENCY", "40"))
 
-cloudinary.config(
-    cloud_name=os.getenv("cloud_name"),
-    api_key=os.getenv("api_key"),
-    api_secret=os.getenv("api_secret"),
-    secure=True
-)
+# /recent-test-grading: số câu mỗi lời gọi model, số lần chấm lại câu thiếu, ngân sách token output mỗi câu
+RECENT_TEST_GRADING_CHUNK_SIZE = int(os.getenv("RECENT_TEST_GRADING_CHUNK_SIZE", "5"))
+RECENT_TEST_GRADING_MAX_RETRIES = int(os.getenv("RECENT_TEST_GRADING_MAX_RETRIES", "2"))
+RECENT_TEST_GRADING_TOKENS_PER_QUESTION = int(os.getenv("RECENT_TEST_GRADING_TOKENS_PER_QUESTION", "350"))
 
-# Global Rubrics for grading
-GLOBAL_RUBRICS = {
-    "Ngữ văn": [
-        {"name": "Đọc hiểu văn bản", "weight": 30},
-        {"name": "Viết (cấu trúc, lập luận)", "weight": 40},
-        {"name": "Diễn đạt & dùng từ", "weight": 20},
-        {"name": "Chính tả, ngữ pháp", "weight": 10}
-    ],
-    "Toán": [
-        {"name": "Đáp án đúng ", "weight": 90},
-        {"name": "Kỹ năng tính toán", "weight": 10},
-     
-    ],
-    "Tiếng Anh": [
-        {"name": "Từ vựng – ngữ pháp", "weight": 30},
-        {"name": "Nghe", "weight": 20},
-        {"name": "Nói", "weight": 20},
-        {"name": "Đọc – Viết", "weight": 30}
-    ],
-    "Vật lí": [
-        {"name": "Hiểu khái niệm, định luật", "weight": 35},
-        {"name": "Vận dụng giải bài tập", "weight": 35},
-        {"name": "Thí nghiệm – quan sát", "weight": 20},
-        {"name": "Trình bày", "weight": 10}
-    ],
-    "Hóa học": [
-        {"name": "Kiến thức hóa học", "weight": 40},
-        {"name": "Phương trình, tính toán", "weight": 30},
-        {"name": "Thực hành – an toàn", "weight": 20},
-        {"name": "Trình bày", "weight": 10}
-    ],
-    "Sinh học": [
-        {"name": "Hiểu kiến thức sinh học", "weight": 40},
-        {"name": "Vận dụng thực tiễn", "weight": 25},
-        {"name": "Quan sát – phân tích", "weight": 25},
-        {"name": "Thuật ngữ khoa học", "weight": 10}
-    ],
-    "Lịch sử": [
-        {"name": "Sự kiện – mốc thời gian", "weight": 40},
-        {"name": "Phân tích – nhận xét", "weight": 30},
-        {"name": "Liên hệ thực tế", "weight": 20},
-        {"name": "Trình bày", "weight": 10}
-    ],
-    "Địa lí": [
-        {"name": "Kiến thức địa lí", "weight": 35},
-        {"name": "Bản đồ – biểu đồ", "weight": 30},
-        {"name": "Phân tích số liệu", "weight": 25},
-        {"name": "Trình bày", "weight": 10}
-    ],
-    "Giáo dục công dân": [
-        {"name": "Đạo đức – pháp luật", "weight": 40},
-        {"name": "Xử lý tình huống", "weight": 30},
-        {"name": "Thái độ, hành vi", "weight": 20},
-        {"name": "Trình bày", "weight": 10}
-    ],
-    "Công nghệ": [
-        {"name": "Kiến thức công nghệ", "weight": 30},
-        {"name": "Kỹ năng thực hành", "weight": 40},
-        {"name": "Sản phẩm / quy trình", "weight": 20},
-        {"name": "An toàn, kỷ luật", "weight": 10}
-    ],
-    "Tin học": [
-        {"name": "Kiến thức tin học", "weight": 30},
-        {"name": "Thao tác máy tính", "weight": 40},
-        {"name": "Tư duy thuật toán", "weight": 20},
-        {"name": "Ý thức sử dụng CNTT", "weight": 10}
-    ],
-    "Thể dục": [
-        {"name": "Kỹ thuật động tác", "weight": 40},
-        {"name": "Thể lực", "weight": 30},
-        {"name": "Ý thức luyện tập", "weight": 20},
-        {"name": "Kỷ luật", "weight": 10}
-    ]
-}
+# /auto-grading/image: số trang tối đa mỗi bài; trang đã tiền xử lý lớn hơn ngưỡng thì gửi URL thay vì base64
+IMAGE_MAX_PAGES = int(os.getenv("IMAGE_MAX_PAGES", "10"))
+IMAGE_PAGE_INLINE_MAX_BYTES = int(os.getenv("IMAGE_PAGE_INLINE_MAX_BYTES", str(1024 * 1024)))
 
-# Subject mapping from English to Vietnamese
-SUBJECT_MAPPING = {
-    "math": "Toán",
-    "van": "Ngữ văn",
-    "english": "Tiếng Anh",
-    "physics": "Vật lí",
-    "chemistry": "Hóa học",
-    "biology": "Sinh học",
-    "geography": "Địa lí",
-    "history": "Lịch sử",
-    "civics": "Giáo dục công dân",
-    "informatics": "Tin học"
-}
+
+async def _bank_take(services: Services, buckets: list, request: BaseModel, recipes: list[dict] | None = None) -> list[dict] | None:
+    """
+    Lấy câu từ ngân hàng cho từng bucket (ghi nhận nhu cầu kèm request gốc để worker nạp lại); None nếu thiếu.
+    """
+    if services.question_bank is None:
+        return None
+    if recipes is None:
+        recipes = [request.model_dump(exclude={"student_id"})] * len(buckets)
+    return await services.question_bank.take(buckets, request.student_id, recipes)
 
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def _bank_store(services: Services, entries: list, student_id: str | None):
+    if services.question_bank is not None:
+        services.question_bank.store(entries, student_id)
 
-# Initialize OpenAI client
-print("Initializing OpenAI client...")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
-MODEL_NAME = "gpt-4o-mini"  # Sử dụng GPT-4o mini cho hiệu quả
-print("OpenAI client initialized")
 
-def extract_json_from_text(text):
+
+async def _prepare_image(services: Services, url: str):
     """
-    Hàm helper để extract JSON từ text response.
-    Thử nhiều pattern khác nhau để tìm JSON hợp lệ.
+    Tải ảnh gốc và tiền xử lý; lỗi thì trả về None để gửi URL ảnh như cũ.
     """
-    # Thử 1: Parse trực tiếp
     try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        pass
-    
-    # Thử 2: Tìm JSON trong code block (```json...```)
-    json_match = re.search(r'```json\s*([\[\{].*?[\]\}])\s*```', text, re.DOTALL)
-    if json_match:
-        try:
-            return json.loads(json_match.group(1))
-        except json.JSONDecodeError:
-            pass
-    
-    # Thử 3: Tìm JSON array [...]
-    array_match = re.search(r'\[\s*\{.*?\}\s*(?:,\s*\{.*?\}\s*)*\]', text, re.DOTALL)
-    if array_match:
-        try:
-            return json.loads(array_match.group(0))
-        except json.JSONDecodeError:
-            pass
-    
-    # Thử 4: Tìm JSON object {...}
-    object_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', text, re.DOTALL)
-    if object_match:
+        fetched = await services.image_fetcher.fetch(url)
+        return await services.image_preprocessor.preprocess(fetched.content)
+    except Exception as e:
+        print(f"Image preprocessing skipped for {url}: {e}")
+        return None
+
+def _image_data_url(prepared) -> str:
+    encoded = base64.b64encode(prepared.content).decode("ascii")
+    return f"data:{prepared.media_type};base64,{encoded}"
+
+async def _image_bytes_url(services: Services, content: bytes) -> str:
+    """
+    Data URL cho ảnh bài làm đã có sẵn bytes (file ảnh, trang PDF scan): tiền xử lý nếu được, không thì gửi nguyên ảnh.
+    """
+    from document_ingest import image_media_type
+
+    if services.image_preprocessor is not None:
         try:
-            return json.loads(object_match.group(0))
-        except json.JSONDecodeError:
-            pass
-    
-    # Thử 5: Xử lý trường hợp có trailing comma
-    cleaned_text = re.sub(r',\s*(\]|\})', r'\1', text)
-    try:
-        return json.loads(cleaned_text)
-    except json.JSONDecodeError:
-        pass
-    
-    return None
+            return _image_data_url(await services.image_preprocessor.preprocess(content))
+        except Exception as e:
+            print(f"Image preprocessing skipped: {e}")
+    encoded = base64.b64encode(content).decode("ascii")
+    return f"data:{image_media_type(content) or 'image/jpeg'};base64,{encoded}"
 
-def readFileFromUrl(url: str) -> str:
-    response = requests.get(url)
-    response.raise_for_status()  # báo lỗi nếu URL sai
-    
-    return response.text
+async def _ingest_page(services: Services, number: int, url: str) -> tuple[str, dict]:
+    """
+    Tiếp nhận một trang bài làm: lấy URL công khai (dùng thẳng / cache / upload) song song với
+    tải + tiền xử lý ảnh để gửi inline. Trả về (URL / data URL gửi cho model, thông tin + thời gian của trang).
+    """
+    start = time.perf_counter()
+
+    async def prepare():
+        if services.image_preprocessor is None:
+            return None, 0.0
+        prepare_start = time.perf_counter()
+        return await _prepare_image(services, url), time.perf_counter() - prepare_start
+
+    ingested, (prepared, prepare_seconds) = await asyncio.gather(services.image_ingestor.ingest(url), prepare())
+    # Trang đã xử lý vẫn quá lớn thì gửi URL công khai, không nhúng base64 vào request
+    inline = prepared is not None and prepared.final_bytes <= IMAGE_PAGE_INLINE_MAX_BYTES
+    page = {
+        "page": number,
+        "source_url": url,
+        "image_url": ingested.url,
+        "image_ingest": ingested.status,
+        "image_preprocess": prepared.summary() if prepared is not None else None,
+        "sent_as": "inline" if inline else "url",
+        "ingest_seconds": round(ingested.seconds, 4),
+        "prepare_seconds": round(prepare_seconds, 4),
+        "seconds": round(time.perf_counter() - start, 4),
+    }
+    return (_image_data_url(prepared) if inline else ingested.url), page
 
-def getUrlFileFormat(url: str) -> str:
-    result = cloudinary.api.resource(url)
-    return result.get("format", "")
-    
 class PromptRequest(BaseModel):
     prompt: str
     task: str = "question_generate_van"  # Default task
@@ -201,12 +173,14 @@ class BaseOnRecentTestRequest(BaseModel):
     recent_tests: list[dict]
     questionTypes: list[str]
     subject: str
+    student_id: str | None = None
     
     
 
 class GenerateQuestionRequest(BaseModel):
     prompt: str
     subject: str  # math, van, english, physics, chemistry, biology, geography, history, civics, informatics
+    student_id: str | None = None  # để ngân hàng câu hỏi không trả lại câu học sinh đã gặp
 
 class TeacherFeedbackRequest(BaseModel):
     teacher_comment: str | list[str]  # Accept both string and list
@@ -214,14 +188,25 @@ class TeacherFeedbackRequest(BaseModel):
     lesson: str
     test_answers: list[dict]
 
+class BatchGradingRequest(BaseModel):
+    items: list[GradingRequest]
+    max_concurrency: int | None = None  # Không vượt quá AUTO_GRADING_BATCH_CONCURRENCY
+
 class AutoGradingRequest(BaseModel):
     exercise_question: str
     fileUrl: str
     subject: str  
 
+class ImageGradingRequest(BaseModel):
+    exercise_question: str
+    subject: str
+    fileUrl: str | None = None  # bài làm một trang
+    fileUrls: list[str] = []  # bài làm nhiều trang, theo đúng thứ tự trang (dùng thay cho fileUrl)
+
 class PerformanceQuestionRequest(BaseModel):
     subject: str
     recent_tests: list[dict]  # List of test info with subject, title, score, submissionTime
+    student_id: str | None = None
 
 # Request model for recent test grading
 class RecentTestGradingRequest(BaseModel):
@@ -236,19 +221,16 @@ class RubricGradingRequest(BaseModel):
     rubric_criteria: list[dict]  # List of {name, weight, description?}
     student_name: str = "Học sinh"
     
-@app.get("/")
+@router.get("/")
 def read_root():
     return {"message": "Văn học AI API", "status": "running"}
 
-@app.post("/generate")
-async def generate_response(request: PromptRequest):
+@router.post("/generate")
+async def generate_response(request: PromptRequest, services: Services = Depends(get_services)):
     try:
-        response = client.chat.completions.create(
+        response = await services.llm.chat_completion(
             model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": "Bạn là trợ lý AI chuyên về văn học Việt Nam."},
-                {"role": "user", "content": request.prompt}
-            ],
+            **GENERATE.params(prompt=request.prompt),
             max_tokens=request.max_tokens,
             temperature=request.temperature,
             top_p=request.top_p
@@ -273,152 +255,56 @@ async def generate_response(request: PromptRequest):
             "error": str(e)
         }
 
-@app.post("/generate_question")
-async def generate_question(request: GenerateQuestionRequest):
+async def _generate_question_result(services: Services, config: SubjectEntry, prompt_text: str) -> dict | None:
+    """
+    Sinh một câu hỏi bằng model; trả về {question, answer, difficulty} hoặc None nếu JSON không hợp lệ.
+    """
+    response = await services.llm.chat_completion(
+        model=MODEL_NAME,
+        **GENERATE_QUESTION.params({"config": config}, config.key, prompt=prompt_text),
+        max_tokens=1024,
+        temperature=0.3,
+        top_p=0.8,
+        **output_format(GeneratedQuestion, {"type": "json_object"})
+    )
+    
+    result = parse_output(GeneratedQuestion, response.choices[0].message.content)
+    return result.model_dump() if result is not None else None
+
+
+@router.post("/generate_question")
+async def generate_question(request: GenerateQuestionRequest, services: Services = Depends(get_services)):
     """
     Tạo câu hỏi cho bất kỳ môn học THCS nào
     Subjects: math, van, english, physics, chemistry, biology, geography, history, civics, informatics
+    Yêu cầu đã có đủ câu trong ngân hàng (học sinh chưa gặp) được trả ngay, không gọi model.
     """
-    # Định nghĩa thông tin cho từng môn học
-    subject_config = {
-        "math": {
-            "name": "Toán",
-            "system_prompt": "Bạn là giáo viên Toán THCS. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "question": "Cho A = {1,2,3} và B = {2,3,4}. Tìm A giao B.",
-                "answer": "A giao B là tập hợp các phần tử thuộc cả A và B. Các phần tử chung là 2 và 3. Vậy A giao B = {2,3}.",
-                "difficulty": "easy"
-            }
-        },
-        "van": {
-            "name": "Ngữ văn",
-            "system_prompt": "Bạn là giáo viên Ngữ văn THCS. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "question": "Phân tích hình ảnh người lái đò trong tác phẩm 'Người lái đò sông Đà' của Nguyễn Tuân.",
-                "answer": "Người lái đò là hình ảnh người lao động chân chất, giản dị. Tác giả miêu tả ông qua ngoại hình, cử chỉ và lời nói, thể hiện sức mạnh và tình yêu nghề nghiệp. Hình ảnh này ca ngợi vẻ đẹp của người lao động Việt Nam.",
-                "difficulty": "medium"
-            }
-        },
-        "english": {
-            "name": "Tiếng Anh",
-            "system_prompt": "Bạn là giáo viên Tiếng Anh THCS. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "question": "Fill in the blank: She _____ to school every day. (go/goes)",
-                "answer": "Đáp án: goes. Giải thích: Chủ ngữ 'She' là ngôi thứ 3 số ít nên động từ phải thêm 's/es'. Do đó ta dùng 'goes'.",
-                "difficulty": "easy"
-            }
-        },
-        "physics": {
-            "name": "Vật lý",
-            "system_prompt": "Bạn là giáo viên Vật lý THCS. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "question": "Một vật chuyển động đều với vận tốc 36 km/h trong 2 giờ. Tính quãng đường vật đi được.",
-                "answer": "Quãng đường = vận tốc × thời gian = 36 km/h × 2h = 72 km. Vậy quãng đường vật đi được là 72 km.",
-                "difficulty": "easy"
-            }
-        },
-        "chemistry": {
-            "name": "Hóa học",
-            "system_prompt": "Bạn là giáo viên Hóa học THCS. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "question": "Viết phương trình hóa học của phản ứng giữa natri (Na) và nước (H₂O).",
-                "answer": "Phương trình: 2Na + 2H₂O → 2NaOH + H₂. Giải thích: Natri là kim loại kiềm hoạt động mạnh, phản ứng với nước tạo dung dịch bazơ natri hydroxit và giải phóng khí hydro.",
-                "difficulty": "medium"
-            }
-        },
-        "biology": {
-            "name": "Sinh học",
-            "system_prompt": "Bạn là giáo viên Sinh học THCS. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "question": "Nêu chức năng chính của hệ tuần hoàn ở động vật có xương sống.",
-                "answer": "Hệ tuần hoàn có các chức năng: 1) Vận chuyển oxy và chất dinh dưỡng đến các tế bào, 2) Đưa CO₂ và chất thải ra khỏi cơ thể, 3) Điều hòa thân nhiệt, 4) Bảo vệ cơ thể chống bệnh tật.",
-                "difficulty": "easy"
-            }
-        },
-        "geography": {
-            "name": "Địa lý",
-            "system_prompt": "Bạn là giáo viên Địa lý THCS. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "question": "Nêu đặc điểm khí hậu nhiệt đới gió mùa ở Việt Nam.",
-                "answer": "Khí hậu nhiệt đới gió mùa có đặc điểm: 1) Nhiệt độ cao quanh năm (trung bình >20°C), 2) Có 2 mùa rõ rệt: mùa mưa và mùa khô, 3) Lượng mưa lớn tập trung vào mùa hè, 4) Chịu ảnh hưởng của gió mùa Đông Bắc và Tây Nam.",
-                "difficulty": "easy"
-            }
-        },
-        "history": {
-            "name": "Lịch sử",
-            "system_prompt": "Bạn là giáo viên Lịch sử THCS. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "question": "Nêu ý nghĩa lịch sử của chiến thắng Bạch Đằng năm 938.",
-                "answer": "Ý nghĩa: 1) Đánh bại quân Nam Hán, kết thúc 1000 năm Bắc thuộc, 2) Mở ra thời kỳ độc lập tự chủ cho dân tộc Việt Nam, 3) Khẳng định ý chí tự chủ và năng lực quân sự của dân tộc, 4) Ngô Quyền trở thành vua đầu tiên của nước Việt Nam độc lập.",
-                "difficulty": "medium"
-            }
-        },
-        "civics": {
-            "name": "Giáo dục Công dân",
-            "system_prompt": "Bạn là giáo viên Giáo dục Công dân THCS. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "question": "Nêu quyền và nghĩa vụ cơ bản của công dân Việt Nam.",
-                "answer": "Quyền: 1) Quyền bình đẳng, 2) Quyền tự do ngôn luận, 3) Quyền bầu cử và ứng cử, 4) Quyền được học tập. Nghĩa vụ: 1) Tuân thủ pháp luật, 2) Bảo vệ Tổ quốc, 3) Nộp thuế, 4) Giữ gìn môi trường.",
-                "difficulty": "easy"
-            }
-        },
-        "informatics": {
-            "name": "Tin học",
-            "system_prompt": "Bạn là giáo viên Tin học THCS. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "question": "Viết chương trình Python tính tổng hai số a và b.",
-                "answer": "Code:\na = int(input('Nhập số a: '))\nb = int(input('Nhập số b: '))\ntong = a + b\nprint('Tổng =', tong)\n\nGiải thích: Chương trình nhận 2 số từ người dùng, cộng lại và in kết quả.",
-                "difficulty": "easy"
-            }
-        }
-    }
-    
-    # Kiểm tra subject hợp lệ
-    if request.subject not in subject_config:
+    config = resolve_subject(request.subject)
+    label_subject(request.subject)
+    if config is None:
         return {
             "success": False,
-            "error": f"Môn học '{request.subject}' không hợp lệ. Các môn học hỗ trợ: {', '.join(subject_config.keys())}"
+            "error": f"Môn học '{request.subject}' không hợp lệ. Các môn học hỗ trợ: {SUPPORTED_SUBJECTS}"
         }
     
     try:
-        config = subject_config[request.subject]
-        
-        prompt = f"""Tạo câu hỏi {config['name']} theo yêu cầu: {request.prompt}
-
-Trả về JSON với format SAU (KHÔNG thêm text khác):
-{{"question": "câu hỏi", "answer": "lời giải chi tiết", "difficulty": "easy"}}
+        bucket = bank_bucket("generate_question", config.key, request.prompt)
+        served = await _bank_take(services, [bucket], request)
+        if served is not None:
+            result, source = served[0], "bank"
+        else:
+            result, source = await _generate_question_result(services, config, request.prompt), "model"
+            if result is not None:
+                _bank_store(services, [(bucket, result)], request.student_id)
 
-Ví dụ:
-{json.dumps(config['example'], ensure_ascii=False)}"""
-        
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": config['system_prompt']},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1024,
-            temperature=0.3,
-            top_p=0.8,
-            response_format={"type": "json_object"}
-        )
-        
-        response_text = response.choices[0].message.content
-        result = extract_json_from_text(response_text)
-        
-        # Validate JSON structure
-        if result and isinstance(result, dict):
-            if "question" in result and "answer" in result:
-                if isinstance(result.get("question"), str) and isinstance(result.get("answer"), str):
-                    if "difficulty" not in result:
-                        result["difficulty"] = "medium"
-                    
-                    return {
-                        "success": True,
-                        "result": result,
-                        "subject": request.subject,
-                        "prompt": request.prompt
-                    }
+        if result is not None:
+            return {
+                "success": True,
+                "result": result,
+                "subject": request.subject,
+                "prompt": request.prompt,
+                "source": source
+            }
         
         return {
             "success": False,
@@ -434,164 +320,175 @@ Ví dụ:
         }
 
 
-@app.post('/auto-grading')
-async def auto_grading(request: GradingRequest):
+def _grading_signals(result) -> dict:
+    # Điểm (thang 10) và đúng/sai của kết quả chấm, để ModelRouter quyết định có cần leo thang không
+    score = next((getattr(result, name) for name in ("score", "grade", "total_score") if hasattr(result, name)), None)
+    return {"score": score, "is_correct": getattr(result, "isCorrect", None)}
+
+
+async def _grade_answer(services: Services, request: GradingRequest, config: SubjectEntry):
     """
-    Tự động chấm điểm bài tập cho các môn THCS
-    Subjects: math, van, english, physics, chemistry, biology, geography, history, civics, informatics
+    Chấm một bài làm bằng một lời gọi model, dùng prompt + rubric dựng sẵn của môn học.
     """
-    subject_grading_prompts = {
-        "math": "Bạn là giáo viên Toán THCS. Hãy chấm điểm bài làm toán dựa trên các bước giải và kết quả cuối cùng.",
-        "van": "Bạn là giáo viên Ngữ văn THCS. Hãy chấm điểm bài làm văn dựa trên nội dung, lập luận và diễn đạt.",
-        "english": "Bạn là giáo viên Tiếng Anh THCS. Hãy chấm điểm bài làm tiếng Anh dựa trên ngữ pháp, từ vựng và ý tưởng.",
-        "physics": "Bạn là giáo viên Vật lý THCS. Hãy chấm điểm bài làm vật lý dựa trên phương pháp giải và kết quả.",
-        "chemistry": "Bạn là giáo viên Hóa học THCS. Hãy chấm điểm bài làm hóa học dựa trên các phản ứng và tính toán.",
-        "biology": "Bạn là giáo viên Sinh học THCS. Hãy chấm điểm bài làm sinh học dựa trên kiến thức và phân tích.",
-        "geography": "Bạn là giáo viên Địa lý THCS. Hãy chấm điểm bài làm địa lý dựa trên hiểu biết về địa hình và khí hậu.",
-        "history": "Bạn là giáo viên Lịch sử THCS. Hãy chấm điểm bài làm lịch sử dựa trên sự kiện và phân tích lịch sử.",
-        "civics": "Bạn là giáo viên Giáo dục Công dân THCS. Hãy chấm điểm bài làm GDCD dựa trên quyền và nghĩa vụ công dân.",
-        "informatics": "Bạn là giáo viên Tin học THCS. Hãy chấm điểm bài làm tin học dựa trên code và logic."
+    budget = PromptBudget(PROMPT_BUDGET_ANSWER)
+    student_answer = budget.fit("student_answer", request.student_answer)
+
+    # Quy tắc chấm + rubric của môn là tiền tố chung; đề bài và bài làm ở cuối
+    prompt = GRADE_ANSWER.params(
+        {"config": config}, config.key, exercise_question=request.exercise_question, student_answer=student_answer
+    )
+    budget.count(prompt["messages"])
+    # Bài làm ngắn (phần lớn lưu lượng) dùng model nhỏ nhất; điểm sát ngưỡng / model không chắc thì chấm lại
+    route = choose_route("auto-grading", config.key, count_tokens(student_answer), max_tokens=512, confidence=True)
+    response, grading_result = await services.router.complete(
+        services.llm, route, lambda text: parse_output(AnswerGrading, text), _grading_signals,
+        cache=True,
+        **prompt,
+        temperature=0.3,
+        top_p=0.9,
+        **output_format(AnswerGrading, {"type": "json_object"})
+    )
+
+    response_text = response.choices[0].message.content
+
+    return {
+        "success": True,
+        "grading_response": grading_result.model_dump() if grading_result is not None else response_text,
+        "exercise_question": request.exercise_question,
+        "subject": request.subject,
+        "prompt_budget": budget.report()
     }
 
-    if request.subject not in subject_grading_prompts:
+
+@router.post('/auto-grading')
+async def auto_grading(request: GradingRequest, services: Services = Depends(get_services)):
+    """
+    Tự động chấm điểm bài tập cho các môn THCS
+    Subjects: math, van, english, physics, chemistry, biology, geography, history, civics, informatics
+    """
+    config = resolve_subject(request.subject)
+    label_subject(request.subject)
+    if config is None:
         return {
             "success": False,
-            "error": f"Môn học '{request.subject}' không hợp lệ. Các môn học hỗ trợ: {', '.join(subject_grading_prompts.keys())}"
+            "error": f"Môn học '{request.subject}' không hợp lệ. Các môn học hỗ trợ: {SUPPORTED_SUBJECTS}"
         }
 
     try:
-        grading_prompt = subject_grading_prompts[request.subject]
-        
-        # Get rubric for the subject
-        subject_vietnamese = SUBJECT_MAPPING.get(request.subject, "")
-        rubric_criteria = GLOBAL_RUBRICS.get(subject_vietnamese, [])
-        
-        rubric_text = ""
-        if rubric_criteria:
-            rubric_text = "\n\nTiêu chí chấm điểm (Rubric):\n"
-            for criterion in rubric_criteria:
-                rubric_text += f"- {criterion['name']}: {criterion['weight']}%\n"
-
-        prompt = f"""{grading_prompt}
-
-Đề bài: {request.exercise_question}
-
-Bài làm của học sinh:
-{request.student_answer}{rubric_text}
-
-Hãy đưa ra điểm số từ 0-10 và nhận xét chi tiết về bài làm dựa trên các tiêu chí rubric.
-
-Trả về format JSON:
-{{"isCorrect": <true || false>, "comments": "<nhận xét chi tiết về bài làm theo từng tiêu chí rubric>", "score": <điểm số từ 0-10>}}
-"""
-
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": grading_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=512,
-            temperature=0.3,
-            top_p=0.9,
-            response_format={"type": "json_object"}
-        )
-
-        response_text = response.choices[0].message.content
-        grading_result = extract_json_from_text(response_text)
-
-        return {
-            "success": True,
-            "grading_response": grading_result if grading_result is not None else response_text,
-            "exercise_question": request.exercise_question,
-            "subject": request.subject
-        }
+        return await _grade_answer(services, request, config)
 
     except Exception as e:
         return {
             "success": False,
             "error": str(e)
         }
+
+
+@router.post('/auto-grading/batch')
+async def auto_grading_batch(request: BatchGradingRequest, services: Services = Depends(get_services)):
+    """
+    Chấm điểm hàng loạt nhiều bài làm cùng lúc (ví dụ cả lớp nộp một bài kiểm tra).
+    Các bài được chấm song song tối đa max_concurrency bài, kết quả trả về theo đúng thứ tự đầu vào.
+    """
+    # Tra cứu môn học (prompt + rubric dựng sẵn) một lần cho mỗi môn trong batch
+    contexts = {}
+    for item in request.items:
+        if item.subject not in contexts:
+            contexts[item.subject] = resolve_subject(item.subject)
+    label_subject(list(contexts))
+
+    limit = min(request.max_concurrency or AUTO_GRADING_BATCH_CONCURRENCY, AUTO_GRADING_BATCH_CONCURRENCY)
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def grade_item(index: int, item: GradingRequest):
+        config = contexts[item.subject]
+        if config is None:
+            return {
+                "index": index,
+                "success": False,
+                "error": f"Môn học '{item.subject}' không hợp lệ. Các môn học hỗ trợ: {SUPPORTED_SUBJECTS}"
+            }
+        async with semaphore:
+            try:
+                with subject_scope(item.subject):
+                    result = await _grade_answer(services, item, config)
+            except Exception as e:
+                return {"index": index, "success": False, "error": str(e)}
+        return {"index": index, **result}
+
+    results = await asyncio.gather(*(grade_item(i, item) for i, item in enumerate(request.items)))
+    succeeded = sum(1 for r in results if r["success"])
+
+    return {
+        "success": True,
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
+    }
     
-@app.post('/auto-grading/file')
-async def auto_grading(request: AutoGradingRequest):
+@router.post('/auto-grading/file')
+async def auto_grading_file(request: AutoGradingRequest, services: Services = Depends(get_services)):
     """
     Tự động chấm điểm bài tập từ file URL cho các môn THCS
     Subjects: math, van, english, physics, chemistry, biology, geography, history, civics, informatics
+    File text, PDF, DOCX được tách text để chấm; file ảnh và PDF scan được chấm bằng vision model.
     """
-    subject_grading_prompts = {
-        "math": "Bạn là giáo viên Toán THCS. Hãy chấm điểm bài làm toán dựa trên các bước giải và kết quả cuối cùng.",
-        "van": "Bạn là giáo viên Ngữ văn THCS. Hãy chấm điểm bài làm văn dựa trên nội dung, lập luận và diễn đạt.",
-        "english": "Bạn là giáo viên Tiếng Anh THCS. Hãy chấm điểm bài làm tiếng Anh dựa trên ngữ pháp, từ vựng và ý tưởng.",
-        "physics": "Bạn là giáo viên Vật lý THCS. Hãy chấm điểm bài làm vật lý dựa trên phương pháp giải và kết quả.",
-        "chemistry": "Bạn là giáo viên Hóa học THCS. Hãy chấm điểm bài làm hóa học dựa trên các phản ứng và tính toán.",
-        "biology": "Bạn là giáo viên Sinh học THCS. Hãy chấm điểm bài làm sinh học dựa trên kiến thức và phân tích.",
-        "geography": "Bạn là giáo viên Địa lý THCS. Hãy chấm điểm bài làm địa lý dựa trên hiểu biết về địa hình và khí hậu.",
-        "history": "Bạn là giáo viên Lịch sử THCS. Hãy chấm điểm bài làm lịch sử dựa trên sự kiện và phân tích lịch sử.",
-        "civics": "Bạn là giáo viên Giáo dục Công dân THCS. Hãy chấm điểm bài làm GDCD dựa trên quyền và nghĩa vụ công dân.",
-        "informatics": "Bạn là giáo viên Tin học THCS. Hãy chấm điểm bài làm tin học dựa trên code và logic."
-    }
-
-    if request.subject not in subject_grading_prompts:
+    config = resolve_subject(request.subject)
+    label_subject(request.subject)
+    if config is None:
         return {
             "success": False,
-            "error": f"Môn học '{request.subject}' không hợp lệ. Các môn học hỗ trợ: {', '.join(subject_grading_prompts.keys())}"
+            "error": f"Môn học '{request.subject}' không hợp lệ. Các môn học hỗ trợ: {SUPPORTED_SUBJECTS}"
         }
 
     try:
-        file_content = readFileFromUrl(request.fileUrl)
-        grading_prompt = subject_grading_prompts[request.subject]
-        
-        # Get rubric for the subject
-        subject_vietnamese = SUBJECT_MAPPING.get(request.subject, "")
-        rubric_criteria = GLOBAL_RUBRICS.get(subject_vietnamese, [])
-        
-        rubric_text = ""
-        if rubric_criteria:
-            rubric_text = "\n\nTiêu chí chấm điểm (Rubric):\n"
-            for criterion in rubric_criteria:
-                rubric_text += f"- {criterion['name']}: {criterion['weight']}%\n"
-
-        prompt = f"""{grading_prompt}
-Nội dung bài làm:
-{file_content}
-
-Hãy kiểm tra xem đúng hay sai so với đề bài: {request.exercise_question}{rubric_text}
-
-YÊU CẦU CHẤM:
-- So sánh kết quả và lập luận của bài làm với đề bài.
-- Áp dụng các tiêu chí rubric để đánh giá toàn diện.
-- Nếu kết luận cuối cùng đúng về mặt toán học thì coi là ĐÚNG,
-  kể cả khi cách trình bày khác, thiếu lời giải chi tiết, hoặc dùng từ khác.
-- Chỉ trả về isCorrect = false nếu:
-  + Kết quả cuối cùng sai, HOẶC
-  + Lập luận mâu thuẫn với định nghĩa/toán học cơ bản.
-- Không đánh giá dựa trên hình thức, chính tả, hoặc cách diễn đạt.
-- Nếu bài làm đúng bản chất toán học → isCorrect = true.
-
-TRẢ VỀ DUY NHẤT JSON (không giải thích thêm ngoài comments):
-{{"isCorrect": <true || false>, "comments": "<nhận xét chi tiết về bài làm theo từng tiêu chí rubric>"}}
-"""
+        # Nhận dạng định dạng theo nội dung; text PDF / DOCX được tách (hoặc lấy từ cache theo hash nội dung)
+        fetched = await services.file_fetcher.fetch(request.fileUrl)
+        document = await services.document_ingestor.ingest(fetched)
+        if document.scanned:
+            # Ảnh hoặc PDF scan: chấm bằng vision model như /auto-grading/image, các trang trong một lời gọi
+            model_image_urls = await asyncio.gather(*(_image_bytes_url(services, image) for image in document.images))
+            response_text, grading_result = await _grade_image_answer(
+                services, request.exercise_question, request.subject, tuple(model_image_urls)
+            )
+            return {
+                "success": True,
+                "grading_response": grading_result.model_dump() if grading_result is not None else response_text,
+                "exercise_question": request.exercise_question,
+                "student_answer": None,
+                "document": document.summary()
+            }
 
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": grading_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=512,
+        file_content = document.text
+        # File tải nhầm (rất lớn) bị nén/cắt bớt thay vì gửi nguyên vào prompt
+        budget = PromptBudget(PROMPT_BUDGET_FILE)
+        prompt_content = budget.fit("file_content", file_content)
+
+        prompt = GRADE_FILE.params(
+            {"config": config}, config.key, exercise_question=request.exercise_question, content=prompt_content
+        )
+        budget.count(prompt["messages"])
+        route = choose_route(
+            "auto-grading/file", config.key, count_tokens(prompt_content), max_tokens=512, confidence=True
+        )
+        response, grading_result = await services.router.complete(
+            services.llm, route, lambda text: parse_output(GradingVerdict, text), _grading_signals,
+            **prompt,
             temperature=0.3,
-            top_p=0.9
+            top_p=0.9,
+            **output_format(GradingVerdict)
         )
 
         response_text = response.choices[0].message.content
-        grading_result = extract_json_from_text(response_text)
 
         return {
             "success": True,
-            "grading_response": grading_result if grading_result is not None else response_text,
+            "grading_response": grading_result.model_dump() if grading_result is not None else response_text,
             "exercise_question": request.exercise_question,
             "student_answer" : file_content,
+            "document": document.summary(),
+            "prompt_budget": budget.report()
         }
 
     except Exception as e:
@@ -601,86 +498,85 @@ TRẢ VỀ DUY NHẤT JSON (không giải thích thêm ngoài comments):
         }
 
 
-@app.post("/auto-grading/image")
-async def autograding_image(request: AutoGradingRequest):
+async def _grade_image_answer(services: Services, exercise_question: str, subject: str, model_image_urls: tuple):
+    """
+    Chấm bài làm dạng ảnh (một hoặc nhiều trang, theo thứ tự) bằng một lời gọi vision model.
+    Trả về (output của model, GradingVerdict hoặc None nếu không đọc được).
+    """
+    # Get rubric for the subject
+    config = resolve_subject(subject)
+    label_subject(subject)
+    subject_name = config.name if config is not None else subject
+    rubric_text = config.rubric_text if config is not None else ""
+    pages = len(model_image_urls)
+
+    # Sử dụng Vision API: quy tắc chấm là tiền tố chung, đề bài + ảnh bài làm ở cuối.
+    # Không biết trước độ dài bài làm trong ảnh nên dùng model mặc định (các bậc model đều hỗ trợ vision)
+    route = choose_route(
+        "auto-grading/image", config.key if config is not None else None, question_type="image",
+        max_tokens=512, confidence=True
+    )
+    response, grading_result = await services.router.complete(
+        services.llm, route, lambda text: parse_output(GradingVerdict, text), _grading_signals,
+        **GRADE_IMAGE.params(
+            {"subject_name": subject_name, "rubric_text": rubric_text},
+            config.key if config is not None else None,
+            images=model_image_urls,
+            exercise_question=exercise_question,
+            pages=f"\nBài làm gồm {pages} trang, ảnh gửi kèm theo đúng thứ tự trang." if pages > 1 else "",
+        ),
+        temperature=0.3,
+        top_p=0.9,
+        **output_format(GradingVerdict)
+    )
+    return response.choices[0].message.content, grading_result
+
+
+@router.post("/auto-grading/image")
+async def autograding_image(request: ImageGradingRequest, services: Services = Depends(get_services)):
     print(request)
     """
     Tự động chấm điểm bài tập từ hình ảnh cho các môn THCS
     Subjects: math, van, english, physics, chemistry, biology, geography, history, civics, informatics
+    Bài nhiều trang (fileUrls) được chấm trong một lời gọi vision, các trang gửi theo đúng thứ tự.
     """
-    try:
-        # Tải ảnh từ URL và upload lên Cloudinary để lấy URL công khai
-        upload_result = cloudinary.uploader.upload(request.fileUrl)
-        image_url = upload_result.get("secure_url")
-
-        # Get rubric for the subject
-        subject_vietnamese = SUBJECT_MAPPING.get(request.subject, "")
-        rubric_criteria = GLOBAL_RUBRICS.get(subject_vietnamese, [])
-        
-        rubric_text = ""
-        if rubric_criteria:
-            rubric_text = "\n\nTiêu chí chấm điểm (Rubric):\n"
-            for criterion in rubric_criteria:
-                rubric_text += f"- {criterion['name']}: {criterion['weight']}%\n"
-        
-        # Tạo prompt text cho vision API
-        grading_text = f"""Bạn là giáo viên {request.subject} THCS. Hãy chấm điểm bài làm dựa trên nội dung trong hình ảnh.
-
-Đề bài: {request.exercise_question}{rubric_text}
-
-YÊU CẦU CHẤM:
-- Đọc và phân tích bài làm của học sinh trong hình ảnh
-- So sánh kết quả và lập luận của bài làm với đề bài
-- Áp dụng các tiêu chí rubric để đánh giá toàn diện
-- Nếu kết luận cuối cùng đúng về mặt toán học thì coi là ĐÚNG,
-  kể cả khi cách trình bày khác, thiếu lời giải chi tiết, hoặc dùng từ khác
-- Chỉ trả về isCorrect = false nếu:
-  + Kết quả cuối cùng sai, HOẶC
-  + Lập luận mâu thuẫn với định nghĩa/toán học cơ bản
-- Không đánh giá dựa trên hình thức, chính tả, hoặc cách diễn đạt
-- Nếu bài làm đúng bản chất toán học → isCorrect = true
-
-TRẢ VỀ DUY NHẤT JSON (không giải thích thêm ngoài comments):
-{{"isCorrect": <true || false>, "comments": "<nhận xét chi tiết về bài làm theo từng tiêu chí rubric>"}}
-"""
+    page_urls = request.fileUrls or ([request.fileUrl] if request.fileUrl else [])
+    if not page_urls:
+        return {
+            "success": False,
+            "error": "Cần ít nhất một ảnh bài làm (fileUrl hoặc fileUrls)."
+        }
+    if len(page_urls) > IMAGE_MAX_PAGES:
+        return {
+            "success": False,
+            "error": f"Bài làm có {len(page_urls)} trang, tối đa {IMAGE_MAX_PAGES} trang."
+        }
 
-        # Sử dụng Vision API với content array để gửi cả text và image
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",  # gpt-4o-mini hỗ trợ vision
-            messages=[
-                {
-                    "role": "system", 
-                    "content": f"Bạn là giáo viên {request.subject} THCS có khả năng đọc và phân tích hình ảnh bài làm của học sinh."
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": grading_text
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": image_url
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=512,
-            temperature=0.3,
-            top_p=0.9
+    try:
+        # Các trang được tiếp nhận song song; với mỗi trang: lấy URL công khai (dùng thẳng URL Cloudinary,
+        # dùng lại kết quả upload cũ, hoặc upload trong thread riêng) cùng lúc với tải + tiền xử lý ảnh gốc
+        # để gửi inline (base64), nhẹ hơn nhiều so với ảnh gốc
+        start = time.perf_counter()
+        ingested = await asyncio.gather(*(_ingest_page(services, i, url) for i, url in enumerate(page_urls, 1)))
+        ingest_seconds = time.perf_counter() - start
+        model_image_urls = tuple(model_url for model_url, _ in ingested)
+        pages = [page for _, page in ingested]
+
+        response_text, grading_result = await _grade_image_answer(
+            services, request.exercise_question, request.subject, model_image_urls
         )
 
-        response_text = response.choices[0].message.content
-        grading_result = extract_json_from_text(response_text)
-
         return {
             "success": True,
-            "grading_response": grading_result if grading_result is not None else response_text,
+            "grading_response": grading_result.model_dump() if grading_result is not None else response_text,
             "exercise_question": request.exercise_question,
-            "student_answer_image_url": image_url
+            # Các trường của trang đầu giữ nguyên như khi chỉ nhận một ảnh
+            "student_answer_image_url": pages[0]["image_url"],
+            "student_answer_image_urls": [page["image_url"] for page in pages],
+            "image_ingest": pages[0]["image_ingest"],
+            "image_preprocess": pages[0]["image_preprocess"],
+            "pages": pages,
+            "ingest_seconds": round(ingest_seconds, 4)
         }
     except Exception as e:
         return {
@@ -688,71 +584,74 @@ TRẢ VỀ DUY NHẤT JSON (không giải thích thêm ngoài comments):
             "error": str(e)
         }
     
-@app.get("/health")
-def health_check():
+@router.get("/health")
+async def health_check(services: Services = Depends(get_services)):
+    # Chỉ báo trạng thái client đã tạo, không tạo client mới cho health check
+    llm = services.peek("llm")
+    question_bank = services.peek("question_bank")
+    job_queue = services.peek("job_queue")
+
+    async def stats(component):
+        # stats() của cache / ngân hàng / hàng đợi đếm bản ghi trong SQLite: chạy trong thread riêng
+        return await asyncio.to_thread(component.stats) if component is not None else None
+
+    response_cache, question_bank_stats, jobs_stats = await asyncio.gather(
+        stats(llm.cache if llm is not None else None), stats(question_bank), stats(job_queue)
+    )
     return {
         "status": "healthy",
         "api": "OpenAI",
         "model": MODEL_NAME,
-        "client_initialized": client is not None
+        "routing_models": TIER_MODELS if ROUTING else None,
+        "client_initialized": llm is not None,
+        "response_cache": response_cache,
+        "llm_coalescing": llm.singleflight.stats() if llm is not None and llm.singleflight is not None else None,
+        "llm_scheduler": llm.scheduler.stats() if llm is not None else None,
+        "question_bank": question_bank_stats,
+        "jobs": jobs_stats
     }
     
 
-@app.post("/grade-essay")
-async def grade_essay(request: GradingRequest):
+@router.get("/metrics")
+def metrics_endpoint():
+    """
+    Số liệu theo endpoint / môn học ở định dạng text của Prometheus
+    """
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
+@router.post("/grade-essay")
+async def grade_essay(request: GradingRequest, services: Services = Depends(get_services)):
     """
     Chấm điểm bài văn của học sinh
     """
+    label_subject(request.subject)
     try:
-        prompt = f"""Hãy chấm điểm bài làm văn theo thang điểm 10 và đưa ra nhận xét cụ thể về ưu điểm và hạn chế của bài viết.
-
-Đề bài: {request.exercise_question}
-
-Bài làm của học sinh:
-{request.student_answer}
-
-Hãy đánh giá theo các tiêu chí:
-- Nội dung (40%)
-- Phân tích & lập luận (30%)
-- Diễn đạt & ngôn ngữ (20%)
-- Sáng tạo (10%)
-
-Trả về kết quả dưới dạng JSON với format:
-{{
-    "grade": <điểm số từ 0-10>,
-    "comments": "<nhận xét chi tiết về bài làm>",
-    "criteria_scores": {{
-        "Nội dung": <điểm từ 0-10>,
-        "Phân tích & lập luận": <điểm từ 0-10>,
-        "Diễn đạt & ngôn ngữ": <điểm từ 0-10>,
-        "Sáng tạo": <điểm từ 0-10>
-    }},
-    "strengths": "<điểm mạnh của bài làm>",
-    "weaknesses": "<điểm yếu và hướng cải thiện>"
-}}"""
-        
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": "Bạn là trợ lý AI chuyên về văn học Việt Nam."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=512,
+        budget = PromptBudget(PROMPT_BUDGET_ESSAY)
+        student_answer = budget.fit("student_answer", request.student_answer)
+        prompt = GRADE_ESSAY.params(exercise_question=request.exercise_question, student_answer=student_answer)
+        budget.count(prompt["messages"])
+        # Validate output thành EssayGrading (tên tiêu chí tiếng Việt là alias); điểm sát ngưỡng thì chấm lại
+        config = resolve_subject(request.subject)
+        route = choose_route("grade-essay", config.key if config is not None else None, count_tokens(student_answer),
+                             question_type="essay", max_tokens=512)
+        response, grading_result = await services.router.complete(
+            services.llm, route, lambda text: parse_output(EssayGrading, text), _grading_signals,
+            cache=True,
+            **prompt,
             temperature=0.3,
             top_p=0.9,
-            response_format={"type": "json_object"}
+            **output_format(EssayGrading, {"type": "json_object"})
         )
         
         response_text = response.choices[0].message.content
         
-        # Parse JSON từ response
-        grading_result = extract_json_from_text(response_text)
-        
-        if grading_result:
+        if grading_result is not None:
             return {
                 "success": True,
-                "result": grading_result,
-                "exercise_question": request.exercise_question
+                "result": grading_result.model_dump(by_alias=True),
+                "exercise_question": request.exercise_question,
+                "prompt_budget": budget.report()
             }
         else:
             return {
@@ -760,7 +659,8 @@ Trả về kết quả dưới dạng JSON với format:
                 "result": {
                     "raw_response": response_text
                 },
-                "exercise_question": request.exercise_question
+                "exercise_question": request.exercise_question,
+                "prompt_budget": budget.report()
             }
     
     except Exception as e:
@@ -769,143 +669,121 @@ Trả về kết quả dưới dạng JSON với format:
             "error": str(e)
         }
 
-@app.post("/recent-test")
-async def recent_test(request: BaseOnRecentTestRequest):
+def _recent_test_topic(test: dict) -> str:
+    return test.get("title") or str(test) if isinstance(test, dict) else str(test)
+
+
+def _recent_test_buckets(request: BaseOnRecentTestRequest, config: SubjectEntry) -> list:
+    # Mỗi chủ đề một bucket; loại câu hỏi yêu cầu (Tự luận, Trắc nghiệm, ...) tách thành ngân hàng riêng
+    variant = normalize_topic(",".join(request.questionTypes or [])).replace("|", "/")
+    return [
+        bank_bucket("recent_test", config.key, _recent_test_topic(test), variant=variant)
+        for test in request.recent_tests
+    ]
+
+
+def _recent_test_result(services: Services, request: BaseOnRecentTestRequest, config: SubjectEntry,
+                        response_text: str, buckets: list):
+    parsed = parse_output(RecentTestQuestions, response_text)
+    quiz_result = [item.model_dump() for item in parsed.questions] if parsed is not None else None
+    
+    if quiz_result:
+        # Lưu vào ngân hàng khi ghép được từng câu với đúng chủ đề (đủ số câu, đúng thứ tự)
+        if len(quiz_result) == len(buckets):
+            _bank_store(services, [
+                (bucket, item) for bucket, item in zip(buckets, quiz_result)
+                if isinstance(item, dict) and isinstance(item.get("question"), str)
+            ], request.student_id)
+        return {
+            "success": True,
+            "questions": quiz_result,
+            "topics": request.recent_tests,
+            "subject": request.subject,
+            "subject_name": config.name,
+            "source": "model"
+        }
+    else:
+        return {
+            "success": True,
+            "questions": [],
+            "raw_response": response_text,
+            "topics": request.recent_tests,
+            "subject": request.subject,
+            "subject_name": config.name
+        }
+
+
+def _recent_test_params(request: BaseOnRecentTestRequest, config: SubjectEntry) -> dict:
+    recent_tests_text = "\n".join([f"- {test}" for test in request.recent_tests])
+    
+    # Xử lý questionTypes nếu có
+    question_types_text = ""
+    if hasattr(request, 'questionTypes') and request.questionTypes:
+        question_types_text = "\n\nLoại câu hỏi cần tạo:\n" + "\n".join([f"- {qtype}" for qtype in request.questionTypes])
+    
+    return dict(
+        model=MODEL_NAME,
+        **RECENT_TEST.params(
+            {"config": config}, config.key,
+            topics=recent_tests_text, question_types=question_types_text, count=len(request.recent_tests),
+        ),
+        max_tokens=2048,
+        temperature=0.7,
+        top_p=0.9,
+        **output_format(RecentTestQuestions)
+    )
+
+
+@router.post("/recent-test")
+async def recent_test(request: BaseOnRecentTestRequest, stream: bool = False,
+                      services: Services = Depends(get_services)):
     """
     Tạo câu hỏi dựa trên các chủ đề/bài kiểm tra gần đây cho tất cả các môn học THCS
     Subjects: math, van, english, physics, chemistry, biology, geography, history, civics, informatics
+    Nếu ngân hàng có đủ câu (học sinh chưa gặp) cho mọi chủ đề thì trả ngay, không gọi model.
+    ?stream=true: trả về SSE, mỗi câu hỏi được gửi ngay khi model viết xong
     """
-    # Định nghĩa config cho từng môn học
-    subject_config = {
-        "math": {
-            "name": "Toán",
-            "system_prompt": "Bạn là giáo viên Toán THCS chuyên tạo câu hỏi luyện tập. Hãy luôn tạo đầy đủ số lượng câu hỏi theo yêu cầu.",
-            "question_type": "toán học"
-        },
-        "van": {
-            "name": "Ngữ văn",
-            "system_prompt": "Bạn là giáo viên Ngữ văn THCS chuyên tạo câu hỏi luyện tập. Hãy luôn tạo đầy đủ số lượng câu hỏi theo yêu cầu.",
-            "question_type": "văn học"
-        },
-        "english": {
-            "name": "Tiếng Anh",
-            "system_prompt": "Bạn là giáo viên Tiếng Anh THCS chuyên tạo câu hỏi luyện tập. Hãy luôn tạo đầy đủ số lượng câu hỏi theo yêu cầu.",
-            "question_type": "tiếng Anh"
-        },
-        "physics": {
-            "name": "Vật lý",
-            "system_prompt": "Bạn là giáo viên Vật lý THCS chuyên tạo câu hỏi luyện tập. Hãy luôn tạo đầy đủ số lượng câu hỏi theo yêu cầu.",
-            "question_type": "vật lý"
-        },
-        "chemistry": {
-            "name": "Hóa học",
-            "system_prompt": "Bạn là giáo viên Hóa học THCS chuyên tạo câu hỏi luyện tập. Hãy luôn tạo đầy đủ số lượng câu hỏi theo yêu cầu.",
-            "question_type": "hóa học"
-        },
-        "biology": {
-            "name": "Sinh học",
-            "system_prompt": "Bạn là giáo viên Sinh học THCS chuyên tạo câu hỏi luyện tập. Hãy luôn tạo đầy đủ số lượng câu hỏi theo yêu cầu.",
-            "question_type": "sinh học"
-        },
-        "geography": {
-            "name": "Địa lý",
-            "system_prompt": "Bạn là giáo viên Địa lý THCS chuyên tạo câu hỏi luyện tập. Hãy luôn tạo đầy đủ số lượng câu hỏi theo yêu cầu.",
-            "question_type": "địa lý"
-        },
-        "history": {
-            "name": "Lịch sử",
-            "system_prompt": "Bạn là giáo viên Lịch sử THCS chuyên tạo câu hỏi luyện tập. Hãy luôn tạo đầy đủ số lượng câu hỏi theo yêu cầu.",
-            "question_type": "lịch sử"
-        },
-        "civics": {
-            "name": "Giáo dục Công dân",
-            "system_prompt": "Bạn là giáo viên Giáo dục Công dân THCS chuyên tạo câu hỏi luyện tập. Hãy luôn tạo đầy đủ số lượng câu hỏi theo yêu cầu.",
-            "question_type": "giáo dục công dân"
-        },
-        "informatics": {
-            "name": "Tin học",
-            "system_prompt": "Bạn là giáo viên Tin học THCS chuyên tạo câu hỏi luyện tập. Hãy luôn tạo đầy đủ số lượng câu hỏi theo yêu cầu.",
-            "question_type": "tin học"
-        }
-    }
-    
-    # Kiểm tra subject hợp lệ
-    if request.subject not in subject_config:
+    config = resolve_subject(request.subject)
+    label_subject(request.subject)
+    if config is None:
         return {
             "success": False,
-            "error": f"Môn học '{request.subject}' không hợp lệ. Các môn học hỗ trợ: {', '.join(subject_config.keys())}"
+            "error": f"Môn học '{request.subject}' không hợp lệ. Các môn học hỗ trợ: {SUPPORTED_SUBJECTS}"
         }
     
     try:
-        config = subject_config[request.subject]
-        recent_tests_text = "\n".join([f"- {test}" for test in request.recent_tests])
-        
-        # Xử lý questionTypes nếu có
-        question_types_text = ""
-        if hasattr(request, 'questionTypes') and request.questionTypes:
-            question_types_text = f"\n\nLoại câu hỏi cần tạo:\n" + "\n".join([f"- {qtype}" for qtype in request.questionTypes])
-        
-        prompt = f"""Dựa trên các chủ đề {config['question_type']} sau đây, hãy tạo ra một câu hỏi {config['question_type']} cho mỗi chủ đề.
-
-Môn học: {config['name']}
-
-Các chủ đề:
-{recent_tests_text}{question_types_text}
-
-QUY TẮC QUAN TRỌNG:
-- Trả về ĐÚNG {len(request.recent_tests)} câu hỏi tương ứng với {len(request.recent_tests)} chủ đề
-- Câu hỏi phải phù hợp với môn {config['name']} và chương trình THCS
-- CHỈ trả về JSON array, KHÔNG có text giải thích thêm
-- KHÔNG có dấu phẩy thừa sau phần tử cuối
-- Format chính xác như sau:
-
-[
-    {{
-        "topic": "<tên chủ đề y nguyên>",
-        "question": "<câu hỏi {config['question_type']} liên quan>",
-        "difficulty": "<easy|medium|hard>"
-    }},
-    {{
-        "topic": "<tên chủ đề y nguyên>",
-        "question": "<câu hỏi {config['question_type']} liên quan>",
-        "difficulty": "<easy|medium|hard>"
-    }}
-]
-"""
-        
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": config['system_prompt']},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=2048,
-            temperature=0.7,
-            top_p=0.9
-        )
-        
-        response_text = response.choices[0].message.content
-        
-        # Parse JSON từ response
-        quiz_result = extract_json_from_text(response_text)
-        
-        if quiz_result and isinstance(quiz_result, list):
-            return {
-                "success": True,
-                "questions": quiz_result,
-                "topics": request.recent_tests,
-                "subject": request.subject,
-                "subject_name": config['name']
-            }
-        else:
-            return {
+        buckets = _recent_test_buckets(request, config)
+        recipe = request.model_dump(exclude={"student_id"})
+        served = await _bank_take(services, buckets, request, [dict(recipe, recent_tests=[test]) for test in request.recent_tests])
+        if served is not None:
+            result = {
                 "success": True,
-                "questions": [],
-                "raw_response": response_text,
+                "questions": served,
                 "topics": request.recent_tests,
                 "subject": request.subject,
-                "subject_name": config['name']
+                "subject_name": config.name,
+                "source": "bank"
             }
+            if stream:
+                async def produce(emit):
+                    for index, item in enumerate(served):
+                        emit(None, index, item)
+                    return result
+
+                return stream_items_response(produce)
+            return result
+
+        params = _recent_test_params(request, config)
+
+        if stream:
+            return stream_json_response(
+                services.llm.stream_chat_completion(**params),
+                on_complete=lambda response_text: _recent_test_result(services, request, config, response_text, buckets),
+                root_field="questions"
+            )
+
+        response = await services.llm.chat_completion(**params)
+        return _recent_test_result(services, request, config, response.choices[0].message.content, buckets)
     except Exception as e:
         return {
             "success": False,
@@ -913,124 +791,22 @@ QUY TẮC QUAN TRỌNG:
             "subject": request.subject
         }
 
-@app.post("/analyze-teacher-feedback")
-async def analyze_teacher_feedback(request: TeacherFeedbackRequest):
+@router.post("/analyze-teacher-feedback")
+async def analyze_teacher_feedback(request: TeacherFeedbackRequest, services: Services = Depends(get_services)):
     """
     Phân tích đánh giá của giáo viên và trả về câu hỏi bài tập + gợi ý cải thiện cho tất cả các môn học
     """
-    # Map Vietnamese subject names to English keys
-    subject_name_map = {
-        "Toán": "math",
-        "Ngữ văn": "van",
-        "Tiếng Anh": "english",
-        "Vật lý": "physics",
-        "Hóa học": "chemistry",
-        "Sinh học": "biology",
-        "Địa lý": "geography",
-        "Lịch sử": "history",
-        "Giáo dục Công dân": "civics",
-        "Tin học": "informatics"
-    }
-    
-    # Convert Vietnamese subject name to English key if needed
-    subject_key = subject_name_map.get(request.subject, request.subject.lower())
-    
-    # Định nghĩa config cho từng môn học
-    subject_config = {
-        "math": {
-            "name": "Toán",
-            "system_prompt": "Bạn là giáo viên Toán THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "exercise_question": "Giải phương trình: 2x + 5 = 15",
-                "improve_suggestion": "Em cần rèn luyện thêm kỹ năng chuyển vế và tính toán cẩn thận hơn."
-            }
-        },
-        "van": {
-            "name": "Ngữ văn",
-            "system_prompt": "Bạn là giáo viên Ngữ văn THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "exercise_question": "Nêu cảm nhận của em về nhân vật trong đoạn trích đã học.",
-                "improve_suggestion": "Em cần phân biệt rõ nội dung và nghệ thuật trong bài phân tích."
-            }
-        },
-        "english": {
-            "name": "Tiếng Anh",
-            "system_prompt": "Bạn là giáo viên Tiếng Anh THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "exercise_question": "Rewrite the sentence using past perfect tense: She finished her homework before dinner.",
-                "improve_suggestion": "Em cần ôn lại cấu trúc thì quá khứ hoàn thành và cách sử dụng trong ngữ cảnh."
-            }
-        },
-        "physics": {
-            "name": "Vật lý",
-            "system_prompt": "Bạn là giáo viên Vật lý THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "exercise_question": "Tính lực ma sát khi một vật có khối lượng 5kg trượt trên mặt phẳng ngang với hệ số ma sát 0.3.",
-                "improve_suggestion": "Em cần nắm vững công thức tính lực ma sát và đơn vị đo lường."
-            }
-        },
-        "chemistry": {
-            "name": "Hóa học",
-            "system_prompt": "Bạn là giáo viên Hóa học THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "exercise_question": "Cân bằng phương trình phản ứng: Fe + O₂ → Fe₂O₃",
-                "improve_suggestion": "Em cần rèn luyện kỹ năng cân bằng phương trình hóa học và hiểu rõ quy tắc hóa trị."
-            }
-        },
-        "biology": {
-            "name": "Sinh học",
-            "system_prompt": "Bạn là giáo viên Sinh học THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "exercise_question": "Giải thích quá trình quang hợp ở thực vật và vai trò của diệp lục.",
-                "improve_suggestion": "Em cần hiểu rõ các giai đoạn quang hợp và mối liên hệ giữa chúng."
-            }
-        },
-        "geography": {
-            "name": "Địa lý",
-            "system_prompt": "Bạn là giáo viên Địa lý THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "exercise_question": "Phân tích đặc điểm khí hậu nhiệt đới gió mùa ở miền Nam Việt Nam.",
-                "improve_suggestion": "Em cần nắm vững các yếu tố ảnh hưởng đến khí hậu và cách phân tích bản đồ khí hậu."
-            }
-        },
-        "history": {
-            "name": "Lịch sử",
-            "system_prompt": "Bạn là giáo viên Lịch sử THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "exercise_question": "Phân tích ý nghĩa của cuộc khởi nghĩa Hai Bà Trưng trong lịch sử dân tộc.",
-                "improve_suggestion": "Em cần nắm rõ mốc thời gian và nguyên nhân - kết quả của các sự kiện lịch sử."
-            }
-        },
-        "civics": {
-            "name": "Giáo dục Công dân",
-            "system_prompt": "Bạn là giáo viên Giáo dục Công dân THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "exercise_question": "Trình bày các quyền và nghĩa vụ cơ bản của công dân theo Hiến pháp 2013.",
-                "improve_suggestion": "Em cần hiểu rõ sự khác biệt giữa quyền và nghĩa vụ công dân trong các tình huống cụ thể."
-            }
-        },
-        "informatics": {
-            "name": "Tin học",
-            "system_prompt": "Bạn là giáo viên Tin học THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác.",
-            "example": {
-                "exercise_question": "Viết chương trình nhập vào số nguyên n và in ra tổng các số từ 1 đến n.",
-                "improve_suggestion": "Em cần rèn luyện tư duy thuật toán và cách sử dụng vòng lặp hiệu quả."
-            }
-        }
-    }
-    
-    # Kiểm tra subject hợp lệ
-    if subject_key not in subject_config:
+    # Chấp nhận cả khóa tiếng Anh lẫn tên môn tiếng Việt
+    config = resolve_subject(request.subject)
+    label_subject(request.subject)
+    if config is None:
         return {
             "success": False,
-            "error": f"Môn học '{request.subject}' không hợp lệ. Các môn học hỗ trợ: {', '.join(subject_config.keys())} hoặc tên tiếng Việt"
+            "error": f"Môn học '{request.subject}' không hợp lệ. Các môn học hỗ trợ: {SUPPORTED_SUBJECTS} hoặc tên tiếng Việt"
         }
     
     try:
-        config = subject_config[subject_key]
-        subject_name = config["name"]
-        system_prompt = config["system_prompt"]
-        example = config["example"]
+        subject_name = config.name
         
         # Format teacher comments - handle both string and list
         if isinstance(request.teacher_comment, list):
@@ -1039,54 +815,26 @@ async def analyze_teacher_feedback(request: TeacherFeedbackRequest):
             # If it's a string, keep it as is
             comments_text = request.teacher_comment
         
-        prompt = f"""Dựa trên nhận xét của giáo viên về bài học "{request.lesson}" môn {subject_name}, hãy tạo câu hỏi bài tập và gợi ý cải thiện cho học sinh.
-
-Nhận xét của giáo viên:
-{comments_text}
-
-Bài học: {request.lesson}
-Môn học: {subject_name}
-
-YÊU CẦU:
-- Tạo câu hỏi bài tập phù hợp với nội dung bài học và nhận xét của giáo viên
-- Đưa ra gợi ý cải thiện cụ thể dựa trên điểm yếu trong nhận xét
-- Câu hỏi phải có độ khó vừa phải, phù hợp với trình độ THCS
-- Gợi ý phải thiết thực và có thể áp dụng được
-
-Trả về JSON với format SAU (KHÔNG thêm text khác):
-{{"exercise_question": "<câu hỏi bài tập {subject_name}>", "improve_suggestion": "<gợi ý cải thiện cụ thể>"}}
-
-Ví dụ cho môn {subject_name}:
-{{"exercise_question": "{example['exercise_question']}", "improve_suggestion": "{example['improve_suggestion']}"}}"""
-        
-        response = client.chat.completions.create(
+        response = await services.llm.chat_completion(
             model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
+            **TEACHER_FEEDBACK.params({"config": config}, config.key, lesson=request.lesson, comments=comments_text),
             max_tokens=512,
             temperature=0.3,
             top_p=0.8,
-            response_format={"type": "json_object"}
+            **output_format(TeacherFeedback, {"type": "json_object"})
         )
         
         response_text = response.choices[0].message.content
         
-        # Parse JSON từ response
-        feedback_result = extract_json_from_text(response_text)
-        
-        # Validate JSON structure
-        if feedback_result and isinstance(feedback_result, dict):
-            if "exercise_question" in feedback_result and "improve_suggestion" in feedback_result:
-                if isinstance(feedback_result.get("exercise_question"), str) and isinstance(feedback_result.get("improve_suggestion"), str):
-                    return {
-                        "success": True,
-                        "result": feedback_result,
-                        "teacher_comment": request.teacher_comment,
-                        "subject": subject_name,
-                        "lesson": request.lesson
-                    }
+        feedback_result = parse_output(TeacherFeedback, response_text)
+        if feedback_result is not None:
+            return {
+                "success": True,
+                "result": feedback_result.model_dump(),
+                "teacher_comment": request.teacher_comment,
+                "subject": subject_name,
+                "lesson": request.lesson
+            }
         
         return {
             "success": False,
@@ -1102,137 +850,248 @@ Ví dụ cho môn {subject_name}:
         }
 
 
-@app.post("/recent-test-grading")
-async def recent_test_grading(request: RecentTestGradingRequest):
+def _detailed_result(question_number: int, question_data: dict, grading_data: dict):
+    return {
+        "question_number": question_number,
+        "question": question_data["question"],
+        "student_answer": question_data["student_answer"],
+        "topic": question_data["topic"],
+        "difficulty": question_data["difficulty"],
+        "isCorrect": grading_data.get("isCorrect", False),
+        "score": grading_data.get("score", 0),
+        "comments": grading_data.get("comments", ""),
+        "correct_answer": grading_data.get("correct_answer", "")
+    }
+
+
+def _recent_test_grading_max_tokens(count: int) -> int:
+    return min(2048, 256 + RECENT_TEST_GRADING_TOKENS_PER_QUESTION * count)
+
+
+def _recent_test_grading_params(config: SubjectEntry, numbered: list, budget: PromptBudget,
+                                model: str = MODEL_NAME) -> dict:
+    """
+    Tham số gọi model để chấm một nhóm câu; numbered là danh sách (số thứ tự câu, câu hỏi).
+    Các câu trả lời trong nhóm dùng chung ngân sách PROMPT_BUDGET_TEST_GRADING token.
+    """
+    # Tạo danh sách câu hỏi để chấm (giữ số thứ tự gốc để ghép kết quả theo question_number)
+    answers = budget.fit_many(
+        [f"questions[{number - 1}].student_answer" for number, _ in numbered],
+        [q['student_answer'] for _, q in numbered],
+    )
+    questions_text = ""
+    for (number, q), answer in zip(numbered, answers):
+        questions_text += f"\n{number}. Câu hỏi: {q['question']}\n"
+        questions_text += f"   Chủ đề: {q['topic']}\n"
+        questions_text += f"   Độ khó: {q['difficulty']}\n"
+        questions_text += f"   Câu trả lời của học sinh: {answer}\n"
+
+    # Rubric dựng sẵn trong registry môn học nằm trong tiền tố chung; danh sách câu ở cuối
+    prompt = TEST_GRADING.params({"config": config}, config.key, questions=questions_text, count=len(numbered))
+    budget.count(prompt["messages"])
+    return dict(
+        model=model,
+        **prompt,
+        max_tokens=_recent_test_grading_max_tokens(len(numbered)),
+        temperature=0.3,
+        top_p=0.9,
+        **output_format(QuestionGradings)
+    )
+
+
+def _chunk_questions(numbered: list) -> list[list]:
+    # Chia đều: 11 câu với chunk 5 -> 4/4/3 thay vì 5/5/1, để các nhóm xong gần cùng lúc
+    size = max(1, RECENT_TEST_GRADING_CHUNK_SIZE)
+    count = -(-len(numbered) // size)
+    chunks, start = [], 0
+    for i in range(count):
+        end = start + len(numbered) // count + (1 if i < len(numbered) % count else 0)
+        chunks.append(numbered[start:end])
+        start = end
+    return chunks
+
+
+def _valid_grading(item) -> QuestionGrading | None:
+    try:
+        return QuestionGrading.model_validate(item)
+    except ValueError:
+        return None
+
+
+def _parse_grading_items(response_text: str, numbered: list) -> dict:
+    """
+    Ghép kết quả model với câu hỏi theo question_number; trả về {số thứ tự câu: kết quả chấm}.
+    Phần tử thiếu, sai format hoặc đánh số lạ bị bỏ qua để chấm lại riêng.
+    """
+    parsed = parse_output(QuestionGradings, response_text)
+    if parsed is not None:
+        items = parsed.results
+    else:
+        # Output bị cắt giữa chừng (chạm max_tokens) hoặc có phần tử sai format:
+        # vẫn giữ các phần tử đã đóng hoàn chỉnh (None ở chỗ phần tử hỏng để giữ vị trí)
+        items = [_valid_grading(item) for _, _, item in IncrementalArrayParser().feed(response_text)]
+
+    expected = [number for number, _ in numbered]
+    graded = {}
+    for position, item in enumerate(items):
+        if item is None:
+            continue
+        number = item.question_number
+        if number not in expected:
+            # Model tự đánh số lại từ 1: chỉ tin vị trí khi trả về đủ số phần tử
+            number = expected[position] if len(items) == len(expected) else None
+        if number is not None and number not in graded:
+            graded[number] = item.model_dump()
+    return graded
+
+
+async def _grade_question_chunk(services: Services, config: SubjectEntry, numbered: list, budget: PromptBudget, on_graded=None):
+    """
+    Chấm một nhóm câu; câu nào model trả thiếu hoặc hỏng thì chỉ gửi lại riêng các câu đó.
+    Nhóm toàn câu trả lời ngắn dùng model nhỏ nhất; lần gửi lại (câu thiếu / hỏng, câu có điểm sát ngưỡng
+    hoặc mâu thuẫn với isCorrect) dùng model mạnh hơn một bậc.
+    Trả về ({số thứ tự câu: kết quả chấm}, lỗi gọi model nếu có).
+    """
+    start = time.perf_counter()
+    max_tokens = _recent_test_grading_max_tokens(len(numbered))
+    answer_tokens = max(
+        count_tokens_capped(str(q['student_answer']), PROMPT_BUDGET_TEST_GRADING) for _, q in numbered
+    )
+    route = choose_route(
+        "recent-test-grading", config.key, answer_tokens, max_tokens=max_tokens, fast_max_tokens=max_tokens
+    )
+    stronger = route.escalated()
+    graded, flagged, outcomes, changed, error = {}, {}, {}, 0, None
+    pending = numbered
+    for attempt in range(1 + max(0, RECENT_TEST_GRADING_MAX_RETRIES)):
+        model = route.model if attempt == 0 or stronger is None else stronger.model
+        try:
+            # Lần thử lại không dùng cache để không nhận lại đúng output hỏng
+            params = _recent_test_grading_params(config, pending, budget, model)
+            response = await services.llm.chat_completion(cache=attempt == 0, **params)
+        except Exception as e:
+            # Lỗi tạm thời (429, 5xx, mất kết nối) đã được LLMScheduler thử lại; lỗi còn lại thì dừng
+            error = str(e)
+            break
+        parsed = _parse_grading_items(response.choices[0].message.content, pending)
+        for number, _ in pending:
+            grading_data = parsed.get(number)
+            if attempt == 0:
+                signals = {} if grading_data is None else {
+                    "score": grading_data["score"], "is_correct": grading_data["isCorrect"]
+                }
+                reason = escalation_reason(grading_data, **signals)
+                outcomes[reason or "accepted"] = outcomes.get(reason or "accepted", 0) + 1
+                if reason is not None and grading_data is not None and stronger is not None:
+                    # Giữ kết quả đầu phòng khi chấm lại không thành công
+                    flagged[number] = grading_data
+                    continue
+            if grading_data is not None:
+                first = flagged.pop(number, None)
+                if first is not None and (first["score"], first["isCorrect"]) != (
+                    grading_data["score"], grading_data["isCorrect"]
+                ):
+                    changed += 1
+                graded[number] = grading_data
+                if on_graded is not None:
+                    on_graded(number, grading_data)
+        pending = [(number, q) for number, q in pending if number not in graded]
+        if not pending:
+            break
+    for number, grading_data in flagged.items():
+        graded[number] = grading_data
+        if on_graded is not None:
+            on_graded(number, grading_data)
+    escalated = stronger is not None and any(outcome != "accepted" for outcome in outcomes)
+    services.router.record(
+        route, outcomes, **({"escalated_model": stronger.model, "changed": changed} if escalated else {}),
+        seconds=round(time.perf_counter() - start, 3)
+    )
+    return graded, error
+
+
+def _recent_test_grading_result(request: RecentTestGradingRequest, config: SubjectEntry, graded: dict,
+                                errors: list, budget: PromptBudget):
+    detailed_results = [
+        _detailed_result(number, question_data, graded[number])
+        for number, question_data in enumerate(request.questions, 1)
+        if number in graded
+    ]
+    if not detailed_results:
+        return {
+            "success": False,
+            "error": "Model không trả về kết quả chấm điểm hợp lệ. Vui lòng thử lại.",
+            "errors": errors,
+            "expected_count": len(request.questions),
+            "received_count": 0,
+            "prompt_budget": budget.report()
+        }
+
+    # Thống kê trên các câu đã chấm được; câu lỗi liệt kê trong ungraded_questions
+    total_score = sum([r["score"] for r in detailed_results])
+    average_score = total_score / len(detailed_results)
+    correct_count = sum([1 for r in detailed_results if r["isCorrect"]])
+
+    return {
+        "success": True,
+        "subject": request.subject,
+        "subject_name": config.name,
+        "total_questions": len(request.questions),
+        "graded_count": len(detailed_results),
+        "ungraded_questions": [n for n in range(1, len(request.questions) + 1) if n not in graded],
+        "correct_count": correct_count,
+        "average_score": round(average_score, 2),
+        "rubric_criteria": [dict(c) for c in config.rubric_criteria],
+        "detailed_results": detailed_results,
+        "errors": errors,
+        "prompt_budget": budget.report()
+    }
+
+
+@router.post("/recent-test-grading")
+async def recent_test_grading(request: RecentTestGradingRequest, stream: bool = False,
+                              services: Services = Depends(get_services)):
     """
     Chấm điểm một nhóm câu hỏi dựa trên rubric toàn cục cho môn học
     Subjects: math, van, english, physics, chemistry, biology, geography, history, civics, informatics
+    Câu hỏi được chia thành nhóm RECENT_TEST_GRADING_CHUNK_SIZE câu, chấm song song và ghép theo question_number;
+    câu bị thiếu/hỏng chỉ được chấm lại riêng, không làm hỏng cả request.
+    ?stream=true: trả về SSE, mỗi câu được gửi ngay khi nhóm của nó chấm xong
     """
-    # Định nghĩa config cho từng môn học
-    subject_config = {
-        "math": {"name": "Toán", "system_prompt": "Bạn là giáo viên Toán THCS chuyên chấm điểm bài tập. CHỈ trả về JSON, không có text khác."},
-        "van": {"name": "Ngữ văn", "system_prompt": "Bạn là giáo viên Ngữ văn THCS chuyên chấm điểm bài tập. CHỈ trả về JSON, không có text khác."},
-        "english": {"name": "Tiếng Anh", "system_prompt": "Bạn là giáo viên Tiếng Anh THCS chuyên chấm điểm bài tập. CHỈ trả về JSON, không có text khác."},
-        "physics": {"name": "Vật lý", "system_prompt": "Bạn là giáo viên Vật lý THCS chuyên chấm điểm bài tập. CHỈ trả về JSON, không có text khác."},
-        "chemistry": {"name": "Hóa học", "system_prompt": "Bạn là giáo viên Hóa học THCS chuyên chấm điểm bài tập. CHỈ trả về JSON, không có text khác."},
-        "biology": {"name": "Sinh học", "system_prompt": "Bạn là giáo viên Sinh học THCS chuyên chấm điểm bài tập. CHỈ trả về JSON, không có text khác."},
-        "geography": {"name": "Địa lý", "system_prompt": "Bạn là giáo viên Địa lý THCS chuyên chấm điểm bài tập. CHỈ trả về JSON, không có text khác."},
-        "history": {"name": "Lịch sử", "system_prompt": "Bạn là giáo viên Lịch sử THCS chuyên chấm điểm bài tập. CHỈ trả về JSON, không có text khác."},
-        "civics": {"name": "Giáo dục Công dân", "system_prompt": "Bạn là giáo viên Giáo dục Công dân THCS chuyên chấm điểm bài tập. CHỈ trả về JSON, không có text khác."},
-        "informatics": {"name": "Tin học", "system_prompt": "Bạn là giáo viên Tin học THCS chuyên chấm điểm bài tập. CHỈ trả về JSON, không có text khác."}
-    }
-    
-    # Kiểm tra subject hợp lệ
-    if request.subject not in subject_config:
+    config = resolve_subject(request.subject)
+    label_subject(request.subject)
+    if config is None:
         return {
             "success": False,
-            "error": f"Môn học '{request.subject}' không hợp lệ. Các môn học hỗ trợ: {', '.join(subject_config.keys())}"
+            "error": f"Môn học '{request.subject}' không hợp lệ. Các môn học hỗ trợ: {SUPPORTED_SUBJECTS}"
         }
-    
+    if not request.questions:
+        return {
+            "success": False,
+            "error": "Danh sách câu hỏi trống."
+        }
+
+    chunks = _chunk_questions(list(enumerate(request.questions, 1)))
+    budget = PromptBudget(PROMPT_BUDGET_TEST_GRADING)
+
+    async def grade_all(on_graded=None):
+        results = await asyncio.gather(*(_grade_question_chunk(services, config, chunk, budget, on_graded) for chunk in chunks))
+        graded = {}
+        for chunk_graded, _ in results:
+            graded.update(chunk_graded)
+        errors = sorted({error for _, error in results if error})
+        return _recent_test_grading_result(request, config, graded, errors, budget)
+
     try:
-        config = subject_config[request.subject]
-        
-        # Lấy rubric cho môn học
-        subject_vietnamese = SUBJECT_MAPPING.get(request.subject, "")
-        rubric_criteria = GLOBAL_RUBRICS.get(subject_vietnamese, [])
-        
-        # Format rubric text
-        rubric_text = ""
-        if rubric_criteria:
-            rubric_text = "\n\nTiêu chí đánh giá (Rubric):\n"
-            for criterion in rubric_criteria:
-                rubric_text += f"- {criterion['name']}: {criterion['weight']}%\n"
-        
-        # Tạo danh sách câu hỏi để chấm
-        questions_text = ""
-        for i, q in enumerate(request.questions, 1):
-            questions_text += f"\n{i}. Câu hỏi: {q['question']}\n"
-            questions_text += f"   Chủ đề: {q['topic']}\n"
-            questions_text += f"   Độ khó: {q['difficulty']}\n"
-            questions_text += f"   Câu trả lời của học sinh: {q['student_answer']}\n"
-        
-        prompt = f"""Bạn là giáo viên {config['name']} THCS. Hãy chấm điểm {len(request.questions)} câu hỏi sau theo rubric đã cho.
-
-Môn học: {config['name']}{rubric_text}
-
-Danh sách câu hỏi và câu trả lời của học sinh:{questions_text}
-
-YÊU CẦU CHẤM:
-- Đánh giá MỖI câu hỏi dựa trên độ chính xác, logic và phương pháp giải
-- Áp dụng tiêu chí rubric để đánh giá toàn diện
-- Với mỗi câu: xác định đúng/sai (isCorrect), cho điểm (0-10), và nhận xét chi tiết
-- Điểm phải phản ánh chính xác mức độ đạt được theo từng tiêu chí rubric
-- Nếu câu trả lời đúng về bản chất toán học → isCorrect = true
-- Chỉ đánh giá isCorrect = false nếu kết quả hoặc logic sai rõ ràng
-
-TRẢ VỀ DUY NHẤT JSON array (KHÔNG có text khác, KHÔNG dùng markdown):
-[
-  {{
-    "question_number": 1,
-    "isCorrect": <true || false>,
-    "score": <điểm từ 0-10>,
-    "comments": "Nhận xét chi tiết về bài làm, bao gồm: 1) Đánh giá độ chính xác, 2) Phân tích các tiêu chí rubric, 3) Điểm mạnh/yếu",
-    "correct_answer": "Đáp án đúng và lời giải chi tiết"
-  }},
-  ...
-]
-
-Lưu ý: Phải trả về ĐÚNG {len(request.questions)} kết quả chấm điểm."""
-        
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": config['system_prompt']},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=2048,
-            temperature=0.3,
-            top_p=0.9
-        )
-        
-        response_text = response.choices[0].message.content
-        grading_results = extract_json_from_text(response_text)
-        
-        # Validate response
-        if grading_results and isinstance(grading_results, list) and len(grading_results) == len(request.questions):
-            # Combine results with original questions
-            detailed_results = []
-            for i, (question_data, grading_data) in enumerate(zip(request.questions, grading_results)):
-                detailed_results.append({
-                    "question_number": i + 1,
-                    "question": question_data["question"],
-                    "student_answer": question_data["student_answer"],
-                    "topic": question_data["topic"],
-                    "difficulty": question_data["difficulty"],
-                    "isCorrect": grading_data.get("isCorrect", False),
-                    "score": grading_data.get("score", 0),
-                    "comments": grading_data.get("comments", ""),
-                    "correct_answer": grading_data.get("correct_answer", "")
-                })
-            
-            # Calculate overall statistics
-            total_score = sum([r["score"] for r in detailed_results])
-            average_score = total_score / len(detailed_results)
-            correct_count = sum([1 for r in detailed_results if r["isCorrect"]])
-            
-            return {
-                "success": True,
-                "subject": request.subject,
-                "subject_name": config['name'],
-                "total_questions": len(request.questions),
-                "correct_count": correct_count,
-                "average_score": round(average_score, 2),
-                "rubric_criteria": rubric_criteria,
-                "detailed_results": detailed_results
-            }
-        else:
-            return {
-                "success": False,
-                "error": "Model không trả về đủ kết quả chấm điểm hoặc format không đúng.",
-                "raw_response": response_text,
-                "expected_count": len(request.questions),
-                "received_count": len(grading_results) if isinstance(grading_results, list) else 0
-            }
+        if stream:
+            def produce(emit):
+                def on_graded(number, grading_data):
+                    emit(None, number - 1, _detailed_result(number, request.questions[number - 1], grading_data))
+                return grade_all(on_graded)
+
+            return stream_items_response(produce)
+
+        return await grade_all()
     
     except Exception as e:
         return {
@@ -1240,178 +1099,172 @@ Lưu ý: Phải trả về ĐÚNG {len(request.questions)} kết quả chấm đ
             "error": str(e)
         }
 
-@app.post("/performance/question-generation")
-async def performance_question_generation(request: PerformanceQuestionRequest):
+def _performance_prompt(request: PerformanceQuestionRequest, config: SubjectEntry):
     """
-    Tạo câu hỏi luyện tập hàng ngày dựa trên hiệu suất học tập gần đây của học sinh
-    Trả về JSON theo format dailyPracticeQuestion của student schema
+    Dựng phần prompt riêng của học sinh (hiệu suất gần đây);
+    trả về (prompt, điểm trung bình, chủ đề ưu tiên, mức độ khó).
     """
-    # Định nghĩa thông tin cho từng môn học
-    subject_config = {
-        "math": {
-            "name": "Toán",
-            "system_prompt": "Bạn là giáo viên Toán THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác."
-        },
-        "van": {
-            "name": "Ngữ văn",
-            "system_prompt": "Bạn là giáo viên Ngữ văn THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác."
-        },
-        "english": {
-            "name": "Tiếng Anh",
-            "system_prompt": "Bạn là giáo viên Tiếng Anh THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác."
-        },
-        "physics": {
-            "name": "Vật lý",
-            "system_prompt": "Bạn là giáo viên Vật lý THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác."
-        },
-        "chemistry": {
-            "name": "Hóa học",
-            "system_prompt": "Bạn là giáo viên Hóa học THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác."
-        },
-        "biology": {
-            "name": "Sinh học",
-            "system_prompt": "Bạn là giáo viên Sinh học THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác."
-        },
-        "geography": {
-            "name": "Địa lý",
-            "system_prompt": "Bạn là giáo viên Địa lý THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác."
-        },
-        "history": {
-            "name": "Lịch sử",
-            "system_prompt": "Bạn là giáo viên Lịch sử THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác."
-        },
-        "civics": {
-            "name": "Giáo dục Công dân",
-            "system_prompt": "Bạn là giáo viên Giáo dục Công dân THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác."
-        },
-        "informatics": {
-            "name": "Tin học",
-            "system_prompt": "Bạn là giáo viên Tin học THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác."
-        }
-    }
+    # Tạo thông tin về các bài test gần đây
+    test_info_text = ""
+    recent_topics = []  # Lưu các chủ đề từ test title
+    
+    if request.recent_tests and len(request.recent_tests) > 0:
+        test_info_text = "\n\nThông tin các bài kiểm tra gần đây:\n"
+        for i, test in enumerate(request.recent_tests[:3], 1):  # Chỉ lấy 3 bài gần nhất
+            title = test.get('title', 'N/A')
+            score = test.get('score', 0)
+            test_info_text += f"{i}. Bài: {title} - Điểm: {score}/10\n"
+            
+            # Trích xuất chủ đề từ title
+            if title and title != 'N/A':
+                recent_topics.append({
+                    'title': title,
+                    'score': score
+                })
+    else:
+        test_info_text = "\n\nHọc sinh chưa có kết quả kiểm tra gần đây."
+    
+    # Tạo prompt dựa trên hiệu suất
+    avg_score = 0
+    if request.recent_tests and len(request.recent_tests) > 0:
+        scores = [test.get('score', 0) for test in request.recent_tests if test.get('score')]
+        avg_score = sum(scores) / len(scores) if scores else 0
+    
+    # Xác định độ khó phù hợp
+    if avg_score >= 8:
+        level = "hard"
+        difficulty_guidance = "Tạo câu hỏi ở mức độ NÂNG CAO để thách thức và phát triển năng lực học sinh xuất sắc này."
+    elif avg_score >= 6:
+        level = "medium"
+        difficulty_guidance = "Tạo câu hỏi ở mức độ TRUNG BÌNH để củng cố kiến thức và nâng cao dần năng lực."
+    else:
+        level = "easy"
+        difficulty_guidance = "Tạo câu hỏi ở mức độ CƠ BẢN để giúp học sinh nắm vững kiến thức nền tảng."
     
-    # Kiểm tra subject hợp lệ
-    if request.subject not in subject_config:
+    # Tạo phần hướng dẫn về chủ đề
+    topic_guidance = ""
+    topic = ""
+    if recent_topics:
+        # Ưu tiên chủ đề có điểm thấp nhất (cần cải thiện)
+        lowest_score_topic = min(recent_topics, key=lambda x: x['score'])
+        topic = lowest_score_topic['title']
+        topic_guidance = f"\n\n🎯 CHỦ ĐỀ ƯU TIÊN:\nDựa trên bài kiểm tra '{lowest_score_topic['title']}' (Điểm: {lowest_score_topic['score']}/10), hãy tạo câu hỏi TRỰC TIẾP liên quan đến nội dung này.\n\nYÊU CẦU VỀ CHỦ ĐỀ:\n- Phân tích kỹ tên bài để hiểu rõ kiến thức cần luyện tập (ví dụ: 'Cách đếm số tự nhiên' → tạo câu về đếm, quy luật số)\n- Câu hỏi phải KHỚP với chủ đề trong title, không lệch sang kiến thức khác\n- Nếu title có 'Chương X, Bài Y' thì tập trung vào nội dung cụ thể của bài đó"
+    
+    # Phần chỉ dẫn chung và format JSON nằm trong PERFORMANCE_QUESTION (tiền tố chung)
+    prompt = f"""{test_info_text.strip()}
+
+Điểm trung bình: {avg_score:.1f}/10
+
+Hướng dẫn độ khó: {difficulty_guidance}{topic_guidance}"""
+    return prompt, avg_score, topic, level
+
+
+def _performance_question_params(config: SubjectEntry, prompt: str) -> dict:
+    return dict(
+        model=MODEL_NAME,
+        **PERFORMANCE_QUESTION.params({"config": config}, config.key, prompt=prompt),
+        max_tokens=1024,
+        temperature=0.7,
+        top_p=0.9,
+        **output_format(PerformanceQuestion, {"type": "json_object"})
+    )
+
+
+def _parse_performance_question(response_text: str) -> dict | None:
+    """
+    Đọc câu luyện tập từ output của model: {question, answer, improvement_suggestions} hoặc None.
+    """
+    result = parse_output(PerformanceQuestion, response_text)
+    if result is None:
+        return None
+    # ai_score luôn là 0 (cập nhật sau khi học sinh làm bài) nên không trả về
+    return result.model_dump(include={"question", "answer", "improvement_suggestions"})
+
+
+async def _performance_question_result(services: Services, config: SubjectEntry, prompt: str) -> dict | None:
+    """
+    Gọi model sinh câu luyện tập; trả về {question, answer, improvement_suggestions} hoặc None.
+    """
+    response = await services.llm.chat_completion(**_performance_question_params(config, prompt))
+    return _parse_performance_question(response.choices[0].message.content)
+
+
+def _performance_bank_item(result: dict) -> dict:
+    # improvement_suggestions viết cho riêng học sinh đã gửi request: không lưu vào ngân hàng dùng chung
+    return {"question": result["question"], "answer": result["answer"]}
+
+
+def _performance_suggestions(request: PerformanceQuestionRequest, avg_score: float, topic: str) -> str:
+    """
+    Gợi ý cải thiện cho câu lấy từ ngân hàng, dựng từ kết quả kiểm tra của chính học sinh (không gọi model).
+    """
+    if topic:
+        score = next((test.get("score", 0) for test in request.recent_tests[:3] if test.get("title") == topic), 0)
+        text = (f"Em cần ôn lại nội dung bài '{topic}' (Điểm: {score}/10): đọc lại phần lý thuyết trọng tâm, "
+                f"làm lại các câu đã sai trong bài kiểm tra rồi luyện thêm bài tập cùng dạng.")
+    else:
+        text = "Em chưa có kết quả kiểm tra gần đây: hãy làm câu luyện tập này và đối chiếu đáp án để biết phần cần ôn."
+    if avg_score >= 8:
+        return f"{text} Điểm trung bình {avg_score:.1f}/10 đã tốt, em nên thử thêm các bài nâng cao."
+    if avg_score >= 6:
+        return f"{text} Điểm trung bình {avg_score:.1f}/10: em nên luyện đều mỗi ngày để củng cố kiến thức."
+    return f"{text} Em nên nắm vững kiến thức cơ bản trước khi chuyển sang bài khó hơn."
+
+
+def _performance_question_response(request: PerformanceQuestionRequest, result: dict | None, avg_score: float,
+                                   source: str) -> dict:
+    if result is not None:
         return {
-            "success": False,
-            "error": f"Môn học '{request.subject}' không hợp lệ. Các môn học hỗ trợ: {', '.join(subject_config.keys())}"
+            "success": True,
+            "question": result["question"],
+            "answer": result["answer"],
+            "ai_score": 0,
+            "improvement_suggestions": result["improvement_suggestions"],
+            "subject": request.subject,
+            "average_score": round(avg_score, 2),
+            "source": source
         }
     
-    try:
-        config = subject_config[request.subject]
-        
-        # Tạo thông tin về các bài test gần đây
-        test_info_text = ""
-        recent_topics = []  # Lưu các chủ đề từ test title
-        
-        if request.recent_tests and len(request.recent_tests) > 0:
-            test_info_text = "\n\nThông tin các bài kiểm tra gần đây:\n"
-            for i, test in enumerate(request.recent_tests[:3], 1):  # Chỉ lấy 3 bài gần nhất
-                title = test.get('title', 'N/A')
-                score = test.get('score', 0)
-                test_info_text += f"{i}. Bài: {title} - Điểm: {score}/10\n"
-                
-                # Trích xuất chủ đề từ title
-                if title and title != 'N/A':
-                    recent_topics.append({
-                        'title': title,
-                        'score': score
-                    })
-        else:
-            test_info_text = "\n\nHọc sinh chưa có kết quả kiểm tra gần đây."
-        
-        # Tạo prompt dựa trên hiệu suất
-        avg_score = 0
-        if request.recent_tests and len(request.recent_tests) > 0:
-            scores = [test.get('score', 0) for test in request.recent_tests if test.get('score')]
-            avg_score = sum(scores) / len(scores) if scores else 0
-        
-        # Xác định độ khó phù hợp
-        if avg_score >= 8:
-            difficulty_guidance = "Tạo câu hỏi ở mức độ NÂNG CAO để thách thức và phát triển năng lực học sinh xuất sắc này."
-        elif avg_score >= 6:
-            difficulty_guidance = "Tạo câu hỏi ở mức độ TRUNG BÌNH để củng cố kiến thức và nâng cao dần năng lực."
-        else:
-            difficulty_guidance = "Tạo câu hỏi ở mức độ CƠ BẢN để giúp học sinh nắm vững kiến thức nền tảng."
-        
-        # Tạo phần hướng dẫn về chủ đề
-        topic_guidance = ""
-        if recent_topics:
-            # Ưu tiên chủ đề có điểm thấp nhất (cần cải thiện)
-            lowest_score_topic = min(recent_topics, key=lambda x: x['score'])
-            topic_guidance = f"\n\n🎯 CHỦ ĐỀ ƯU TIÊN:\nDựa trên bài kiểm tra '{lowest_score_topic['title']}' (Điểm: {lowest_score_topic['score']}/10), hãy tạo câu hỏi TRỰC TIẾP liên quan đến nội dung này.\n\nYÊU CẦU VỀ CHỦ ĐỀ:\n- Phân tích kỹ tên bài để hiểu rõ kiến thức cần luyện tập (ví dụ: 'Cách đếm số tự nhiên' → tạo câu về đếm, quy luật số)\n- Câu hỏi phải KHỚP với chủ đề trong title, không lệch sang kiến thức khác\n- Nếu title có 'Chương X, Bài Y' thì tập trung vào nội dung cụ thể của bài đó"
-        
-        prompt = f"""Dựa trên thông tin hiệu suất học tập của học sinh môn {config['name']}, hãy tạo MỘT câu hỏi luyện tập phù hợp.
-
-{test_info_text}
+    return {
+        "success": False,
+        "error": "Model không tạo được JSON hợp lệ với đầy đủ các trường bắt buộc. Vui lòng thử lại.",
+        "subject": request.subject
+    }
 
-Điểm trung bình: {avg_score:.1f}/10
 
-Hướng dẫn độ khó: {difficulty_guidance}{topic_guidance}
-
-YÊU CẦU CHUNG:
-1. Phân tích điểm yếu/mạnh của học sinh dựa trên điểm số
-2. Đề xuất gợi ý cải thiện cụ thể
-3. Tạo câu hỏi PHÙ HỢP CHÍNH XÁC với nội dung bài kiểm tra gần đây
-4. Câu hỏi phải giúp học sinh cải thiện kỹ năng yếu đã được phát hiện
-
-Trả về 3 JSON với format SAU (KHÔNG thêm text khác, KHÔNG dùng markdown):
-{{
-  "question": "Nội dung câu hỏi luyện tập chi tiết, rõ ràng và TRỰC TIẾP liên quan đến chủ đề trong test title",
-  "answer": "Câu trả lời mẫu đầy đủ, có hướng dẫn từng bước giải chi tiết",
-  "ai_score": 0,
-  "improvement_suggestions": "Gợi ý cải thiện CỤ THỂ dựa trên: 1) Phân tích điểm yếu từ bài test (kèm tên bài), 2) Phương pháp học tập phù hợp với chủ đề đó, 3) Kỹ năng cần rèn luyện liên quan trực tiếp đến nội dung bài test"
-}}
-
-Lưu ý: 
-- ai_score luôn là 0 (sẽ được cập nhật sau khi học sinh làm bài)
-- improvement_suggestions phải ĐỀ CẬP CỤ THỂ đến nội dung bài kiểm tra (ví dụ: "Em cần ôn lại phần 'Cách đếm số tự nhiên'...")
-- Câu hỏi phải ĐÚNG chủ đề với test title, không tạo câu chung chung"""
-        
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": config['system_prompt']},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1024,
-            temperature=0.7,
-            top_p=0.9,
-            response_format={"type": "json_object"}
-        )
-        
-        response_text = response.choices[0].message.content
-        result = extract_json_from_text(response_text)
-        
-        # Validate JSON structure
-        if result and isinstance(result, dict):
-            # Kiểm tra các trường bắt buộc
-            required_fields = ["question", "answer", "improvement_suggestions"]
-            if all(field in result for field in required_fields):
-                # Đảm bảo ai_score = 0
-                result["ai_score"] = 0
-                
-                # Validate kiểu dữ liệu
-                if (isinstance(result.get("question"), str) and 
-                    isinstance(result.get("answer"), str) and
-                    isinstance(result.get("improvement_suggestions"), str)):
-                    
-                    return {
-                        "success": True,
-                        "question": result["question"],
-                        "answer": result["answer"],
-                        "ai_score": 0,
-                        "improvement_suggestions": result["improvement_suggestions"],
-                        "subject": request.subject,
-                        "average_score": round(avg_score, 2)
-                    }
-        
+@router.post("/performance/question-generation")
+async def performance_question_generation(request: PerformanceQuestionRequest,
+                                          services: Services = Depends(get_services)):
+    """
+    Tạo câu hỏi luyện tập hàng ngày dựa trên hiệu suất học tập gần đây của học sinh
+    Trả về JSON theo format dailyPracticeQuestion của student schema
+    Câu luyện tập cùng chủ đề ưu tiên + mức độ khó được lấy từ ngân hàng nếu học sinh chưa gặp.
+    """
+    config = resolve_subject(request.subject)
+    label_subject(request.subject)
+    if config is None:
         return {
             "success": False,
-            "error": "Model không tạo được JSON hợp lệ với đầy đủ các trường bắt buộc. Vui lòng thử lại.",
-            "subject": request.subject
+            "error": f"Môn học '{request.subject}' không hợp lệ. Các môn học hỗ trợ: {SUPPORTED_SUBJECTS}"
         }
     
+    try:
+        prompt, avg_score, topic, level = _performance_prompt(request, config)
+
+        bucket = bank_bucket("performance", config.key, topic, difficulty=level)
+        served = await _bank_take(services, [bucket], request)
+        if served is not None:
+            # Câu trong ngân hàng dùng chung cho nhiều học sinh: gợi ý cải thiện dựng lại theo học sinh này
+            result = dict(_performance_bank_item(served[0]),
+                          improvement_suggestions=_performance_suggestions(request, avg_score, topic))
+            source = "bank"
+        else:
+            result, source = await _performance_question_result(services, config, prompt), "model"
+            if result is not None:
+                _bank_store(services, [(bucket, _performance_bank_item(result))], request.student_id)
+
+        return _performance_question_response(request, result, avg_score, source)
+    
     except Exception as e:
         return {
             "success": False,
@@ -1420,15 +1273,76 @@ Lưu ý:
         }
 
 
-@app.post("/grade-with-rubric")
-async def grade_with_rubric(request: RubricGradingRequest):
+# Worker nạp ngân hàng câu hỏi: sinh lại theo request gốc (recipe) đã lưu cùng bucket
+async def _refill_generate_question(services: Services, recipe: dict) -> list[dict]:
+    request = GenerateQuestionRequest(**recipe)
+    result = await _generate_question_result(services, resolve_subject(request.subject), request.prompt)
+    return [result] if result is not None else []
+
+
+async def _refill_recent_test(services: Services, recipe: dict) -> list[dict]:
+    request = BaseOnRecentTestRequest(**recipe)
+    response = await services.llm.chat_completion(**_recent_test_params(request, resolve_subject(request.subject)))
+    parsed = parse_output(RecentTestQuestions, response.choices[0].message.content)
+    if parsed is None:
+        return []
+    return [q.model_dump() for q in parsed.questions[:len(request.recent_tests)]]
+
+
+async def _refill_performance_question(services: Services, recipe: dict) -> list[dict]:
+    request = PerformanceQuestionRequest(**recipe)
+    config = resolve_subject(request.subject)
+    prompt, _, _, _ = _performance_prompt(request, config)
+    result = await _performance_question_result(services, config, prompt)
+    return [_performance_bank_item(result)] if result is not None else []
+
+
+def _rubric_grading_result(request: RubricGradingRequest, grading: RubricGrading | None, response_text: str,
+                           objective_scores: dict, budget: PromptBudget):
+    if grading is not None:
+        grading_result = grading.model_dump()
+        # Ghép điểm các câu khách quan đã chấm bằng luật với các câu model chấm, theo số thứ tự câu
+        if objective_scores:
+            model_scores = [
+                item for item in grading_result["question_scores"] if item["question_number"] not in objective_scores
+            ]
+            grading_result["question_scores"] = sorted(
+                model_scores + list(objective_scores.values()),
+                key=lambda item: item.get("question_number") if isinstance(item.get("question_number"), int) else 0
+            )
+        
+        return {
+            "success": True,
+            "grading_result": grading_result,
+            "test_title": request.test_title,
+            "subject": request.subject,
+            "student_name": request.student_name,
+            "auto_graded_questions": sorted(objective_scores),
+            "prompt_budget": budget.report()
+        }
+    
+    return {
+        "success": False,
+        "error": "Không thể parse kết quả chấm điểm từ AI. Vui lòng thử lại.",
+        "raw_response": response_text
+    }
+
+
+@router.post("/grade-with-rubric")
+async def grade_with_rubric(request: RubricGradingRequest, stream: bool = False,
+                            services: Services = Depends(get_services)):
     """
     Chấm điểm bài tập dựa trên rubric do giáo viên cung cấp.
     Trả về điểm chi tiết theo từng tiêu chí và tổng điểm.
+    Câu khách quan (trắc nghiệm, đúng/sai, đáp số) được chấm tại chỗ bằng objective_grader;
+    model chỉ chấm câu tự luận và nhận xét theo rubric.
+    ?stream=true: trả về SSE, mỗi mục rubric_scores / question_scores được gửi ngay khi hoàn thành
     """
     try:
         # Lấy tên môn học tiếng Việt
-        subject_vn = SUBJECT_MAPPING.get(request.subject, request.subject)
+        config = resolve_subject(request.subject)
+        label_subject(request.subject)
+        subject_vn = config.rubric_name if config is not None else request.subject
         
         # Chuẩn bị thông tin rubric
         rubric_info = ""
@@ -1441,103 +1355,79 @@ async def grade_with_rubric(request: RubricGradingRequest):
                 rubric_info += f" - {description}"
             rubric_info += "\\n"
         
-        # Chuẩn bị thông tin câu hỏi và câu trả lời
-        qa_info = ""
+        # Câu khách quan chấm bằng luật; model chỉ nhận tóm tắt kết quả để nhận xét theo rubric
+        objective_scores = grade_objective_questions(request.questions_and_answers)
+        objective_info = ""
+        if objective_scores:
+            objective_info = "\n📌 CÁC CÂU KHÁCH QUAN ĐÃ CHẤM TỰ ĐỘNG (không cần chấm lại, chỉ dùng để nhận xét):\n"
+            for number, score in objective_scores.items():
+                status = "đúng" if score["is_correct"] else "sai"
+                objective_info += f"- Câu {number}: {status} ({score['student_score']}/{score['max_score']} điểm)\n"
+
+        # Chuẩn bị thông tin câu hỏi và câu trả lời (chỉ các câu cần model chấm);
+        # mọi bài làm dùng chung ngân sách PROMPT_BUDGET_RUBRIC token, bài quá dài bị nén/cắt bớt
+        budget = PromptBudget(PROMPT_BUDGET_RUBRIC)
+        free_numbers = [i for i in range(1, len(request.questions_and_answers) + 1) if i not in objective_scores]
+        student_answers = dict(zip(free_numbers, budget.fit_many(
+            [f"questions_and_answers[{i - 1}].studentAnswer" for i in free_numbers],
+            [request.questions_and_answers[i - 1].get('studentAnswer', 'Chưa trả lời') for i in free_numbers],
+        )))
+        # Đề bài + đáp án mẫu giống nhau với mọi học sinh làm cùng bài kiểm tra nên đứng trước bài làm:
+        # cả lớp dùng chung một tiền tố prompt dài (được OpenAI cache), chỉ phần bài làm là khác
+        questions_info, answers_info = "", ""
         for i, qa in enumerate(request.questions_and_answers, 1):
-            qa_info += f"""
-Câu {i}:
+            if i in objective_scores:
+                continue
+            questions_info += f"""
+Câu {i} ({qa.get('questionType', 'N/A')}, điểm tối đa: {qa.get('grade', 0)}):
 - Đề bài: {qa.get('question', 'N/A')}
-- Loại câu hỏi: {qa.get('questionType', 'N/A')}
-- Điểm tối đa: {qa.get('grade', 0)}
 - Đáp án mẫu: {qa.get('solution', 'N/A')}
-- Bài làm của học sinh: {qa.get('studentAnswer', 'Chưa trả lời')}
 """
+            answers_info += f"\nCâu {i}: {student_answers[i]}\n"
         
-        # Tạo prompt cho AI
-        grading_prompt = f"""Bạn là giáo viên {subject_vn} THCS. Hãy chấm điểm bài làm của học sinh "{request.student_name}" dựa trên rubric sau.
-
-📋 THÔNG TIN BÀI KIỂM TRA:
-- Tên bài: {request.test_title}
-- Môn học: {subject_vn}
-
-📊 RUBRIC ĐÁNH GIÁ:
-{rubric_info}
-
-📝 NỘI DUNG BÀI LÀM:
-{qa_info}
-
-🎯 YÊU CẦU:
-1. Chấm điểm từng tiêu chí trong rubric (0-10 điểm cho mỗi tiêu chí)
-2. Tính điểm theo trọng số: Điểm tiêu chí × (Trọng số/100)
-3. Tổng điểm = Tổng các điểm đã tính trọng số
-4. Nhận xét chi tiết cho từng tiêu chí
-5. Nhận xét tổng thể và gợi ý cải thiện
-
-Trả về JSON với format sau (KHÔNG thêm text khác):
-{{
-    "rubric_scores": [
-        {{
-            "criteria_name": "Tên tiêu chí",
-            "weight": <trọng số>,
-            "score": <điểm 0-10>,
-            "weighted_score": <điểm đã nhân trọng số>,
-            "comment": "Nhận xét cho tiêu chí này"
-        }}
-    ],
-    "question_scores": [
-        {{
-            "question_number": <số thứ tự câu>,
-            "max_score": <điểm tối đa>,
-            "student_score": <điểm học sinh đạt được>,
-            "is_correct": <true/false>,
-            "feedback": "Nhận xét cho câu này"
-        }}
-    ],
-    "total_score": <tổng điểm cuối cùng (0-10)>,
-    "overall_comment": "Nhận xét tổng thể về bài làm",
-    "strengths": ["Điểm mạnh 1", "Điểm mạnh 2"],
-    "weaknesses": ["Điểm yếu 1", "Điểm yếu 2"],
-    "improvement_suggestions": "Gợi ý cải thiện chi tiết"
-}}"""
-
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": f"Bạn là giáo viên {subject_vn} THCS chuyên nghiệp. Chấm điểm công bằng, chi tiết và có tính xây dựng. CHỈ trả về JSON, không có text khác."},
-                {"role": "user", "content": grading_prompt}
-            ],
-            max_tokens=2048,
+        # Tạo prompt cho AI: yêu cầu chấm + format JSON (tiền tố chung), rồi rubric + đề bài, cuối cùng là bài làm
+        prompt = RUBRIC_GRADING.params(
+            {"subject_name": subject_vn}, config.key if config is not None else None,
+            test_title=request.test_title, subject_name=subject_vn, rubric=rubric_info,
+            questions=questions_info or "(Không có câu tự luận)", student_name=request.student_name,
+            answers=answers_info or "(Không có câu tự luận)", objective=objective_info,
+        )
+        budget.count(prompt["messages"])
+        # Output gồm nhận xét rubric + một mục question_scores cho mỗi câu tự luận
+        max_tokens = min(2048, 1024 + 128 * len(free_numbers))
+        # Còn câu tự luận: chấm nhiều tiêu chí bằng model mặc định; mọi câu đã chấm bằng luật thì model
+        # chỉ còn viết nhận xét nên dùng đường nhanh
+        route = choose_route(
+            "grade-with-rubric", config.key if config is not None else None,
+            sum(count_tokens(answer) for answer in student_answers.values()),
+            question_type="rubric" if free_numbers else None, max_tokens=max_tokens, fast_max_tokens=max_tokens
+        )
+        params = dict(
+            **prompt,
             temperature=0.3,
             top_p=0.9,
-            response_format={"type": "json_object"}
+            **output_format(RubricGrading, {"type": "json_object"})
         )
-        
-        response_text = response.choices[0].message.content
-        grading_result = extract_json_from_text(response_text)
-        
-        if grading_result and isinstance(grading_result, dict):
-            # Validate và đảm bảo các trường cần thiết
-            if "total_score" not in grading_result:
-                # Tính tổng điểm từ rubric_scores nếu không có
-                if "rubric_scores" in grading_result:
-                    total = sum(item.get("weighted_score", 0) for item in grading_result["rubric_scores"])
-                    grading_result["total_score"] = round(total, 2)
-                else:
-                    grading_result["total_score"] = 0
-            
-            return {
-                "success": True,
-                "grading_result": grading_result,
-                "test_title": request.test_title,
-                "subject": request.subject,
-                "student_name": request.student_name
-            }
-        
-        return {
-            "success": False,
-            "error": "Không thể parse kết quả chấm điểm từ AI. Vui lòng thử lại.",
-            "raw_response": response_text
-        }
+
+        if stream:
+            def on_complete(response_text):
+                grading = parse_output(RubricGrading, response_text)
+                # Đã gửi dần cho client nên không leo thang được: chỉ ghi lại kết quả
+                reason = escalation_reason(grading, **(_grading_signals(grading) if grading is not None else {}))
+                services.router.record(route, {reason or "accepted": 1}, streamed=True)
+                return _rubric_grading_result(request, grading, response_text, objective_scores, budget)
+
+            return stream_json_response(
+                services.llm.stream_chat_completion(**route.params(), **params),
+                on_complete=on_complete,
+                prelude=[("question_scores", score) for score in objective_scores.values()]
+            )
+
+        response, grading = await services.router.complete(
+            services.llm, route, lambda text: parse_output(RubricGrading, text), _grading_signals,
+            cache=True, **params
+        )
+        return _rubric_grading_result(request, grading, response.choices[0].message.content, objective_scores, budget)
         
     except Exception as e:
         return {
@@ -1545,4 +1435,90 @@ Trả về JSON với format sau (KHÔNG thêm text khác):
             "error": str(e),
             "test_title": request.test_title,
             "subject": request.subject
-        }
\ No newline at end of file
+        }
+
+
+# Các endpoint chạy được dạng job nền: client nhận job id ngay thay vì giữ kết nối trong lúc chấm
+JOB_HANDLERS = {
+    "grade-with-rubric": JobHandler(RubricGradingRequest, grade_with_rubric),
+    "recent-test-grading": JobHandler(RecentTestGradingRequest, recent_test_grading),
+    "auto-grading": JobHandler(GradingRequest, auto_grading),
+    "auto-grading/batch": JobHandler(BatchGradingRequest, auto_grading_batch),
+    "auto-grading/file": JobHandler(AutoGradingRequest, auto_grading_file),
+    "auto-grading/image": JobHandler(ImageGradingRequest, autograding_image),
+    "grade-essay": JobHandler(GradingRequest, grade_essay),
+}
+
+
+@router.post("/jobs/{endpoint:path}")
+async def submit_job(endpoint: str, payload: dict = Body(...), callback_url: str | None = None,
+                     services: Services = Depends(get_services)):
+    """
+    Nhận request của một endpoint chấm bài (cùng body) và trả job id ngay; xem kết quả ở GET /jobs/{job_id}.
+    callback_url (tùy chọn): khi job xong, server POST nội dung job (như GET /jobs/{job_id}) tới URL này.
+    """
+    if services.job_queue is None:
+        return {"success": False, "error": "Job nền đang tắt (JOBS=0)"}
+    try:
+        job = await services.job_queue.submit(endpoint.strip("/"), payload, callback_url)
+    except ValueError as e:  # gồm cả ValidationError của pydantic
+        return {"success": False, "error": str(e)}
+    return {
+        "success": True,
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['id']}"
+    }
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, services: Services = Depends(get_services)):
+    """
+    Trạng thái job (queued / running / succeeded / failed) và kết quả khi đã xong.
+    """
+    job = await services.job_queue.get(job_id) if services.job_queue is not None else None
+    if job is None:
+        return {"success": False, "error": f"Không tìm thấy job {job_id}"}
+    return job_view(job)
+
+
+def create_app(app_services: Services | None = None) -> FastAPI:
+    """
+    Tạo app FastAPI: gắn middleware và router (.env đã được nạp lúc import, xem config.py).
+    Client chỉ được tạo khi dùng tới.
+    Chạy: uvicorn --factory main:create_app (hoặc uvicorn main:app như trước).
+    Test: create_app(Services(llm=FakeLLM())) để thay client thật bằng bản giả.
+    """
+    services = app_services if app_services is not None else Services()
+    # Job nền gọi thẳng hàm xử lý của endpoint (không qua FastAPI): gắn sẵn Services của app này
+    services.job_handlers = {
+        endpoint: JobHandler(handler.model, partial(handler.run, services=services))
+        for endpoint, handler in JOB_HANDLERS.items()
+    }
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.services = services
+
+    # CORS middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # Đo thời gian xử lý theo endpoint / môn học, xem tại /metrics
+    app.middleware("http")(metrics_middleware)
+
+    app.include_router(router)
+    return app
+
+
+def __getattr__(name: str):
+    # uvicorn main:app: app được tạo khi được lấy lần đầu, import main không có side effect
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
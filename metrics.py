@@ -0,0 +1,335 @@
+"""
+Đo đạc theo endpoint và môn học, xuất ra /metrics theo định dạng text của Prometheus.
+- Middleware: histogram thời gian xử lý request
+- LLMClient: thời gian gọi model, số token prompt (kể cả phần OpenAI đã cache) / completion,
+  chi phí ước tính, cache hit/miss
+- parse_output / extract_json_from_text: output đúng schema ngay hay phải dùng mức fallback nào
+- ModelRouter: bậc model được chọn và số lần phải leo thang lên model mạnh hơn
+
+Nhãn endpoint / subject của request hiện tại được truyền qua contextvars nên
+các lời gọi model bên trong handler tự gắn đúng nhãn.
+Số liệu nằm trong bộ nhớ của từng worker (mỗi tiến trình uvicorn có /metrics riêng).
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, replace
+
+from starlette.routing import Match
+
+from subjects import resolve_subject
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# Giá USD cho mỗi token (input, input đã cache, output), theo bảng giá công khai của OpenAI
+LLM_PRICING = {
+    "gpt-4o-mini": (0.15 / 1_000_000, 0.075 / 1_000_000, 0.60 / 1_000_000),
+    "gpt-4.1-nano": (0.10 / 1_000_000, 0.025 / 1_000_000, 0.40 / 1_000_000),
+    "gpt-4o": (2.50 / 1_000_000, 1.25 / 1_000_000, 10.00 / 1_000_000),
+}
+
+REQUEST_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def render(self):
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=REQUEST_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [đếm theo bucket..., tổng, số mẫu]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(labels.get(name, "") for name in self.labelnames))
+        return series[-1] if series else 0
+
+    def render(self):
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, hits in zip(self.buckets, series):
+                cumulative += hits
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            yield f"{self.name}_bucket{labels} {series[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "http_request_duration_seconds",
+    "Thời gian xử lý request (tới khi gửi header với response stream)",
+    ("endpoint", "subject", "status"),
+    REQUEST_BUCKETS,
+))
+LLM_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "llm_request_duration_seconds",
+    "Thời gian một lời gọi model (không tính thời gian chờ slot)",
+    ("endpoint", "subject", "model"),
+    LLM_BUCKETS,
+))
+LLM_REQUESTS = REGISTRY.register(Counter(
+    "llm_requests_total",
+    "Số lời gọi model theo kết quả cache (hit, miss, off), gộp với lời gọi đang chạy (coalesced) hoặc lỗi (error)",
+    ("endpoint", "subject", "model", "result"),
+))
+LLM_PROMPT_TOKENS = REGISTRY.register(Counter(
+    "llm_prompt_tokens_total", "Số token prompt theo response.usage", ("endpoint", "subject", "model"),
+))
+LLM_PROMPT_CACHED_TOKENS = REGISTRY.register(Counter(
+    "llm_prompt_cached_tokens_total",
+    "Số token prompt OpenAI lấy từ prompt cache (usage.prompt_tokens_details.cached_tokens)",
+    ("endpoint", "subject", "model"),
+))
+LLM_COMPLETION_TOKENS = REGISTRY.register(Counter(
+    "llm_completion_tokens_total", "Số token completion theo response.usage", ("endpoint", "subject", "model"),
+))
+LLM_COST_USD = REGISTRY.register(Counter(
+    "llm_cost_usd_total", "Chi phí ước tính (USD) theo LLM_PRICING", ("endpoint", "subject", "model"),
+))
+LLM_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "llm_queue_depth", "Số lời gọi model đang chờ trong hàng đợi theo mức ưu tiên", ("priority",),
+))
+LLM_QUEUE_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "llm_queue_wait_seconds",
+    "Thời gian chờ hạn mức RPM/TPM và slot đồng thời trước khi gọi model",
+    ("priority",),
+    (0.001, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+))
+LLM_RETRIES = REGISTRY.register(Counter(
+    "llm_retries_total", "Số lần thử lại lời gọi model (rate_limit = 429, server_error = 5xx / mất kết nối)",
+    ("reason",),
+))
+JOBS = REGISTRY.register(Counter(
+    "jobs_total", "Số job nền đã kết thúc theo endpoint và trạng thái (succeeded / failed)",
+    ("endpoint", "status"),
+))
+JOBS_QUEUED = REGISTRY.register(Gauge(
+    "jobs_queued", "Số job đang chờ worker trong hàng đợi bền",
+))
+JSON_EXTRACT = REGISTRY.register(Counter(
+    "json_extract_total",
+    "Cách đọc được output của model: schema (đúng JSON schema ngay), mức fallback khi tách JSON "
+    "(direct, scan, repaired, truncated), invalid (JSON sai cấu trúc) hoặc none",
+    ("endpoint", "subject", "tier"),
+))
+LLM_ROUTING = REGISTRY.register(Counter(
+    "llm_routing_total",
+    "Số câu chấm theo bậc model được chọn (fast, standard, strong) và kết quả: accepted hoặc lý do leo thang "
+    "(unparseable, low_confidence, inconsistent, borderline_score)",
+    ("endpoint", "subject", "tier", "outcome"),
+))
+
+
+@dataclass
+class RequestLabels:
+    endpoint: str = "none"
+    subject: str = "none"
+
+
+_labels: ContextVar[RequestLabels | None] = ContextVar("metrics_labels", default=None)
+
+
+def current_labels() -> RequestLabels:
+    return _labels.get() or RequestLabels()
+
+
+def subject_label(subject) -> str:
+    """
+    Chuẩn hóa môn học về key trong registry để số nhãn luôn hữu hạn.
+    Nhiều môn (ví dụ một batch) cho nhãn "mixed" nếu không trùng nhau.
+    """
+    if subject is None:
+        return "none"
+    if isinstance(subject, (list, tuple, set)):
+        keys = {subject_label(s) for s in subject}
+        return keys.pop() if len(keys) == 1 else "mixed"
+    config = resolve_subject(subject)
+    return config.key if config is not None else "unknown"
+
+
+def label_subject(subject):
+    """
+    Gắn môn học cho request đang xử lý (middleware đọc lại khi request kết thúc).
+    """
+    labels = _labels.get()
+    if labels is not None:
+        labels.subject = subject_label(subject)
+
+
+@contextmanager
+def subject_scope(subject):
+    """
+    Gắn môn học chỉ cho các lời gọi model trong khối with (ví dụ từng bài trong batch).
+    """
+    token = _labels.set(replace(current_labels(), subject=subject_label(subject)))
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+@contextmanager
+def request_scope(endpoint: str, subject=None):
+    """
+    Nhãn cho công việc chạy ngoài HTTP request (ví dụ job nền), để lời gọi model vẫn được tính theo endpoint.
+    """
+    token = _labels.set(RequestLabels(endpoint=endpoint, subject=subject_label(subject)))
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+def _match_route(routes, scope) -> str | None:
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            # FastAPI mới giữ router được include (không prefix) thành một route: tìm tiếp bên trong
+            included = getattr(route, "original_router", None)
+            if included is not None:
+                return _match_route(included.routes, scope)
+            return getattr(route, "path", None)
+    return None
+
+
+def _route_path(request) -> str:
+    return _match_route(request.app.router.routes, request.scope) or "unmatched"
+
+
+async def metrics_middleware(request, call_next):
+    labels = RequestLabels(endpoint=_route_path(request))
+    token = _labels.set(labels)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start, endpoint=labels.endpoint, subject=labels.subject, status=str(status)
+        )
+        _labels.reset(token)
+
+
+def observe_llm_call(model: str, seconds: float, usage=None):
+    labels = current_labels()
+    LLM_REQUEST_SECONDS.observe(seconds, endpoint=labels.endpoint, subject=labels.subject, model=model)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", 0) or 0
+    LLM_PROMPT_TOKENS.inc(prompt_tokens, endpoint=labels.endpoint, subject=labels.subject, model=model)
+    LLM_PROMPT_CACHED_TOKENS.inc(cached_tokens, endpoint=labels.endpoint, subject=labels.subject, model=model)
+    LLM_COMPLETION_TOKENS.inc(completion_tokens, endpoint=labels.endpoint, subject=labels.subject, model=model)
+    pricing = LLM_PRICING.get(model)
+    if pricing is not None:
+        cost = (prompt_tokens - cached_tokens) * pricing[0] + cached_tokens * pricing[1] + completion_tokens * pricing[2]
+        LLM_COST_USD.inc(cost, endpoint=labels.endpoint, subject=labels.subject, model=model)
+
+
+def count_llm_request(model: str, result: str):
+    labels = current_labels()
+    LLM_REQUESTS.inc(endpoint=labels.endpoint, subject=labels.subject, model=model, result=result)
+
+
+def count_json_tier(tier: str):
+    labels = current_labels()
+    JSON_EXTRACT.inc(endpoint=labels.endpoint, subject=labels.subject, tier=tier)
+
+
+def count_routing(tier: str, outcome: str, count: int = 1):
+    labels = current_labels()
+    LLM_ROUTING.inc(count, endpoint=labels.endpoint, subject=labels.subject, tier=tier, outcome=outcome)
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,280 @@
+"""
+Chấm tại chỗ các câu khách quan (trắc nghiệm, đúng/sai, đáp số, điền ngắn) trong /grade-with-rubric.
+So khớp với đáp án mẫu theo luật: chữ cái phương án, giá trị đúng/sai, số có sai số, chuỗi đã chuẩn hóa.
+Câu nào luật không kết luận được (tự luận, đáp án không rõ) vẫn gửi cho model như cũ.
+"""
+import math
+import os
+import re
+import unicodedata
+from fractions import Fraction
+
+from config import load_env
+
+load_env()
+
+OBJECTIVE_GRADER = os.getenv("OBJECTIVE_GRADER", "1") == "1"
+# Sai số tương đối / tuyệt đối khi so đáp số. Đáp số làm tròn thô hơn đáp án (3.14 cho 3.14159) không được
+# luật kết luận mà để model đánh giá (đề có thể yêu cầu làm tròn)
+OBJECTIVE_NUMERIC_REL_TOLERANCE = float(os.getenv("OBJECTIVE_NUMERIC_REL_TOLERANCE", "1e-6"))
+OBJECTIVE_NUMERIC_ABS_TOLERANCE = float(os.getenv("OBJECTIVE_NUMERIC_ABS_TOLERANCE", "1e-6"))
+
+CHOICE, TRUE_FALSE, NUMERIC, SHORT_ANSWER = "choice", "true_false", "numeric", "short_answer"
+
+# questionType sau khi bỏ dấu, chữ thường, bỏ ký tự không phải chữ/số
+_TYPE_ALIASES = {
+    CHOICE: {"multiplechoice", "singlechoice", "choice", "mcq", "quiz", "abcd", "tracnghiem", "tracnghiemkhachquan"},
+    TRUE_FALSE: {"truefalse", "boolean", "bool", "yesno", "dungsai", "dunghaysai"},
+    NUMERIC: {"numeric", "number", "numerical", "calculation", "dapso", "tinhtoan", "dienso"},
+    SHORT_ANSWER: {"shortanswer", "fillintheblank", "fillblank", "fill", "dienkhuyet", "dientu", "traloingan"},
+}
+_FREE_RESPONSE = {"essay", "freeresponse", "open", "longanswer", "tuluan", "vietdoanvan", "nghiluan"}
+
+_TRUE_WORDS = {"dung", "d", "true", "t", "yes", "y", "co", "1", "correct"}
+_FALSE_WORDS = {"sai", "s", "false", "f", "no", "n", "khong", "0", "incorrect", "wrong"}
+_UNANSWERED = {"", "chua tra loi", "khong tra loi", "n/a", "none", "null"}
+
+_OPTION = re.compile(r"^(?:dap an|phuong an|chon|answer|option)?\s*[:\-]?\s*\(?([a-h])\s*(?:[).:\-]|$)(?:\s|$)")
+_NUMBER = re.compile(r"^[-+]?(?:\d+(?:[.,]\d+)?|[.,]\d+)(?:\s*/\s*\d+)?$")
+_LEADING_VARIABLE = re.compile(r"^[a-z]\w*\s*=\s*")
+_UNIT = re.compile(r"\s*([^\d\s.,/+-][^\d]*)$")
+# "1.000" / "1,000" / "1.000.000": có thể là dấu tách hàng nghìn hoặc dấu thập phân
+_THOUSANDS = re.compile(r"^[-+]?[1-9]\d{0,2}(?:[.,]\d{3})+$")
+
+# Đơn vị (đã bỏ dấu) -> (đại lượng, hệ số về đơn vị gốc) để so "300 cm" với "3 m";
+# đơn vị ngoài bảng chỉ so được khi hai bên ghi giống nhau
+_UNIT_SCALES = {
+    "mm": ("length", 1e-3), "cm": ("length", 1e-2), "dm": ("length", 1e-1), "m": ("length", 1.0),
+    "km": ("length", 1e3),
+    "mg": ("mass", 1e-3), "g": ("mass", 1.0), "kg": ("mass", 1e3), "tan": ("mass", 1e6),
+    "ml": ("volume", 1e-3), "l": ("volume", 1.0), "lit": ("volume", 1.0),
+    "s": ("time", 1.0), "giay": ("time", 1.0), "phut": ("time", 60.0), "min": ("time", 60.0),
+    "h": ("time", 3600.0), "gio": ("time", 3600.0),
+}
+
+
+def _fold(text: str) -> str:
+    # Bỏ dấu tiếng Việt (đ -> d) để "Đúng"/"dung"/"ĐÚNG" so khớp được với nhau
+    text = unicodedata.normalize("NFD", text.casefold().replace("đ", "d"))
+    return "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+
+
+def normalize_answer(value) -> str:
+    """
+    Chuẩn hóa đáp án để so chuỗi: chữ thường, gộp khoảng trắng, bỏ ngoặc kép và dấu câu ở cuối.
+    """
+    text = unicodedata.normalize("NFC", str(value)).casefold().strip()
+    text = re.sub(r"\s+", " ", text).strip("\"'“”‘’")
+    return text.rstrip(" .;!").strip()
+
+
+def question_kind(question_type) -> str | None:
+    key = re.sub(r"[^a-z0-9]", "", _fold(str(question_type or "")))
+    for kind, aliases in _TYPE_ALIASES.items():
+        if key in aliases:
+            return kind
+    return None
+
+
+def parse_option(value) -> str | None:
+    match = _OPTION.match(_fold(normalize_answer(value)))
+    return match.group(1).upper() if match else None
+
+
+def parse_bool(value) -> bool | None:
+    if isinstance(value, bool):
+        return value
+    text = _fold(normalize_answer(value))
+    if text in _TRUE_WORDS:
+        return True
+    if text in _FALSE_WORDS:
+        return False
+    return None
+
+
+def _split_unit(value) -> tuple[str, str]:
+    text = _LEADING_VARIABLE.sub("", normalize_answer(value))
+    unit = ""
+    match = _UNIT.search(text)
+    if match:
+        unit = re.sub(r"\s+", "", _fold(match.group(1))).rstrip(".")
+        text = text[:match.start()]
+    return text, unit
+
+
+def parse_quantity(value) -> tuple[float, str] | None:
+    """
+    Đọc đáp số kèm đơn vị ở cuối: "2,5" -> (2.5, ""), "x = -3/4" -> (-0.75, ""), "12 cm" -> (12.0, "cm"),
+    "10%" -> (10.0, "%").
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value), ""
+    text, unit = _split_unit(value)
+    if not _NUMBER.match(text):
+        return None
+    text = text.replace(" ", "")
+    if "," in text and "." not in text:
+        text = text.replace(",", ".")
+    try:
+        number = float(Fraction(text)) if "/" in text else float(text)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return number, unit
+
+
+def _readings(value) -> list[tuple[float, str, float | None]]:
+    """
+    Các cách đọc đáp số (giá trị, đơn vị, bước làm tròn). "1.000" có hai cách: 1.0 (thập phân) và 1000 (hàng nghìn).
+    """
+    readings = []
+    quantity = parse_quantity(value)
+    if quantity is not None:
+        readings.append((quantity[0], quantity[1], _precision(value)))
+    if not isinstance(value, (int, float)):
+        text, unit = _split_unit(value)
+        if _THOUSANDS.match(text):
+            readings.append((float(re.sub(r"[.,]", "", text)), unit, None))
+    return readings
+
+
+def parse_number(value) -> float | None:
+    quantity = parse_quantity(value)
+    return quantity[0] if quantity is not None else None
+
+
+def infer_kind(question_type, solution) -> str | None:
+    """
+    Loại câu theo questionType; nếu thiếu/không rõ thì đoán từ đáp án mẫu. Tự luận -> None.
+    """
+    kind = question_kind(question_type)
+    if kind is not None:
+        return kind
+    if re.sub(r"[^a-z0-9]", "", _fold(str(question_type or ""))) in _FREE_RESPONSE:
+        return None
+    text = normalize_answer(solution)
+    if re.fullmatch(r"\(?[a-h]\)?", _fold(text)):
+        return CHOICE
+    if _fold(text) in {"dung", "sai", "true", "false"}:
+        return TRUE_FALSE
+    if parse_number(text) is not None:
+        return NUMERIC
+    return None
+
+
+def _precision(value) -> float | None:
+    """
+    Bước làm tròn của số thập phân đã ghi ("0.54" -> 0.01); None nếu là số nguyên / phân số (giá trị chính xác).
+    """
+    match = re.search(r"[.,](\d+)", normalize_answer(value))
+    return 10.0 ** -len(match.group(1)) if match and "/" not in str(value) else None
+
+
+def _convert(number: float, unit: str, target: str) -> float | None:
+    """
+    Đổi đáp số từ đơn vị unit sang target; None nếu không so được.
+    Thiếu đơn vị ở một bên thì coi như cùng đơn vị, trừ phần trăm ("10%" và "0.1" có thể đều đúng).
+    """
+    if unit == target or ("%" not in (unit, target) and "" in (unit, target)):
+        return number
+    source, dest = _UNIT_SCALES.get(unit), _UNIT_SCALES.get(target)
+    if source is None or dest is None or source[0] != dest[0]:
+        return None
+    return number * source[1] / dest[1]
+
+
+def _numbers_match(student: float, student_step: float | None,
+                   solution: float, solution_step: float | None) -> bool | None:
+    if math.isclose(student, solution, rel_tol=OBJECTIVE_NUMERIC_REL_TOLERANCE,
+                    abs_tol=OBJECTIVE_NUMERIC_ABS_TOLERANCE):
+        return True
+    difference = abs(student - solution)
+    # Học sinh ghi ít (hoặc bằng) số chữ số thập phân hơn đáp án: chỉ chấp nhận sai số trong độ chính xác của đáp án
+    if (student_step is not None and solution_step is not None and student_step >= solution_step
+            and difference <= 0.5 * solution_step + OBJECTIVE_NUMERIC_ABS_TOLERANCE):
+        return True
+    # Một bên có thể là bản làm tròn của bên kia (0.5 / 0.54, 0.33 / 1/3): đề có yêu cầu làm tròn hay không
+    # thì luật không biết, để model đánh giá
+    steps = [step for step in (student_step, solution_step) if step is not None]
+    if steps and difference <= 0.5 * max(steps) + OBJECTIVE_NUMERIC_ABS_TOLERANCE:
+        return None
+    return False
+
+
+def match_answer(kind: str, student, solution) -> bool | None:
+    """
+    True/False nếu luật kết luận được; None để nhường cho model.
+    """
+    if normalize_answer(student) == normalize_answer(solution):
+        return True
+    if kind == CHOICE:
+        expected, given = parse_option(solution), parse_option(student)
+        if expected is None or given is None:
+            return None  # học sinh ghi nội dung phương án thay vì chữ cái: không đủ dữ kiện
+        return expected == given
+    if kind == TRUE_FALSE:
+        expected, given = parse_bool(solution), parse_bool(student)
+        if expected is None or given is None:
+            return None
+        return expected == given
+    if kind in (NUMERIC, SHORT_ANSWER):
+        results = []
+        for given, given_unit, given_step in _readings(student):
+            for expected, expected_unit, expected_step in _readings(solution):
+                # So trong đơn vị học sinh ghi: "300 cm" đúng với "3 m", "3 m" sai với "3 cm"
+                ratio = _convert(1.0, expected_unit, given_unit)
+                if ratio is None:
+                    # đơn vị không so được (khác đại lượng, ngoài bảng, chỉ một bên là %)
+                    results.append(None)
+                    continue
+                results.append(_numbers_match(
+                    given, given_step,
+                    expected * ratio, expected_step * ratio if expected_step is not None else None,
+                ))
+        # Dấu tách hàng nghìn không rõ ("1.000" với "1000"): các cách đọc cho kết quả khác nhau thì để model đánh giá
+        if results:
+            return results[0] if len(set(results)) == 1 else None
+    # Học sinh ghi cả lời giải, hoặc điền ngắn khác chữ (đồng nghĩa, diễn đạt khác): để model đánh giá
+    return None
+
+
+def grade_objective_question(question_number: int, qa: dict) -> dict | None:
+    """
+    Chấm một câu khách quan; trả về phần tử question_scores hoặc None nếu cần model chấm.
+    """
+    solution = qa.get("solution")
+    kind = infer_kind(qa.get("questionType"), solution)
+    if kind is None or solution is None or normalize_answer(solution) == "":
+        return None
+
+    max_score = qa.get("grade", 0)
+    student = qa.get("studentAnswer")
+    if student is None or _fold(normalize_answer(student)) in _UNANSWERED:
+        correct, feedback = False, "Chưa trả lời."
+    else:
+        correct = match_answer(kind, student, solution)
+        if correct is None:
+            return None
+        feedback = "Đúng." if correct else f"Sai. Đáp án đúng: {solution}."
+
+    return {
+        "question_number": question_number,
+        "max_score": max_score,
+        "student_score": max_score if correct else 0,
+        "is_correct": correct,
+        "feedback": feedback,
+        "graded_by": "rule",
+    }
+
+
+def grade_objective_questions(questions_and_answers: list[dict]) -> dict[int, dict]:
+    """
+    {số thứ tự câu (từ 1): question_scores} cho các câu chấm được bằng luật.
+    """
+    if not OBJECTIVE_GRADER:
+        return {}
+    scores = {}
+    for number, qa in enumerate(questions_and_answers, 1):
+        score = grade_objective_question(number, qa)
+        if score is not None:
+            scores[number] = score
+    return scores
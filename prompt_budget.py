@@ -0,0 +1,294 @@
+"""
+Dựng prompt trong ngân sách token.
+Token được đếm tại chỗ (tiktoken nếu có, không thì ước lượng theo số ký tự); phần nhập của học sinh
+vượt ngân sách được nén dần: gộp khoảng trắng, bỏ dòng lặp, cuối cùng giữ phần đầu + phần cuối.
+Các bước nén chạy trên cả text (thời gian tuyến tính); phần vẫn dài gấp nhiều lần ngân sách mới bị cắt nhanh
+theo ký tự trước khi đếm / cắt theo token, nên chi phí đếm token không phụ thuộc cỡ file.
+Nhờ vậy một file tải nhầm hay bài văn rất dài không biến thành lời gọi model đắt hoặc lỗi context.
+"""
+import math
+import os
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken là tùy chọn; không có thì dùng ước lượng theo ký tự
+    tiktoken = None
+
+from config import load_env
+
+load_env()
+
+PROMPT_TOKENIZER_ENCODING = os.getenv("PROMPT_TOKENIZER_ENCODING", "o200k_base")  # bộ mã của gpt-4o / gpt-4o-mini
+# Ước lượng khi không có tiktoken: tiếng Việt có dấu tốn nhiều token hơn tiếng Anh nên chọn thấp (an toàn)
+PROMPT_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "3"))
+
+# Ngân sách token cho phần nhập của học sinh, theo endpoint
+PROMPT_BUDGET_ANSWER = int(os.getenv("PROMPT_BUDGET_ANSWER", "3000"))  # /auto-grading, /auto-grading/batch
+PROMPT_BUDGET_ESSAY = int(os.getenv("PROMPT_BUDGET_ESSAY", "6000"))  # /grade-essay
+PROMPT_BUDGET_FILE = int(os.getenv("PROMPT_BUDGET_FILE", "6000"))  # /auto-grading/file
+PROMPT_BUDGET_RUBRIC = int(os.getenv("PROMPT_BUDGET_RUBRIC", "8000"))  # mọi bài làm trong /grade-with-rubric
+PROMPT_BUDGET_TEST_GRADING = int(os.getenv("PROMPT_BUDGET_TEST_GRADING", "4000"))  # mỗi nhóm câu /recent-test-grading
+# Khi phải cắt: tỉ lệ ngân sách dành cho phần đầu (phần còn lại cho phần cuối, nơi thường có kết luận)
+PROMPT_HEAD_RATIO = float(os.getenv("PROMPT_HEAD_RATIO", "0.7"))
+# Số ký tự mỗi token ước lượng rộng: text dài hơn ngân sách x hệ số này chỉ được đếm token trên phần cắt nhanh
+# theo ký tự (phần bỏ đi ước lượng theo số ký tự), để file vài MB không chặn event loop
+PROMPT_MAX_CHARS_PER_TOKEN = float(os.getenv("PROMPT_MAX_CHARS_PER_TOKEN", "8"))
+
+# Token cố định mỗi message và cho phần mở đầu câu trả lời (theo cách OpenAI tính chat format)
+_MESSAGE_OVERHEAD_TOKENS = 3
+_REPLY_PRIMING_TOKENS = 3
+_MIN_DUPLICATE_LINE_CHARS = 20
+_OMISSION = re.compile(r"\[\.\.\. lược bớt khoảng (\d+) token \.\.\.\]")
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(PROMPT_TOKENIZER_ENCODING)
+    except Exception:
+        # Chưa có file BPE trong cache và không tải được (máy không có mạng)
+        return None
+
+
+def tokenizer_name() -> str:
+    return f"tiktoken:{PROMPT_TOKENIZER_ENCODING}" if _encoding() is not None else "estimate"
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / PROMPT_CHARS_PER_TOKEN)
+
+
+def count_tokens_capped(text: str, budget: int) -> int:
+    """
+    Số token của text, chỉ đếm phần giữ lại sau khi cắt nhanh theo budget (đủ để so với ngưỡng <= budget).
+    """
+    return count_tokens(_precut(text, budget)[0])
+
+
+def _estimate_tokens(text: str, budget: int) -> int:
+    # Số token của text: đếm trên phần giữ lại sau khi cắt nhanh, cộng ước lượng phần bị cắt
+    kept, omitted = _precut(text, budget)
+    return count_tokens(kept) + omitted
+
+
+def count_message_tokens(messages: list[dict]) -> int:
+    """
+    Số token prompt của một lời gọi chat (chỉ phần text).
+    """
+    total = _REPLY_PRIMING_TOKENS
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = "\n".join(part.get("text", "") for part in content if part.get("type") == "text")
+        total += _MESSAGE_OVERHEAD_TOKENS + count_tokens(content or "")
+    return total
+
+
+def collapse_whitespace(text: str) -> str:
+    text = re.sub(r"[ \t ]+", " ", text.replace("\r\n", "\n"))
+    text = re.sub(r" *\n *", "\n", text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def collapse_duplicate_lines(text: str) -> str:
+    """
+    Bỏ các dòng dài đã xuất hiện trước đó (header/footer từng trang, nội dung dán hai lần),
+    rồi gộp dòng lặp liên tiếp thành một dòng kèm số lần lặp.
+    """
+    lines, seen = [], set()
+    for line in text.split("\n"):
+        key = line.strip()
+        if len(key) >= _MIN_DUPLICATE_LINE_CHARS:
+            if key in seen:
+                continue
+            seen.add(key)
+        lines.append(line)
+
+    out, repeats = [], 0
+    for index, line in enumerate(lines):
+        if index and line == lines[index - 1] and line.strip():
+            repeats += 1
+            continue
+        if repeats:
+            out[-1] += f" (lặp lại {repeats + 1} lần)"
+            repeats = 0
+        out.append(line)
+    if repeats:
+        out[-1] += f" (lặp lại {repeats + 1} lần)"
+    return "\n".join(out)
+
+
+def _omission_marker(tokens: int) -> str:
+    return f"\n\n[... lược bớt khoảng {tokens} token ...]\n\n"
+
+
+def _omitted(text: str) -> int:
+    # Tổng số token đã ghi trong các ghi chú lược bớt có sẵn trong text
+    return sum(int(count) for count in _OMISSION.findall(text))
+
+
+def _precut(text: str, budget: int) -> tuple[str, int]:
+    """
+    Cắt nhanh theo ký tự (không đếm token) text dài hơn nhiều so với budget: giữ phần đầu + phần cuối.
+    Trả về (text, số token ước lượng đã lược bớt).
+    """
+    limit = int(budget * PROMPT_MAX_CHARS_PER_TOKEN)
+    if len(text) <= limit:
+        return text, 0
+    head_chars = int(limit * PROMPT_HEAD_RATIO)
+    tail_chars = limit - head_chars
+    omitted = math.ceil((len(text) - limit) / PROMPT_CHARS_PER_TOKEN)
+    tail = text[len(text) - tail_chars:] if tail_chars else ""
+    return text[:head_chars].rstrip() + _omission_marker(omitted) + tail.lstrip(), omitted
+
+
+def truncate_head_tail(text: str, budget: int) -> str:
+    """
+    Giữ phần đầu và phần cuối vừa đủ budget token, ở giữa ghi chú phần đã lược bớt.
+    """
+    total = count_tokens(text)
+    if total <= budget:
+        return text
+    # Ghi chú cộng dồn cả số token đã lược bớt ở lần cắt nhanh trước: ước lượng độ dài theo tổng lớn nhất
+    marker_tokens = count_tokens(_omission_marker(total + _omitted(text)))
+    keep = max(0, budget - marker_tokens)
+    head_tokens = int(keep * PROMPT_HEAD_RATIO)
+    tail_tokens = keep - head_tokens
+
+    encoding = _encoding()
+    if encoding is not None:
+        ids = encoding.encode(text, disallowed_special=())
+        head = encoding.decode(ids[:head_tokens])
+        tail = encoding.decode(ids[len(ids) - tail_tokens:]) if tail_tokens else ""
+    else:
+        head_chars = int(head_tokens * PROMPT_CHARS_PER_TOKEN)
+        tail_chars = int(tail_tokens * PROMPT_CHARS_PER_TOKEN)
+        head = text[:head_chars]
+        tail = text[len(text) - tail_chars:] if tail_chars else ""
+        # Cắt ở ranh giới từ để không để lại nửa chữ
+        space = head.rfind(" ", max(0, len(head) - 40))
+        head = head[:space] if space > 0 else head
+        space = tail.find(" ", 0, 40)
+        tail = tail[space + 1:] if space >= 0 else tail
+
+    # Phần bị bỏ có thể chứa ghi chú của lần cắt nhanh trước đó: cộng dồn số token đã lược bớt
+    omitted = total - count_tokens(head) - count_tokens(tail) + _omitted(text) - _omitted(head) - _omitted(tail)
+    return head.rstrip() + _omission_marker(max(omitted, 0)) + tail.lstrip()
+
+
+@dataclass
+class FittedText:
+    text: str
+    original_tokens: int
+    tokens: int
+    steps: list = field(default_factory=list)  # các bước nén đã áp dụng
+
+    @property
+    def compacted(self) -> bool:
+        return bool(self.steps)
+
+
+def fit_text(text, budget: int) -> FittedText:
+    """
+    Nén text cho vừa budget token; text đã vừa thì giữ nguyên.
+    Gộp khoảng trắng / bỏ dòng lặp trên cả text trước, chỉ phần vẫn còn quá dài mới bị cắt nhanh rồi cắt theo token.
+    """
+    text = "" if text is None else str(text)
+    tokens = _estimate_tokens(text, budget)
+    fitted = FittedText(text, tokens, tokens)
+    if tokens <= budget:
+        return fitted
+    for step, compact in (("whitespace", collapse_whitespace), ("duplicate_lines", collapse_duplicate_lines)):
+        compacted = compact(fitted.text)
+        if compacted != fitted.text:
+            fitted.text = compacted
+            fitted.tokens = _estimate_tokens(compacted, budget)
+            fitted.steps.append(step)
+            if fitted.tokens <= budget:
+                return fitted
+    fitted.text, precut = _precut(fitted.text, budget)
+    if precut:
+        fitted.steps.append("precut")
+    fitted.text = truncate_head_tail(fitted.text, budget)
+    fitted.tokens = count_tokens(fitted.text)
+    fitted.steps.append("head_tail")
+    return fitted
+
+
+def share_budget(sizes: list[int], budget: int) -> list[int]:
+    """
+    Chia budget cho nhiều phần: phần ngắn giữ nguyên, phần còn lại chia đều cho các phần dài.
+    """
+    shares = [0] * len(sizes)
+    remaining = budget
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    for position, i in enumerate(order):
+        share = remaining // (len(order) - position)
+        shares[i] = min(sizes[i], share)
+        remaining -= shares[i]
+    return shares
+
+
+class PromptBudget:
+    """
+    Ngân sách token phần nhập của một request: nén các trường quá dài, đếm token của các lời gọi
+    và tạo báo cáo (prompt_budget) đưa vào response.
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.prompt_tokens = 0
+        self.calls = 0
+        self.compacted = []
+
+    def _record(self, name: str, fitted: FittedText):
+        # Lần thử lại dựng lại prompt cho cùng trường: chỉ ghi một lần
+        if fitted.compacted and all(entry["field"] != name for entry in self.compacted):
+            self.compacted.append({
+                "field": name,
+                "original_tokens": fitted.original_tokens,
+                "tokens": fitted.tokens,
+                "steps": fitted.steps,
+            })
+
+    def fit(self, name: str, text, budget: int | None = None) -> str:
+        fitted = fit_text(text, self.budget if budget is None else budget)
+        self._record(name, fitted)
+        return fitted.text
+
+    def fit_many(self, names: list[str], texts: list, budget: int | None = None) -> list[str]:
+        """
+        Nén nhiều trường dùng chung một ngân sách (ví dụ mọi câu trả lời trong một bài kiểm tra).
+        """
+        texts = ["" if t is None else str(t) for t in texts]
+        budget = self.budget if budget is None else budget
+        shares = share_budget([count_tokens_capped(t, budget) for t in texts], budget)
+        out = []
+        for name, text, share in zip(names, texts, shares):
+            fitted = fit_text(text, share)
+            self._record(name, fitted)
+            out.append(fitted.text)
+        return out
+
+    def count(self, messages: list[dict]) -> int:
+        tokens = count_message_tokens(messages)
+        self.prompt_tokens += tokens
+        self.calls += 1
+        return tokens
+
+    def report(self) -> dict:
+        return {
+            "tokenizer": tokenizer_name(),
+            "input_budget": self.budget,
+            "prompt_tokens": self.prompt_tokens,
+            "calls": self.calls,
+            "compacted": self.compacted,
+        }
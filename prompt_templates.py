@@ -0,0 +1,324 @@
+"""
+Mẫu prompt của các endpoint, theo thứ tự: tiền tố tĩnh trước, dữ liệu của request sau.
+OpenAI tự cache phần đầu prompt trùng khớp giữa các lời gọi (prompt từ 1024 token, theo bước 128 token);
+token đã cache rẻ hơn một nửa và được xử lý nhanh hơn. Vì vậy mọi phần không đổi giữa các request
+(vai trò, quy tắc chấm, rubric của môn, format JSON, ví dụ) nằm trong system message ở đầu,
+còn đề bài, bài làm, chủ đề, ... nằm trong user message ở cuối.
+Hiệu quả đo qua usage.prompt_tokens_details.cached_tokens (metric llm_prompt_cached_tokens_total).
+"""
+import os
+from dataclasses import dataclass
+
+from config import load_env
+
+load_env()
+
+# Gửi prompt_cache_key (tên mẫu + môn): OpenAI định tuyến các request cùng tiền tố về cùng máy cache
+PROMPT_CACHE_KEY = os.getenv("PROMPT_CACHE_KEY", "1").lower() not in ("0", "false", "no")
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    name: str
+    system: str  # tiền tố tĩnh: chỉ điền giá trị cố định theo môn học (tên môn, rubric, ví dụ)
+    user: str  # hậu tố động: điền dữ liệu của request
+
+    def messages(self, static: dict | None = None, images: tuple = (), **fields) -> list[dict]:
+        """
+        [system, user] của một lời gọi; images (URL / data URL) được gửi sau phần text của user message.
+        """
+        user = self.user.format(**fields)
+        if images:
+            user = [{"type": "text", "text": user}] + [
+                {"type": "image_url", "image_url": {"url": url}} for url in images
+            ]
+        return [
+            {"role": "system", "content": self.system.format(**(static or {}))},
+            {"role": "user", "content": user},
+        ]
+
+    def params(self, static: dict | None = None, cache_key: str | None = None, images: tuple = (), **fields) -> dict:
+        """
+        messages (+ prompt_cache_key) để truyền thẳng vào chat_completion.
+        """
+        params = {"messages": self.messages(static, images, **fields)}
+        if PROMPT_CACHE_KEY:
+            params["prompt_cache_key"] = f"{self.name}:{cache_key}" if cache_key else self.name
+        return params
+
+
+_ASSISTANT_SYSTEM = "Bạn là trợ lý AI chuyên về văn học Việt Nam."
+
+_GRADING_RULES = """YÊU CẦU CHẤM:
+- So sánh kết quả và lập luận của bài làm với đề bài.
+- Áp dụng các tiêu chí rubric để đánh giá toàn diện.
+- Nếu kết luận cuối cùng đúng về mặt toán học thì coi là ĐÚNG,
+  kể cả khi cách trình bày khác, thiếu lời giải chi tiết, hoặc dùng từ khác.
+- Chỉ trả về isCorrect = false nếu:
+  + Kết quả cuối cùng sai, HOẶC
+  + Lập luận mâu thuẫn với định nghĩa/toán học cơ bản.
+- Không đánh giá dựa trên hình thức, chính tả, hoặc cách diễn đạt.
+- Nếu bài làm đúng bản chất toán học → isCorrect = true.
+
+TRẢ VỀ DUY NHẤT JSON (không giải thích thêm ngoài comments):
+{{"isCorrect": <true || false>, "comments": "<nhận xét chi tiết về bài làm theo từng tiêu chí rubric>"}}"""
+
+GENERATE = PromptTemplate("generate", system=_ASSISTANT_SYSTEM, user="{prompt}")
+
+GENERATE_QUESTION = PromptTemplate(
+    "generate_question",
+    system="""{config.question_system_prompt}
+
+Tạo câu hỏi {config.name} theo yêu cầu của người dùng.
+
+Trả về JSON với format SAU (KHÔNG thêm text khác):
+{{"question": "câu hỏi", "answer": "lời giải chi tiết", "difficulty": "easy"}}
+
+Ví dụ:
+{config.question_example_json}""",
+    user="Yêu cầu: {prompt}",
+)
+
+GRADE_ANSWER = PromptTemplate(
+    "auto-grading",
+    system="""{config.grading_prompt}{config.rubric_text}
+
+Hãy đưa ra điểm số từ 0-10 và nhận xét chi tiết về bài làm dựa trên các tiêu chí rubric.
+
+Trả về format JSON:
+{{"isCorrect": <true || false>, "comments": "<nhận xét chi tiết về bài làm theo từng tiêu chí rubric>", "score": <điểm số từ 0-10>}}""",
+    user="""Đề bài: {exercise_question}
+
+Bài làm của học sinh:
+{student_answer}""",
+)
+
+GRADE_FILE = PromptTemplate(
+    "auto-grading/file",
+    system="""{config.grading_prompt}{config.rubric_text}
+
+Hãy kiểm tra xem nội dung bài làm đúng hay sai so với đề bài.
+
+""" + _GRADING_RULES,
+    user="""Đề bài: {exercise_question}
+
+Nội dung bài làm:
+{content}""",
+)
+
+GRADE_IMAGE = PromptTemplate(
+    "auto-grading/image",
+    system="""Bạn là giáo viên {subject_name} THCS có khả năng đọc và phân tích hình ảnh bài làm của học sinh.
+Hãy chấm điểm bài làm dựa trên nội dung trong hình ảnh.{rubric_text}
+
+Đọc và phân tích bài làm của học sinh trong hình ảnh, sau đó chấm theo yêu cầu dưới đây.
+
+""" + _GRADING_RULES,
+    user="Đề bài: {exercise_question}{pages}",
+)
+
+GRADE_ESSAY = PromptTemplate(
+    "grade-essay",
+    system=_ASSISTANT_SYSTEM + """
+
+Hãy chấm điểm bài làm văn theo thang điểm 10 và đưa ra nhận xét cụ thể về ưu điểm và hạn chế của bài viết.
+
+Hãy đánh giá theo các tiêu chí:
+- Nội dung (40%)
+- Phân tích & lập luận (30%)
+- Diễn đạt & ngôn ngữ (20%)
+- Sáng tạo (10%)
+
+Trả về kết quả dưới dạng JSON với format:
+{{
+    "grade": <điểm số từ 0-10>,
+    "comments": "<nhận xét chi tiết về bài làm>",
+    "criteria_scores": {{
+        "Nội dung": <điểm từ 0-10>,
+        "Phân tích & lập luận": <điểm từ 0-10>,
+        "Diễn đạt & ngôn ngữ": <điểm từ 0-10>,
+        "Sáng tạo": <điểm từ 0-10>
+    }},
+    "strengths": "<điểm mạnh của bài làm>",
+    "weaknesses": "<điểm yếu và hướng cải thiện>"
+}}""",
+    user="""Đề bài: {exercise_question}
+
+Bài làm của học sinh:
+{student_answer}""",
+)
+
+RECENT_TEST = PromptTemplate(
+    "recent-test",
+    system="""{config.practice_system_prompt}
+
+Dựa trên các chủ đề {config.question_type} được cho, hãy tạo ra một câu hỏi {config.question_type} cho mỗi chủ đề.
+
+Môn học: {config.name}
+
+QUY TẮC QUAN TRỌNG:
+- Trả về ĐÚNG số câu hỏi bằng số chủ đề, mỗi câu tương ứng với một chủ đề theo đúng thứ tự
+- Câu hỏi phải phù hợp với môn {config.name} và chương trình THCS
+- CHỈ trả về một JSON object có khóa "questions" là mảng các câu hỏi, KHÔNG có text giải thích thêm
+- KHÔNG có dấu phẩy thừa sau phần tử cuối
+- Format chính xác như sau:
+
+{{
+    "questions": [
+        {{
+            "topic": "<tên chủ đề y nguyên>",
+            "question": "<câu hỏi {config.question_type} liên quan>",
+            "difficulty": "<easy|medium|hard>"
+        }},
+        {{
+            "topic": "<tên chủ đề y nguyên>",
+            "question": "<câu hỏi {config.question_type} liên quan>",
+            "difficulty": "<easy|medium|hard>"
+        }}
+    ]
+}}""",
+    user="""Các chủ đề:
+{topics}{question_types}
+
+Trả về ĐÚNG {count} câu hỏi tương ứng với {count} chủ đề.""",
+)
+
+TEACHER_FEEDBACK = PromptTemplate(
+    "analyze-teacher-feedback",
+    system="""{config.analysis_system_prompt}
+
+Dựa trên nhận xét của giáo viên về một bài học môn {config.name}, hãy tạo câu hỏi bài tập và gợi ý cải thiện cho học sinh.
+
+YÊU CẦU:
+- Tạo câu hỏi bài tập phù hợp với nội dung bài học và nhận xét của giáo viên
+- Đưa ra gợi ý cải thiện cụ thể dựa trên điểm yếu trong nhận xét
+- Câu hỏi phải có độ khó vừa phải, phù hợp với trình độ THCS
+- Gợi ý phải thiết thực và có thể áp dụng được
+
+Trả về JSON với format SAU (KHÔNG thêm text khác):
+{{"exercise_question": "<câu hỏi bài tập {config.name}>", "improve_suggestion": "<gợi ý cải thiện cụ thể>"}}
+
+Ví dụ cho môn {config.name}:
+{config.feedback_example_json}""",
+    user="""Bài học: {lesson}
+
+Nhận xét của giáo viên:
+{comments}""",
+)
+
+TEST_GRADING = PromptTemplate(
+    "recent-test-grading",
+    system="""{config.test_grading_system_prompt}
+
+Hãy chấm điểm các câu hỏi được cho theo rubric đã cho.
+
+Môn học: {config.name}{config.assessment_rubric_text}
+
+YÊU CẦU CHẤM:
+- Đánh giá MỖI câu hỏi dựa trên độ chính xác, logic và phương pháp giải
+- Áp dụng tiêu chí rubric để đánh giá toàn diện
+- Với mỗi câu: xác định đúng/sai (isCorrect), cho điểm (0-10), và nhận xét chi tiết
+- Điểm phải phản ánh chính xác mức độ đạt được theo từng tiêu chí rubric
+- Nếu câu trả lời đúng về bản chất toán học → isCorrect = true
+- Chỉ đánh giá isCorrect = false nếu kết quả hoặc logic sai rõ ràng
+
+TRẢ VỀ DUY NHẤT một JSON object có khóa "results" là mảng kết quả chấm (KHÔNG có text khác, KHÔNG dùng markdown):
+{{
+  "results": [
+    {{
+      "question_number": <số thứ tự câu trong danh sách>,
+      "isCorrect": <true || false>,
+      "score": <điểm từ 0-10>,
+      "comments": "Nhận xét chi tiết về bài làm, bao gồm: 1) Đánh giá độ chính xác, 2) Phân tích các tiêu chí rubric, 3) Điểm mạnh/yếu",
+      "correct_answer": "Đáp án đúng và lời giải chi tiết"
+    }},
+    ...
+  ]
+}}""",
+    user="""Danh sách câu hỏi và câu trả lời của học sinh:{questions}
+
+Lưu ý: Phải trả về ĐÚNG {count} kết quả chấm điểm, question_number đúng như số thứ tự câu trong danh sách trên.""",
+)
+
+PERFORMANCE_QUESTION = PromptTemplate(
+    "performance-question",
+    system="""{config.analysis_system_prompt}
+
+Dựa trên thông tin hiệu suất học tập của học sinh môn {config.name}, hãy tạo MỘT câu hỏi luyện tập phù hợp.
+
+YÊU CẦU CHUNG:
+1. Phân tích điểm yếu/mạnh của học sinh dựa trên điểm số
+2. Đề xuất gợi ý cải thiện cụ thể
+3. Tạo câu hỏi PHÙ HỢP CHÍNH XÁC với nội dung bài kiểm tra gần đây
+4. Câu hỏi phải giúp học sinh cải thiện kỹ năng yếu đã được phát hiện
+
+Trả về 3 JSON với format SAU (KHÔNG thêm text khác, KHÔNG dùng markdown):
+{{
+  "question": "Nội dung câu hỏi luyện tập chi tiết, rõ ràng và TRỰC TIẾP liên quan đến chủ đề trong test title",
+  "answer": "Câu trả lời mẫu đầy đủ, có hướng dẫn từng bước giải chi tiết",
+  "ai_score": 0,
+  "improvement_suggestions": "Gợi ý cải thiện CỤ THỂ dựa trên: 1) Phân tích điểm yếu từ bài test (kèm tên bài), 2) Phương pháp học tập phù hợp với chủ đề đó, 3) Kỹ năng cần rèn luyện liên quan trực tiếp đến nội dung bài test"
+}}
+
+Lưu ý:
+- ai_score luôn là 0 (sẽ được cập nhật sau khi học sinh làm bài)
+- improvement_suggestions phải ĐỀ CẬP CỤ THỂ đến nội dung bài kiểm tra (ví dụ: "Em cần ôn lại phần 'Cách đếm số tự nhiên'...")
+- Câu hỏi phải ĐÚNG chủ đề với test title, không tạo câu chung chung""",
+    user="{prompt}",
+)
+
+RUBRIC_GRADING = PromptTemplate(
+    "grade-with-rubric",
+    system="""Bạn là giáo viên {subject_name} THCS chuyên nghiệp. Chấm điểm công bằng, chi tiết và có tính xây dựng. CHỈ trả về JSON, không có text khác.
+
+Hãy chấm điểm bài làm của học sinh dựa trên rubric, đề bài và đáp án mẫu được cho kèm bài làm.
+
+🎯 YÊU CẦU:
+1. Chấm điểm từng tiêu chí trong rubric (0-10 điểm cho mỗi tiêu chí)
+2. Tính điểm theo trọng số: Điểm tiêu chí × (Trọng số/100)
+3. Tổng điểm = Tổng các điểm đã tính trọng số
+4. Nhận xét chi tiết cho từng tiêu chí
+5. Nhận xét tổng thể và gợi ý cải thiện
+6. question_scores chỉ gồm các câu trong NỘI DUNG BÀI LÀM (các câu đã chấm tự động không cần trả về)
+
+Trả về JSON với format sau (KHÔNG thêm text khác):
+{{
+    "rubric_scores": [
+        {{
+            "criteria_name": "Tên tiêu chí",
+            "weight": <trọng số>,
+            "score": <điểm 0-10>,
+            "weighted_score": <điểm đã nhân trọng số>,
+            "comment": "Nhận xét cho tiêu chí này"
+        }}
+    ],
+    "question_scores": [
+        {{
+            "question_number": <số thứ tự câu trong NỘI DUNG BÀI LÀM>,
+            "max_score": <điểm tối đa>,
+            "student_score": <điểm học sinh đạt được>,
+            "is_correct": <true/false>,
+            "feedback": "Nhận xét cho câu này"
+        }}
+    ],
+    "total_score": <tổng điểm cuối cùng (0-10)>,
+    "overall_comment": "Nhận xét tổng thể về bài làm",
+    "strengths": ["Điểm mạnh 1", "Điểm mạnh 2"],
+    "weaknesses": ["Điểm yếu 1", "Điểm yếu 2"],
+    "improvement_suggestions": "Gợi ý cải thiện chi tiết"
+}}""",
+    # Phần chung của cả bài kiểm tra (rubric, đề bài, đáp án) đứng trước bài làm của từng học sinh
+    user="""📋 THÔNG TIN BÀI KIỂM TRA:
+- Tên bài: {test_title}
+- Môn học: {subject_name}
+
+📊 RUBRIC ĐÁNH GIÁ:
+{rubric}
+
+📖 ĐỀ BÀI VÀ ĐÁP ÁN MẪU:
+{questions}
+
+📝 NỘI DUNG BÀI LÀM của học sinh "{student_name}":
+{answers}
+{objective}""",
+)
@@ -0,0 +1,331 @@
+"""
+Ngân hàng câu hỏi cục bộ cho /generate_question, /recent-test và /performance/question-generation.
+Câu hỏi model sinh ra được lưu lại theo (loại, môn, chủ đề đã chuẩn hóa, độ khó); request sau cùng chủ đề
+được phục vụ ngay từ ngân hàng nếu còn đủ câu học sinh đó chưa gặp, thay vì chờ model vài giây.
+Worker nền sinh thêm câu cho các chủ đề hay được hỏi nhưng sắp hết, vào giờ thấp điểm.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+from datetime import datetime
+
+from config import load_env
+from scheduler import PRIORITY_BULK, priority_scope
+
+load_env()
+
+QUESTION_BANK = os.getenv("QUESTION_BANK", "1") == "1"
+QUESTION_BANK_PATH = os.getenv("QUESTION_BANK_PATH", "question_bank.sqlite3")
+# Chỉ phục vụ từ ngân hàng khi chủ đề đã có ít nhất ngần này câu (tránh mọi học sinh nhận cùng một câu)
+QUESTION_BANK_MIN_STOCK = int(os.getenv("QUESTION_BANK_MIN_STOCK", "3"))
+# Worker nền: số câu mục tiêu mỗi chủ đề, giờ chạy (giờ địa phương, "1-6" hoặc "22-5"; rỗng = mọi lúc)
+# Worker tốn lời gọi model nên mặc định tắt (QUESTION_BANK_REFILL=1 để bật)
+QUESTION_BANK_TARGET_STOCK = int(os.getenv("QUESTION_BANK_TARGET_STOCK", "20"))
+QUESTION_BANK_REFILL = os.getenv("QUESTION_BANK_REFILL", "0") == "1"
+QUESTION_BANK_REFILL_HOURS = os.getenv("QUESTION_BANK_REFILL_HOURS", "1-6")
+QUESTION_BANK_REFILL_INTERVAL_SECONDS = float(os.getenv("QUESTION_BANK_REFILL_INTERVAL_SECONDS", "300"))
+QUESTION_BANK_REFILL_BATCH = int(os.getenv("QUESTION_BANK_REFILL_BATCH", "20"))  # số lời gọi model mỗi lượt
+
+_PUNCTUATION_EDGES = " \t\n.,;:!?\"'“”‘’()[]-"
+
+
+def normalize_topic(topic) -> str:
+    """
+    Chuẩn hóa chủ đề: chữ thường, gộp khoảng trắng, bỏ dấu câu ở hai đầu (giữ dấu tiếng Việt).
+    """
+    text = unicodedata.normalize("NFC", str(topic or "")).casefold()
+    return re.sub(r"\s+", " ", text).strip(_PUNCTUATION_EDGES)
+
+
+@dataclass(frozen=True)
+class BankBucket:
+    kind: str  # generate_question | recent_test | performance
+    subject: str
+    topic: str  # đã chuẩn hóa
+    difficulty: str = "*"  # "*" = không phân theo độ khó
+    variant: str = ""  # ví dụ loại câu hỏi của /recent-test
+
+    @property
+    def key(self) -> str:
+        return "|".join((self.kind, self.subject, self.difficulty, self.variant, self.topic))
+
+
+def bank_bucket(kind: str, subject: str, topic, difficulty: str = "*", variant: str = "") -> BankBucket:
+    return BankBucket(kind, subject, normalize_topic(topic), difficulty, variant)
+
+
+def _payload_hash(payload: dict) -> str:
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class QuestionBank:
+    """
+    Lưu câu hỏi trong SQLite; truy vấn chạy trong thread riêng để không chặn event loop.
+    Ghi sau khi trả response (store) chạy nền; flush() chờ các lần ghi còn dở.
+    """
+
+    def __init__(self, path: str = QUESTION_BANK_PATH, min_stock: int = QUESTION_BANK_MIN_STOCK):
+        self.path = path
+        self.min_stock = min_stock
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            # Mỗi lần lấy câu đều ghi (nhu cầu, câu đã gặp): WAL + synchronous=NORMAL để commit không fsync
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS question_bank_items ("
+                " id INTEGER PRIMARY KEY, bucket TEXT NOT NULL, payload TEXT NOT NULL,"
+                " content_hash TEXT NOT NULL UNIQUE, created_at REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS question_bank_items_bucket ON question_bank_items (bucket);"
+                "CREATE TABLE IF NOT EXISTS question_bank_seen ("
+                " student_id TEXT NOT NULL, item_id INTEGER NOT NULL, seen_at REAL NOT NULL,"
+                " PRIMARY KEY (student_id, item_id));"
+                "CREATE TABLE IF NOT EXISTS question_bank_buckets ("
+                " bucket TEXT PRIMARY KEY, kind TEXT NOT NULL, recipe TEXT NOT NULL,"
+                " demand INTEGER NOT NULL DEFAULT 0, last_requested REAL NOT NULL);"
+            )
+            self._conn.commit()
+
+    def _stock(self, bucket: str) -> int:
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM question_bank_items WHERE bucket = ?", (bucket,)
+        ).fetchone()[0]
+
+    def _take(self, buckets: list[BankBucket], student_id: str | None, recipes: list[dict] | None):
+        now = time.time()
+        with self._lock:
+            if recipes is not None:
+                for bucket, recipe in zip(buckets, recipes):
+                    self._conn.execute(
+                        "INSERT INTO question_bank_buckets (bucket, kind, recipe, demand, last_requested)"
+                        " VALUES (?, ?, ?, 1, ?) ON CONFLICT(bucket) DO UPDATE SET"
+                        " recipe = excluded.recipe, demand = demand + 1, last_requested = excluded.last_requested",
+                        (bucket.key, bucket.kind, json.dumps(recipe, ensure_ascii=False), now),
+                    )
+
+            chosen = []
+            for bucket in buckets:
+                if self._stock(bucket.key) < self.min_stock:
+                    break
+                taken = [item_id for item_id, _ in chosen]
+                row = self._conn.execute(
+                    "SELECT id, payload FROM question_bank_items WHERE bucket = ?"
+                    f" AND id NOT IN ({','.join('?' * len(taken))})"
+                    " AND id NOT IN (SELECT item_id FROM question_bank_seen WHERE student_id = ?)"
+                    " ORDER BY RANDOM() LIMIT 1",
+                    (bucket.key, *taken, student_id or ""),
+                ).fetchone()
+                if row is None:
+                    break
+                chosen.append(row)
+
+            # Phục vụ tất cả hoặc không: thiếu một chủ đề thì cả request đi qua model
+            if len(chosen) < len(buckets):
+                self._conn.commit()
+                return None
+            if student_id:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO question_bank_seen (student_id, item_id, seen_at) VALUES (?, ?, ?)",
+                    [(student_id, item_id, now) for item_id, _ in chosen],
+                )
+            self._conn.commit()
+            return [json.loads(payload) for _, payload in chosen]
+
+    async def take(self, buckets: list[BankBucket], student_id: str | None = None,
+                   recipes: list[dict] | None = None) -> list[dict] | None:
+        """
+        Lấy mỗi bucket một câu học sinh chưa gặp (đánh dấu đã gặp); None nếu có bucket không đủ hàng.
+        recipes: request gốc cho từng bucket, để worker nền sinh thêm câu cho đúng chủ đề đó.
+        """
+        items = await asyncio.to_thread(self._take, buckets, student_id, recipes)
+        if items is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return items
+
+    def _add(self, entries: list[tuple[BankBucket, dict]], student_id: str | None) -> int:
+        now = time.time()
+        added = 0
+        with self._lock:
+            for bucket, payload in entries:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO question_bank_items (bucket, payload, content_hash, created_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    (bucket.key, json.dumps(payload, ensure_ascii=False), _payload_hash(payload), now),
+                )
+                added += cursor.rowcount
+                # Câu vừa sinh cho học sinh này coi như đã gặp
+                if student_id and cursor.rowcount:
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO question_bank_seen (student_id, item_id, seen_at) VALUES (?, ?, ?)",
+                        (student_id, cursor.lastrowid, now),
+                    )
+            self._conn.commit()
+        return added
+
+    async def add(self, entries: list[tuple[BankBucket, dict]], student_id: str | None = None) -> int:
+        """
+        Lưu các câu (bucket, payload); câu trùng nội dung bị bỏ qua. Trả về số câu mới.
+        """
+        if not entries:
+            return 0
+        return await asyncio.to_thread(self._add, entries, student_id)
+
+    def store(self, entries: list[tuple[BankBucket, dict]], student_id: str | None = None):
+        """
+        Như add() nhưng chạy nền, không làm chậm response (dùng được trong callback đồng bộ).
+        """
+        if not entries:
+            return
+        task = asyncio.get_running_loop().create_task(self.add(entries, student_id))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def flush(self):
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    def _low_stock(self, target: int, limit: int) -> list[tuple[BankBucket, dict, int]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT b.bucket, b.recipe, COUNT(i.id) AS stock FROM question_bank_buckets b"
+                " LEFT JOIN question_bank_items i ON i.bucket = b.bucket"
+                " GROUP BY b.bucket HAVING stock < ?"
+                " ORDER BY b.demand DESC, b.last_requested DESC LIMIT ?",
+                (target, limit),
+            ).fetchall()
+        buckets = []
+        for key, recipe, stock in rows:
+            kind, subject, difficulty, variant, topic = key.split("|", 4)
+            buckets.append((BankBucket(kind, subject, topic, difficulty, variant), json.loads(recipe), stock))
+        return buckets
+
+    async def low_stock(self, target: int = QUESTION_BANK_TARGET_STOCK,
+                        limit: int = QUESTION_BANK_REFILL_BATCH) -> list[tuple[BankBucket, dict, int]]:
+        """
+        Các bucket còn ít hơn target câu, chủ đề được hỏi nhiều nhất trước: [(bucket, recipe, stock)].
+        """
+        return await asyncio.to_thread(self._low_stock, target, limit)
+
+    def stats(self) -> dict:
+        with self._lock:
+            items = self._conn.execute("SELECT COUNT(*) FROM question_bank_items").fetchone()[0]
+            buckets = self._conn.execute("SELECT COUNT(*) FROM question_bank_buckets").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "items": items,
+            "buckets": buckets,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def parse_hours(spec: str) -> tuple[int, int] | None:
+    """
+    "1-6" -> (1, 6): chạy từ 1h đến trước 6h; "22-5" vắt qua nửa đêm; rỗng -> None (mọi lúc).
+    """
+    spec = spec.strip()
+    if not spec:
+        return None
+    start, _, end = spec.partition("-")
+    return int(start) % 24, int(end or start) % 24
+
+
+def in_hours(hours: tuple[int, int] | None, hour: int) -> bool:
+    if hours is None:
+        return True
+    start, end = hours
+    return start <= hour < end if start < end else hour >= start or hour < end
+
+
+class QuestionBankRefiller:
+    """
+    Worker nền: vào giờ thấp điểm, sinh thêm câu cho các bucket sắp hết hàng.
+    generators[kind](recipe) -> list[payload] dùng lại đúng đường sinh câu của endpoint.
+    Lời gọi model chạy với ưu tiên BULK nên không chen trước request của người dùng.
+    """
+
+    def __init__(self, bank: QuestionBank, generators: dict, hours: str = QUESTION_BANK_REFILL_HOURS,
+                 interval: float = QUESTION_BANK_REFILL_INTERVAL_SECONDS, batch: int = QUESTION_BANK_REFILL_BATCH,
+                 target: int = QUESTION_BANK_TARGET_STOCK):
+        self.bank = bank
+        self.generators = generators
+        self.hours = parse_hours(hours)
+        self.interval = interval
+        self.batch = batch
+        self.target = target
+        self.generated = 0
+        self.failures = 0
+        self._task = None
+
+    async def _refill_bucket(self, bucket: BankBucket, recipe: dict) -> int:
+        generator = self.generators.get(bucket.kind)
+        if generator is None:
+            return 0
+        try:
+            with priority_scope(PRIORITY_BULK):
+                payloads = await generator(recipe)
+        except Exception:
+            self.failures += 1
+            return 0
+        added = await self.bank.add([(bucket, payload) for payload in payloads])
+        self.generated += added
+        return added
+
+    async def run_once(self) -> int:
+        """
+        Một lượt nạp: mỗi bucket thiếu hàng (tối đa batch bucket) được sinh thêm một lần. Trả về số câu mới.
+        """
+        low = await self.bank.low_stock(self.target, self.batch)
+        added = await asyncio.gather(*(self._refill_bucket(bucket, recipe) for bucket, recipe, _ in low))
+        return sum(added)
+
+    async def _run(self):
+        while True:
+            if in_hours(self.hours, datetime.now().hour):
+                try:
+                    await self.run_once()
+                except Exception as e:
+                    print(f"Question bank refill failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"running": self._task is not None, "generated": self.generated, "failures": self.failures}
+
+
+def create_question_bank() -> QuestionBank | None:
+    """
+    Tạo ngân hàng câu hỏi theo QUESTION_BANK_PATH; None nếu tắt (QUESTION_BANK=0).
+    """
+    if not QUESTION_BANK:
+        return None
+    return QuestionBank()
@@ -0,0 +1,167 @@
+"""
+Cache kết quả gọi LLM theo nội dung (content-addressed).
+Khóa cache là hash của model, messages và các tham số sampling,
+nên các request chấm điểm giống hệt nhau không tốn thêm lời gọi model.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import load_env
+
+load_env()
+
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")  # memory | sqlite | none
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+# Chỉ cache các lời gọi gần như tất định (chấm điểm dùng temperature 0.3)
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv("RESPONSE_CACHE_MAX_TEMPERATURE", "0.3"))
+
+
+def make_cache_key(params: dict) -> str:
+    """
+    Hash SHA-256 của toàn bộ tham số gọi model (model, messages, temperature, top_p, ...).
+    """
+    canonical = json.dumps(params, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """
+    LRU trong bộ nhớ tiến trình, mỗi entry hết hạn sau ttl giây.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: float = RESPONSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+
+    async def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """
+    Lưu cache trên đĩa bằng SQLite để giữ được sau khi khởi động lại server.
+    Truy vấn chạy trong thread riêng để không chặn event loop.
+    """
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, ttl: float = RESPONSE_CACHE_TTL_SECONDS,
+                 table: str = "response_cache"):
+        if not table.isidentifier():
+            raise ValueError(f"Tên bảng không hợp lệ: {table}")
+        self.path = path
+        self.ttl = ttl
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def _get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at < time.time():
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            return value
+
+    def _set(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + self.ttl),
+            )
+            self._conn.commit()
+
+    async def get(self, key: str) -> str | None:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str):
+        await asyncio.to_thread(self._set, key, value)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+class ResponseCache:
+    """
+    Lớp cache đặt trước lời gọi LLM, đếm số lần hit/miss.
+    """
+
+    def __init__(self, backend, max_temperature: float = RESPONSE_CACHE_MAX_TEMPERATURE):
+        self.backend = backend
+        self.max_temperature = max_temperature
+        self.hits = 0
+        self.misses = 0
+
+    def is_cacheable(self, params: dict) -> bool:
+        return params.get("temperature", 1.0) <= self.max_temperature
+
+    async def get(self, key: str) -> str | None:
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: str):
+        await self.backend.set(key, value)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def create_response_cache(backend: str = RESPONSE_CACHE_BACKEND) -> ResponseCache | None:
+    """
+    Tạo cache theo cấu hình RESPONSE_CACHE_BACKEND; trả về None nếu tắt cache.
+    """
+    if backend == "none":
+        return None
+    if backend == "sqlite":
+        return ResponseCache(SQLiteCacheBackend())
+    if backend == "memory":
+        return ResponseCache(MemoryCacheBackend())
+    raise ValueError(f"RESPONSE_CACHE_BACKEND không hợp lệ: {backend}")
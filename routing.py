@@ -0,0 +1,303 @@
+"""
+Chọn model và max_tokens cho từng lời gọi chấm điểm theo endpoint, môn học, loại câu hỏi và độ dài bài làm.
+- Câu khách quan / bài làm ngắn (phần lớn lưu lượng) đi đường nhanh: model nhỏ nhất, max_tokens thấp
+- Bài dài, tự luận, chấm nhiều tiêu chí và các môn trong ROUTING_STANDARD_SUBJECTS dùng model mặc định
+- Chỉ khi output không đọc được, model thiếu tự tin (logprob của isCorrect) hoặc điểm sát ngưỡng đạt
+  mới gọi lại một lần với model mạnh hơn một bậc
+Mỗi quyết định được đếm trong llm_routing_total; đặt ROUTING_LOG_PATH thì ghi thêm vào file JSONL để chỉnh ngưỡng:
+    ROUTING_LOG_PATH=routing.jsonl uvicorn main:app
+    python -m routing report routing.jsonl
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, replace
+
+from config import load_env
+import metrics
+from llm import MODEL_NAME
+from objective_grader import question_kind
+
+load_env()
+
+# Tắt (0): mọi lời gọi dùng MODEL_NAME với max_tokens của endpoint như trước
+ROUTING = os.getenv("ROUTING", "1").lower() not in ("0", "false", "no")
+ROUTING_FAST_MODEL = os.getenv("ROUTING_FAST_MODEL", "gpt-4.1-nano")
+ROUTING_STRONG_MODEL = os.getenv("ROUTING_STRONG_MODEL", "gpt-4o")
+# Bài làm tới chừng này token (và không phải tự luận) được coi là câu ngắn -> đường nhanh
+ROUTING_SHORT_ANSWER_TOKENS = int(os.getenv("ROUTING_SHORT_ANSWER_TOKENS", "40"))
+ROUTING_FAST_MAX_TOKENS = int(os.getenv("ROUTING_FAST_MAX_TOKENS", "256"))
+# Môn cần nhận xét tinh tế hơn: luôn dùng model mặc định (key trong registry môn học, cách nhau dấu phẩy)
+ROUTING_STANDARD_SUBJECTS = {s.strip() for s in os.getenv("ROUTING_STANDARD_SUBJECTS", "van").split(",") if s.strip()}
+# Leo thang: tắt (0) để chỉ định tuyến, không gọi lại
+ROUTING_ESCALATE = os.getenv("ROUTING_ESCALATE", "1").lower() not in ("0", "false", "no")
+# Xác suất (theo logprob) của token true/false trong isCorrect dưới ngưỡng này -> leo thang
+ROUTING_MIN_CONFIDENCE = float(os.getenv("ROUTING_MIN_CONFIDENCE", "0.8"))
+# Điểm (thang 10) trong khoảng này coi là sát ngưỡng đạt -> leo thang
+ROUTING_BORDERLINE_MIN = float(os.getenv("ROUTING_BORDERLINE_MIN", "4.5"))
+ROUTING_BORDERLINE_MAX = float(os.getenv("ROUTING_BORDERLINE_MAX", "5.5"))
+# File JSONL ghi từng quyết định (mặc định rỗng: không ghi); quá ROUTING_LOG_MAX_BYTES thì đổi tên thành .1
+ROUTING_LOG_PATH = os.getenv("ROUTING_LOG_PATH", "")
+ROUTING_LOG_MAX_BYTES = int(os.getenv("ROUTING_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+
+FAST, STANDARD, STRONG = "fast", "standard", "strong"
+TIERS = (FAST, STANDARD, STRONG)
+TIER_MODELS = {FAST: ROUTING_FAST_MODEL, STANDARD: MODEL_NAME, STRONG: ROUTING_STRONG_MODEL}
+
+# Bài văn, chấm nhiều tiêu chí, bài làm trong ảnh (không biết trước độ dài): luôn dùng model mặc định
+_STANDARD_TYPES = {"essay", "rubric", "image"}
+
+
+@dataclass(frozen=True)
+class Route:
+    endpoint: str
+    subject: str | None
+    question_type: str | None
+    answer_tokens: int
+    tier: str
+    model: str
+    max_tokens: int
+    reason: str
+    logprobs: bool = False
+
+    def params(self) -> dict:
+        # Tham số model / max_tokens (+ logprobs để đo độ tự tin) cho chat_completion
+        params = {"model": self.model, "max_tokens": self.max_tokens}
+        if self.logprobs:
+            params["logprobs"] = True
+        return params
+
+    def escalated(self) -> "Route | None":
+        """
+        Route bậc trên gần nhất có model khác (max_tokens không giảm); None nếu đã là bậc cao nhất.
+        """
+        if not (ROUTING and ROUTING_ESCALATE):
+            return None
+        for tier in TIERS[TIERS.index(self.tier) + 1:]:
+            if TIER_MODELS[tier] != self.model:
+                return replace(self, tier=tier, model=TIER_MODELS[tier], reason="escalated", logprobs=False)
+        return None
+
+
+def choose_route(endpoint: str, subject=None, answer_tokens: int = 0, question_type=None, max_tokens: int = 512,
+                 fast_max_tokens: int | None = None, confidence: bool = False) -> Route:
+    """
+    Route cho một lời gọi. subject: key môn học; question_type: questionType của câu ("essay" cho bài văn,
+    "rubric" cho chấm nhiều tiêu chí, "image" cho bài làm trong ảnh, None nếu không rõ); fast_max_tokens: max_tokens ở đường nhanh.
+    confidence=True: xin logprobs để leo thang khi model không chắc về isCorrect.
+    """
+    kind = question_kind(question_type)
+    # questionType lạ (không phải loại khách quan nào) coi như tự luận
+    free_response = question_type in _STANDARD_TYPES or (question_type is not None and kind is None)
+    if not ROUTING:
+        tier, reason = STANDARD, "disabled"
+    elif free_response:
+        tier, reason = STANDARD, "question_type"
+    elif subject in ROUTING_STANDARD_SUBJECTS:
+        tier, reason = STANDARD, "subject"
+    elif kind is not None:
+        tier, reason = FAST, "objective"
+    elif answer_tokens <= ROUTING_SHORT_ANSWER_TOKENS:
+        tier, reason = FAST, "short_answer"
+    else:
+        tier, reason = STANDARD, "long_answer"
+
+    model = TIER_MODELS[tier] if ROUTING else MODEL_NAME
+    if tier == FAST:
+        max_tokens = min(max_tokens, fast_max_tokens or ROUTING_FAST_MAX_TOKENS)
+    route = Route(endpoint, subject, question_type, answer_tokens, tier, model, max_tokens, reason)
+    return replace(route, logprobs=confidence and route.escalated() is not None)
+
+
+def verdict_confidence(response) -> float | None:
+    """
+    Xác suất model gán cho token true/false đầu tiên (isCorrect); None nếu response không có logprobs.
+    """
+    logprobs = getattr(response.choices[0], "logprobs", None)
+    for token in getattr(logprobs, "content", None) or []:
+        if token.token.strip().lower() in ("true", "false"):
+            return round(math.exp(token.logprob), 4)
+    return None
+
+
+def escalation_reason(result, score=None, is_correct=None, confidence=None) -> str | None:
+    """
+    Lý do cần hỏi lại model mạnh hơn, hoặc None nếu kết quả dùng được.
+    """
+    if result is None:
+        return "unparseable"
+    if confidence is not None and confidence < ROUTING_MIN_CONFIDENCE:
+        return "low_confidence"
+    if score is None:
+        return None
+    if is_correct is not None and (
+        (is_correct and score < ROUTING_BORDERLINE_MIN) or (not is_correct and score > ROUTING_BORDERLINE_MAX)
+    ):
+        return "inconsistent"
+    if ROUTING_BORDERLINE_MIN <= score <= ROUTING_BORDERLINE_MAX:
+        return "borderline_score"
+    return None
+
+
+class RoutingLog:
+    """
+    Ghi quyết định định tuyến ra file JSONL. Bản ghi được gom lại và ghi trong thread nền
+    (một task ghi tại một thời điểm) để không chặn event loop.
+    """
+
+    def __init__(self, path: str, max_bytes: int = ROUTING_LOG_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._task = None
+
+    def write(self, record: dict):
+        self._buffer.append(json.dumps(record, ensure_ascii=False))
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._drain())
+
+    async def _drain(self):
+        while self._buffer:
+            lines, self._buffer = self._buffer, []
+            await asyncio.to_thread(self._append, lines)
+
+    def _append(self, lines: list[str]):
+        with self._lock:
+            try:
+                if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+            except OSError as e:
+                print(f"Không ghi được routing log {self.path}: {e}")
+
+    async def flush(self):
+        if self._task is not None:
+            await self._task
+
+
+class ModelRouter:
+    """
+    Chọn route, gọi model, leo thang khi cần và ghi lại quyết định.
+    """
+
+    def __init__(self, log: RoutingLog | None = None):
+        self.log = log
+
+    def record(self, route: Route, outcomes: dict, **details):
+        """
+        outcomes: {"accepted" | lý do leo thang: số câu}; details đi kèm bản ghi trong log.
+        """
+        for outcome, count in outcomes.items():
+            metrics.count_routing(route.tier, outcome, count)
+        if self.log is not None:
+            record = {"time": round(time.time(), 3), **asdict(route), "outcomes": outcomes, **details}
+            record.pop("logprobs")
+            self.log.write(record)
+
+    async def complete(self, llm, route: Route, parse, signals=None, cache: bool = False, **kwargs):
+        """
+        Gọi model theo route; nếu kết quả cần leo thang thì gọi lại một lần với route bậc trên.
+        parse(text) -> object hoặc None; signals(object) -> {"score", "is_correct"} cho escalation_reason.
+        Trả về (response, object); object là None nếu không lần nào đọc được.
+        """
+        start = time.perf_counter()
+        response = await llm.chat_completion(cache=cache, **route.params(), **kwargs)
+        result = parse(response.choices[0].message.content)
+        first = _observations(result, response, signals)
+        reason = escalation_reason(result, **first)
+        stronger = route.escalated() if reason is not None else None
+        if stronger is None:
+            self.record(route, {reason or "accepted": 1}, first=first, seconds=round(time.perf_counter() - start, 3))
+            return response, result
+
+        details = {"first": first, "escalated_model": stronger.model}
+        try:
+            retry = await llm.chat_completion(cache=cache, **stronger.params(), **kwargs)
+        except Exception as e:
+            # Model mạnh lỗi: vẫn dùng kết quả đầu nếu đọc được
+            if result is None:
+                raise
+            details["escalation_error"] = str(e)
+        else:
+            retry_result = parse(retry.choices[0].message.content)
+            final = _observations(retry_result, retry, signals)
+            changed = retry_result is not None and _verdict(final) != _verdict(first)
+            details.update(final=final, changed=changed)
+            if retry_result is not None:
+                response, result = retry, retry_result
+        self.record(route, {reason: 1}, **details, seconds=round(time.perf_counter() - start, 3))
+        return response, result
+
+    async def flush(self):
+        if self.log is not None:
+            await self.log.flush()
+
+
+def _verdict(observed: dict) -> tuple:
+    return observed.get("score"), observed.get("is_correct")
+
+
+def _observations(result, response, signals) -> dict:
+    observed = dict(signals(result)) if result is not None and signals is not None else {}
+    confidence = verdict_confidence(response)
+    if confidence is not None:
+        observed["confidence"] = confidence
+    return observed
+
+
+def create_model_router() -> ModelRouter:
+    return ModelRouter(RoutingLog(ROUTING_LOG_PATH) if ROUTING_LOG_PATH else None)
+
+
+def summarize(records) -> dict:
+    """
+    Gom log theo (endpoint, tier): số câu, tỉ lệ câu bị gắn cờ theo lý do và tỉ lệ leo thang làm đổi kết quả.
+    """
+    groups = {}
+    for record in records:
+        group = groups.setdefault(f"{record['endpoint']} {record['tier']}", {
+            "calls": 0, "items": 0, "outcomes": {}, "escalations": 0, "changed": 0, "confidence": [],
+        })
+        group["calls"] += 1
+        for outcome, count in record["outcomes"].items():
+            group["items"] += count
+            group["outcomes"][outcome] = group["outcomes"].get(outcome, 0) + count
+        if "escalated_model" in record:
+            # changed: True/False với một câu, số câu đổi kết quả với một nhóm câu
+            group["escalations"] += sum(count for outcome, count in record["outcomes"].items() if outcome != "accepted")
+            group["changed"] += int(record.get("changed") or 0)
+        confidence = (record.get("first") or {}).get("confidence")
+        if confidence is not None:
+            group["confidence"].append(confidence)
+
+    summary = {}
+    for key, group in sorted(groups.items()):
+        confidence = sorted(group.pop("confidence"))
+        group["flagged_rate"] = round(1 - group["outcomes"].get("accepted", 0) / group["items"], 3) if group["items"] else 0
+        group["changed_rate"] = round(group["changed"] / group["escalations"], 3) if group["escalations"] else None
+        if confidence:
+            group["confidence_p10"] = confidence[len(confidence) // 10]
+            group["confidence_p50"] = confidence[len(confidence) // 2]
+        summary[key] = group
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thống kê log định tuyến model để chỉnh ngưỡng")
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("path", nargs="?", default=ROUTING_LOG_PATH or "routing.jsonl")
+    args = parser.parse_args()
+
+    with open(args.path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    print(json.dumps(summarize(records), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""
+Điều phối mọi lời gọi OpenAI theo hạn mức RPM/TPM của tài khoản.
+- Token bucket cho request/phút và token/phút; chi phí một lời gọi ước lượng từ prompt + max_tokens
+- Đọc header x-ratelimit-* của OpenAI để bám sát hạn mức thực tế (dùng chung key với worker khác)
+- Việc vượt hạn mức được xếp hàng theo ưu tiên: chấm bài tương tác trước, sinh câu hỏi hàng loạt sau
+- Lỗi 429 / 5xx / mất kết nối được thử lại với exponential backoff có jitter;
+  khi bị 429 cả hàng đợi cùng tạm dừng thay vì tiếp tục dội request
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from config import load_env
+import metrics
+
+load_env()
+
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "20"))
+# Chờ trong hàng đợi quá lâu thì báo quá tải thay vì giữ kết nối của client
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "120"))
+
+PRIORITY_INTERACTIVE = 0  # học sinh / giáo viên đang chờ kết quả chấm
+PRIORITY_BATCH = 1  # chấm cả lớp, chấm theo rubric nhiều câu
+PRIORITY_BULK = 2  # sinh câu hỏi, gợi ý luyện tập
+
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch", PRIORITY_BULK: "bulk"}
+
+ENDPOINT_PRIORITIES = {
+    "/auto-grading": PRIORITY_INTERACTIVE,
+    "/auto-grading/file": PRIORITY_INTERACTIVE,
+    "/auto-grading/image": PRIORITY_INTERACTIVE,
+    "/grade-essay": PRIORITY_INTERACTIVE,
+    "/recent-test-grading": PRIORITY_INTERACTIVE,
+    "/grade-with-rubric": PRIORITY_INTERACTIVE,
+    "/auto-grading/batch": PRIORITY_BATCH,
+    "/generate": PRIORITY_BULK,
+    "/generate_question": PRIORITY_BULK,
+    "/recent-test": PRIORITY_BULK,
+    "/analyze-teacher-feedback": PRIORITY_BULK,
+    "/performance/question-generation": PRIORITY_BULK,
+}
+
+# Token ước lượng cho mỗi ảnh (detail=high) và mỗi message
+_IMAGE_TOKENS = 765
+_MESSAGE_OVERHEAD_TOKENS = 4
+# Tiếng Việt có dấu tốn nhiều token hơn tiếng Anh: ước lượng thận trọng 3 ký tự / token
+_CHARS_PER_TOKEN = 3
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+_priority: ContextVar[int | None] = ContextVar("llm_priority", default=None)
+
+
+class QueueTimeoutError(RuntimeError):
+    pass
+
+
+def parse_duration(value: str | None) -> float | None:
+    """
+    "1s", "6m0s", "20ms", "1h2m3.5s" -> số giây.
+    """
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def estimate_request_tokens(params: dict) -> int:
+    """
+    Số token một lời gọi chiếm trong hạn mức TPM: prompt ước lượng + max_tokens.
+    """
+    chars, images = 0, 0
+    messages = params.get("messages") or []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    chars += len(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    images += 1
+    prompt_tokens = chars // _CHARS_PER_TOKEN + images * _IMAGE_TOKENS + len(messages) * _MESSAGE_OVERHEAD_TOKENS
+    return prompt_tokens + (params.get("max_tokens") or 0)
+
+
+def current_priority() -> int:
+    priority = _priority.get()
+    if priority is not None:
+        return priority
+    return ENDPOINT_PRIORITIES.get(metrics.current_labels().endpoint, PRIORITY_BATCH)
+
+
+@contextmanager
+def priority_scope(priority: int):
+    """
+    Gán mức ưu tiên cho các lời gọi model trong khối with (ghi đè bảng theo endpoint).
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """
+    Bucket nạp lại đều theo hạn mức mỗi phút.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / 60.0
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def seconds_until(self, amount: float) -> float:
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate) if self.rate else float("inf")
+
+    def set_limit(self, per_minute: float):
+        if per_minute > 0:
+            self.capacity = float(per_minute)
+            self.level = min(self.level, self.capacity)
+
+
+def _is_retryable(error: Exception) -> bool:
+    import openai  # đã được nạp khi có lời gọi model (xem LLMClient.client)
+
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _is_rate_limit(error: Exception) -> bool:
+    import openai
+
+    return isinstance(error, openai.RateLimitError)
+
+
+def _retry_after(error: Exception) -> float | None:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    return parse_duration(headers.get("retry-after"))
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        max_concurrency: int,
+        rpm_limit: int = OPENAI_RPM_LIMIT,
+        tpm_limit: int = OPENAI_TPM_LIMIT,
+        max_retries: int = LLM_MAX_RETRIES,
+        backoff_base: float = LLM_BACKOFF_BASE_SECONDS,
+        backoff_max: float = LLM_BACKOFF_MAX_SECONDS,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(rpm_limit)
+        self.tokens = TokenBucket(tpm_limit)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.retries = 0
+        self.throttled = 0  # số lần nhận 429
+        self._waiters = []  # heap (priority, seq, future, tokens)
+        self._depth = dict.fromkeys(PRIORITY_NAMES, 0)  # số caller còn chờ theo ưu tiên
+        self._seq = itertools.count()
+        self._timer = None
+
+    def queue_depth(self) -> dict:
+        return {PRIORITY_NAMES[priority]: depth for priority, depth in self._depth.items()}
+
+    def _change_depth(self, priority: int, delta: int):
+        self._depth[priority] += delta
+        metrics.LLM_QUEUE_DEPTH.set(self._depth[priority], priority=PRIORITY_NAMES[priority])
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+
+        while self._waiters and self.in_flight < self.max_concurrency:
+            priority, _, future, cost = self._waiters[0]
+            if future.done():  # caller đã hủy (client ngắt kết nối)
+                heapq.heappop(self._waiters)
+                continue
+            wait = max(
+                self.paused_until - now,
+                self.requests.seconds_until(1),
+                self.tokens.seconds_until(cost),
+            )
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                break
+            heapq.heappop(self._waiters)
+            self.requests.level -= 1
+            self.tokens.level -= min(cost, self.tokens.capacity)
+            self.in_flight += 1
+            self._change_depth(priority, -1)
+            future.set_result(None)
+
+    async def acquire(self, cost: int, priority: int) -> float:
+        """
+        Chờ tới lượt theo ưu tiên và hạn mức; trả về số giây đã chờ.
+        """
+        if priority not in PRIORITY_NAMES:
+            priority = PRIORITY_BATCH
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future, cost))
+        self._change_depth(priority, 1)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done():
+                self.release()  # vừa được cấp slot đúng lúc hết giờ / bị hủy
+            else:
+                future.cancel()
+                self._change_depth(priority, -1)
+                self._dispatch()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise QueueTimeoutError(
+                f"Hệ thống đang quá tải, đã chờ {self.queue_timeout:.0f} giây. Vui lòng thử lại sau."
+            ) from None
+        waited = time.monotonic() - start
+        metrics.LLM_QUEUE_WAIT_SECONDS.observe(waited, priority=PRIORITY_NAMES[priority])
+        return waited
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def observe_headers(self, headers):
+        """
+        Cập nhật bucket theo header x-ratelimit-* (hạn mức thật, đã tính cả worker khác).
+        """
+        now = time.monotonic()
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            if limit and limit.isdigit():
+                bucket.set_limit(int(limit))
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining and remaining.isdigit():
+                bucket.refill(now)
+                bucket.level = min(bucket.level, int(remaining))
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    async def run(self, call, params: dict, priority: int | None = None, hold: bool = False):
+        """
+        Gọi call() (trả về raw response có .headers) khi tới lượt; thử lại lỗi tạm thời.
+        hold=True: giữ slot sau khi thành công (stream), caller tự gọi release() khi đọc xong.
+        """
+        priority = current_priority() if priority is None else priority
+        cost = estimate_request_tokens(params)
+        attempt = 0
+        while True:
+            await self.acquire(cost, priority)
+            succeeded = False
+            try:
+                raw = await call()
+                succeeded = True
+            except Exception as e:
+                if not _is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                rate_limited = _is_rate_limit(e)
+                reason = "rate_limit" if rate_limited else "server_error"
+                if rate_limited:
+                    # Cả hàng đợi cùng lùi lại, tránh dội thêm request khi đã chạm hạn mức
+                    self.throttled += 1
+                    self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                self.retries += 1
+                metrics.LLM_RETRIES.inc(reason=reason)
+            else:
+                self.observe_headers(raw.headers)
+                return raw
+            finally:
+                if not (succeeded and hold):
+                    self.release()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth(),
+            "rpm_limit": int(self.requests.capacity),
+            "tpm_limit": int(self.tokens.capacity),
+            "requests_available": int(self.requests.level),
+            "tokens_available": int(self.tokens.level),
+            "paused_for_seconds": round(max(0.0, self.paused_until - now), 3),
+            "retries": self.retries,
+            "throttled": self.throttled,
+        }
@@ -0,0 +1,207 @@
+"""
+Model Pydantic cho output của model ở từng endpoint.
+Mỗi model được gửi kèm lời gọi dưới dạng JSON schema strict (response_format json_schema): OpenAI
+ràng buộc việc sinh token theo schema nên output luôn là JSON đúng cấu trúc, trừ khi bị cắt ở max_tokens.
+Output được validate một lần thành object có kiểu; các heuristic của json_extract chỉ còn là đường lui
+(output bị cắt, STRUCTURED_OUTPUT=0) và được đếm trong json_extract_total để biết còn cần tới mức nào.
+"""
+import copy
+import os
+from functools import lru_cache
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, model_validator
+
+from config import load_env
+import metrics
+from json_extract import locate_json
+
+load_env()
+
+# Tắt (0) để quay về format cũ: JSON mô tả trong prompt, response_format json_object hoặc không có
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "1").lower() not in ("0", "false", "no")
+
+_DIFFICULTY = {"enum": ["easy", "medium", "hard"]}
+
+
+class GradingVerdict(BaseModel):
+    # /auto-grading/file, /auto-grading/image
+    isCorrect: bool
+    comments: str
+
+
+class AnswerGrading(GradingVerdict):
+    # /auto-grading, /auto-grading/batch
+    score: float
+
+
+class GeneratedQuestion(BaseModel):
+    # /generate_question
+    question: str
+    answer: str
+    difficulty: str = Field("medium", json_schema_extra=_DIFFICULTY)
+
+
+class RecentTestQuestion(BaseModel):
+    topic: str
+    question: str
+    difficulty: str = Field("medium", json_schema_extra=_DIFFICULTY)
+
+
+class RecentTestQuestions(BaseModel):
+    # /recent-test: schema phải là object nên array câu hỏi được bọc trong "questions"
+    questions: list[RecentTestQuestion]
+
+
+class TeacherFeedback(BaseModel):
+    # /analyze-teacher-feedback
+    exercise_question: str
+    improve_suggestion: str
+
+
+class QuestionGrading(BaseModel):
+    question_number: int = 0  # 0: model không đánh số, ghép theo vị trí
+    isCorrect: bool = False
+    score: float
+    comments: str = ""
+    correct_answer: str = ""
+
+
+class QuestionGradings(BaseModel):
+    # /recent-test-grading (một nhóm câu)
+    results: list[QuestionGrading]
+
+
+class PerformanceQuestion(BaseModel):
+    # /performance/question-generation
+    question: str
+    answer: str
+    ai_score: int = 0
+    improvement_suggestions: str
+
+
+class EssayCriteriaScores(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    content: float = Field(alias="Nội dung")
+    reasoning: float = Field(alias="Phân tích & lập luận")
+    language: float = Field(alias="Diễn đạt & ngôn ngữ")
+    creativity: float = Field(alias="Sáng tạo")
+
+
+class EssayGrading(BaseModel):
+    # /grade-essay
+    grade: float
+    comments: str
+    criteria_scores: EssayCriteriaScores
+    strengths: str = ""
+    weaknesses: str = ""
+
+
+class RubricScore(BaseModel):
+    criteria_name: str
+    weight: float
+    score: float
+    weighted_score: float
+    comment: str = ""
+
+
+class QuestionScore(BaseModel):
+    question_number: int
+    max_score: float
+    student_score: float
+    is_correct: bool
+    feedback: str = ""
+
+
+class RubricGrading(BaseModel):
+    # /grade-with-rubric
+    rubric_scores: list[RubricScore] = []
+    question_scores: list[QuestionScore] = []
+    total_score: float
+    overall_comment: str = ""
+    strengths: list[str] = []
+    weaknesses: list[str] = []
+    improvement_suggestions: str = ""
+
+    @model_validator(mode="before")
+    @classmethod
+    def _fill_total(cls, data):
+        # Output không theo schema có thể thiếu total_score: tính lại từ rubric_scores
+        if isinstance(data, dict) and "total_score" not in data and isinstance(data.get("rubric_scores"), list):
+            total = sum(item.get("weighted_score", 0) for item in data["rubric_scores"] if isinstance(item, dict))
+            data = dict(data, total_score=round(total, 2))
+        return data
+
+
+def _strict(node):
+    """
+    Chuyển schema của Pydantic sang dạng strict của OpenAI: mọi field là bắt buộc, không có field lạ,
+    bỏ default / title (giá trị mặc định chỉ dùng khi parse output không theo schema).
+    """
+    if isinstance(node, list):
+        for item in node:
+            _strict(item)
+        return
+    if not isinstance(node, dict):
+        return
+    node.pop("default", None)
+    node.pop("title", None)
+    if node.get("type") == "object" and "properties" in node:
+        node["required"] = list(node["properties"])
+        node["additionalProperties"] = False
+    for key, value in node.items():
+        if key in ("properties", "$defs"):
+            for child in value.values():
+                _strict(child)
+        else:
+            _strict(value)
+
+
+@lru_cache(maxsize=None)
+def strict_schema(model: type[BaseModel]) -> dict:
+    schema = copy.deepcopy(model.model_json_schema(by_alias=True))
+    _strict(schema)
+    return schema
+
+
+def output_format(model: type[BaseModel], fallback: dict | None = None) -> dict:
+    """
+    Tham số response_format cho chat_completion: JSON schema strict của model,
+    hoặc fallback (format cũ của endpoint) khi tắt STRUCTURED_OUTPUT.
+    """
+    if STRUCTURED_OUTPUT:
+        return {"response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": model.__name__, "strict": True, "schema": strict_schema(model)},
+        }}
+    return {"response_format": fallback} if fallback is not None else {}
+
+
+def parse_output(model: type[BaseModel], text):
+    """
+    Validate output của model thành object; None nếu không dùng được.
+    Mức đã dùng được đếm trong json_extract_total: "schema" (đúng schema ngay),
+    các mức fallback của json_extract, "invalid" (có JSON nhưng sai cấu trúc) hoặc "none".
+    """
+    if isinstance(text, str):
+        try:
+            result = model.model_validate_json(text)
+            metrics.count_json_tier("schema")
+            return result
+        except ValidationError:
+            pass
+
+    value, tier = locate_json(text)
+    if isinstance(value, list) and len(model.model_fields) == 1:
+        # Format cũ (array ở cấp cao nhất) của các model bọc array
+        value = {next(iter(model.model_fields)): value}
+    if value is None:
+        metrics.count_json_tier("none")
+        return None
+    try:
+        result = model.model_validate(value)
+    except ValidationError:
+        metrics.count_json_tier("invalid")
+        return None
+    metrics.count_json_tier(tier)
+    return result
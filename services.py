@@ -0,0 +1,119 @@
+"""
+Các client dùng chung của app (OpenAI, định tuyến model, tải file, ảnh, ngân hàng câu hỏi, hàng đợi job).
+Mỗi client được tạo ở lần dùng đầu tiên chứ không phải lúc import main, nên tool / test import main
+không phải trả giá khởi tạo; test truyền sẵn bản giả qua create_app(Services(llm=FakeLLM())).
+"""
+import importlib
+import os
+
+from file_fetcher import FileFetcher
+from image_ingest import ImageIngestor, create_image_ingestor
+from jobs import JobQueue, create_job_queue
+from llm import LLMClient, preload_openai
+from question_bank import QuestionBank, create_question_bank
+from routing import ModelRouter, create_model_router
+
+
+class Services:
+    def __init__(self, **instances):
+        # Client đã tạo (hoặc được truyền sẵn), kể cả None cho tính năng đang tắt
+        self._instances = dict(instances)
+        self.job_handlers = {}  # {tên endpoint: JobHandler}, main đăng ký khi tạo app
+
+    def _get(self, name: str, factory):
+        if name not in self._instances:
+            self._instances[name] = factory()
+        return self._instances[name]
+
+    def peek(self, name: str):
+        """
+        Client đã tạo, hoặc None nếu chưa ai dùng tới (cho /health: không tạo client chỉ để báo trạng thái).
+        """
+        return self._instances.get(name)
+
+    @property
+    def llm(self) -> LLMClient:
+        # Async OpenAI client (pool kết nối dùng chung, giới hạn đồng thời)
+        return self._get("llm", lambda: LLMClient(api_key=os.getenv("OPENAI_API_KEY")))
+
+    @property
+    def router(self) -> ModelRouter:
+        # Chọn model / max_tokens cho lời gọi chấm điểm, leo thang khi cần, ghi log quyết định
+        return self._get("router", create_model_router)
+
+    @property
+    def file_fetcher(self) -> FileFetcher:
+        # Tải file bài làm (text, PDF, DOCX, ảnh): pool kết nối dùng chung, giới hạn dung lượng,
+        # cache ngắn hạn theo URL + ETag
+        from document_ingest import DOCUMENT_MAX_BYTES
+
+        return self._get("file_fetcher", lambda: FileFetcher(max_bytes=DOCUMENT_MAX_BYTES))
+
+    @property
+    def document_ingestor(self):
+        # Nhận dạng định dạng + tách text PDF / DOCX (process pool, cache theo hash nội dung).
+        # document_ingest kéo theo pypdf nên chỉ import khi cần
+        from document_ingest import create_document_ingestor
+
+        return self._get("document_ingestor", create_document_ingestor)
+
+    @property
+    def image_fetcher(self) -> FileFetcher:
+        # Ảnh gốc chỉ dùng một lần nên không giữ trong cache
+        from image_preprocess import IMAGE_SOURCE_MAX_BYTES
+
+        return self._get("image_fetcher", lambda: FileFetcher(max_bytes=IMAGE_SOURCE_MAX_BYTES, cache_max_entries=0))
+
+    @property
+    def image_ingestor(self) -> ImageIngestor:
+        # Tiếp nhận ảnh bài làm cho /auto-grading/image (IMAGE_HOST=fake để chạy không cần Cloudinary)
+        return self._get("image_ingestor", create_image_ingestor)
+
+    @property
+    def image_preprocessor(self):
+        # Tiền xử lý ảnh (xoay, ảnh xám, cắt, thu nhỏ, nén) trong process pool; None nếu tắt hoặc thiếu Pillow.
+        # image_preprocess kéo theo Pillow nên chỉ import khi cần
+        from image_preprocess import create_image_preprocessor
+
+        return self._get("image_preprocessor", create_image_preprocessor)
+
+    @property
+    def question_bank(self) -> QuestionBank | None:
+        # Ngân hàng câu hỏi (SQLite): phục vụ /generate_question, /recent-test, /performance/question-generation
+        return self._get("question_bank", create_question_bank)
+
+    @property
+    def job_queue(self) -> JobQueue | None:
+        return self._get("job_queue", lambda: create_job_queue(self.job_handlers))
+
+    def preload(self):
+        """
+        Import trước các thư viện nặng (openai, Pillow, pypdf); gọi trong thread nền lúc khởi động.
+        """
+        preload_openai()
+        importlib.import_module("image_preprocess")
+        importlib.import_module("document_ingest")
+
+    async def aclose(self):
+        """
+        Đóng các client đã tạo (job trước, vì job còn dùng các client khác).
+        """
+        job_queue = self.peek("job_queue")
+        if job_queue is not None:
+            await job_queue.stop()
+            job_queue.close()
+        question_bank = self.peek("question_bank")
+        if question_bank is not None:
+            await question_bank.flush()
+            question_bank.close()
+        router = self.peek("router")
+        if router is not None:
+            await router.flush()
+        for name in ("llm", "file_fetcher", "image_fetcher"):
+            client = self.peek(name)
+            if client is not None:
+                await client.aclose()
+        for name in ("image_preprocessor", "document_ingestor"):
+            pool_owner = self.peek(name)
+            if pool_owner is not None:
+                pool_owner.shutdown()
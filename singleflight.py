@@ -0,0 +1,76 @@
+"""
+Gộp các lời gọi giống hệt nhau đang chạy đồng thời (singleflight).
+Khi giáo viên bấm "chấm lại" hoặc frontend gửi lại request sau timeout, các bản trùng
+gắn vào lời gọi đang chạy và nhận cùng kết quả thay vì gọi model thêm lần nữa.
+Lời gọi chung chạy trong task riêng được shield: client ngắt kết nối không hủy nó.
+"""
+import asyncio
+import hashlib
+import json
+import re
+
+_TRAILING_SPACE = re.compile(r"[ \t]+(?=\n|$)")
+
+
+def _normalize_text(text: str) -> str:
+    # Chỉ bỏ khoảng trắng cuối dòng / cuối text và thống nhất xuống dòng: thụt đầu dòng và khoảng trắng
+    # giữa dòng có nghĩa (bài làm Python), hai bài khác nhau ở đó không được gộp chung
+    return _TRAILING_SPACE.sub("", text.replace("\r\n", "\n").replace("\r", "\n")).rstrip()
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return _normalize_text(value)
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def coalesce_key(params: dict) -> str:
+    """
+    Khóa gộp: hash của tham số gọi model sau khi chuẩn hóa khoảng trắng cuối dòng trong prompt.
+    """
+    canonical = json.dumps(_normalize(params), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}  # key -> asyncio.Task
+        self.leaders = 0
+        self.followers = 0
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._inflight
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Đánh dấu lỗi đã được xem nếu mọi caller đều đã rời đi
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: str, fn):
+        """
+        Chạy fn() một lần cho mỗi key đang bay; các caller cùng key chờ chung một kết quả.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.followers += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        total = self.leaders + self.followers
+        return {
+            "in_flight": len(self._inflight),
+            "calls": self.leaders,
+            "coalesced": self.followers,
+            "coalesced_rate": round(self.followers / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,168 @@
+"""
+Hỗ trợ stream kết quả (Server-Sent Events) cho các endpoint sinh output dài.
+Token từ model được đưa qua bộ parse JSON tăng dần; mỗi phần tử array
+vừa đóng được gửi ngay cho client thay vì chờ cả completion.
+"""
+import asyncio
+import json
+
+from fastapi.responses import StreamingResponse
+
+from json_extract import locate_json
+
+
+class IncrementalArrayParser:
+    """
+    Nhận text theo từng mảnh và trả về các phần tử array đã đóng hoàn chỉnh.
+
+    Hỗ trợ hai dạng output:
+    - array ở cấp cao nhất: [ {...}, {...} ]          -> field = None
+    - object chứa array:    {"rubric_scores": [ {...} ]} -> field = "rubric_scores"
+    Chỉ phần tử là object/array mới được phát ra; text ngoài JSON (markdown, lời dẫn) bị bỏ qua.
+    """
+
+    def __init__(self):
+        self._stack = []  # các ký tự ngoặc đang mở
+        self._in_string = False
+        self._escape = False
+        self._string_buffer = None  # gom chuỗi ở cấp object gốc để biết tên key
+        self._last_root_string = None
+        self._field = None
+        self._element = None  # các mảnh text của phần tử đang đọc
+        self._counts = {}
+
+    def _element_depth(self) -> int | None:
+        # Độ sâu (len(stack)) mà tại đó một ngoặc mở là đầu một phần tử cần phát
+        if not self._stack:
+            return None
+        if self._stack == ["["]:
+            return 1
+        if len(self._stack) == 2 and self._stack[0] == "{" and self._stack[1] == "[":
+            return 2
+        return None
+
+    def feed(self, chunk: str) -> list[tuple[str | None, int, object]]:
+        """
+        Trả về danh sách (field, index, item) của các phần tử vừa hoàn thành trong chunk này.
+        """
+        completed = []
+        start = 0  # đầu đoạn chunk thuộc phần tử đang đọc
+        for i, ch in enumerate(chunk):
+            if self._in_string:
+                if self._string_buffer is not None:
+                    self._string_buffer.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._string_buffer is not None:
+                        self._last_root_string = "".join(self._string_buffer[:-1])
+                        self._string_buffer = None
+                continue
+
+            if not self._stack:
+                if ch in "[{":
+                    self._stack.append(ch)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if len(self._stack) == 1 and self._stack[0] == "{":
+                    self._string_buffer = []
+            elif ch == ":" and len(self._stack) == 1:
+                self._field = self._last_root_string
+            elif ch in "[{":
+                if self._element is None and self._element_depth() is not None:
+                    self._element = []
+                    start = i
+                self._stack.append(ch)
+            elif ch in "]}":
+                self._stack.pop()
+                if self._element is not None and self._element_depth() is not None:
+                    self._element.append(chunk[start:i + 1])
+                    # Không đếm metric theo từng phần tử: output đầy đủ được đếm một lần khi parse kết quả cuối
+                    item, _ = locate_json("".join(self._element))
+                    self._element = None
+                    if item is not None:
+                        field = self._field if self._stack[0] == "{" else None
+                        index = self._counts.get(field, 0)
+                        self._counts[field] = index + 1
+                        completed.append((field, index, item))
+
+        if self._element is not None:
+            self._element.append(chunk[start:])
+        return completed
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _sse_events(chunks, on_item, on_complete, prelude=(), root_field=None):
+    parser = IncrementalArrayParser()
+    parts = []
+    offsets = {}  # số phần tử đã gửi trước theo field, để index của model nối tiếp
+    try:
+        for field, item in prelude:
+            index = offsets.get(field, 0)
+            offsets[field] = index + 1
+            yield sse_event("item", {"field": field, "index": index, "item": item})
+        async for chunk in chunks:
+            parts.append(chunk)
+            for field, index, item in parser.feed(chunk):
+                if field is not None and field == root_field:
+                    field = None
+                payload = on_item(field, index, item) if on_item is not None else item
+                if payload is not None:
+                    index += offsets.get(field, 0)
+                    yield sse_event("item", {"field": field, "index": index, "item": payload})
+        # Sự kiện cuối: đúng payload mà endpoint trả về ở chế độ không stream
+        yield sse_event("result", on_complete("".join(parts)))
+    except Exception as e:
+        yield sse_event("error", {"success": False, "error": str(e)})
+
+
+def stream_json_response(chunks, on_complete, on_item=None, prelude=(), root_field=None) -> StreamingResponse:
+    """
+    Tạo response SSE từ các mảnh text của model.
+    on_item(field, index, item) -> payload (None để bỏ qua); on_complete(full_text) -> kết quả cuối.
+    prelude: các (field, item) đã có sẵn (không cần model), gửi ngay trước khi model trả token đầu tiên.
+    root_field: structured output bọc array trong object {root_field: [...]}; phần tử của array này
+    được gửi như array ở cấp cao nhất (field = None).
+    """
+    return StreamingResponse(
+        _sse_events(chunks, on_item, on_complete, prelude, root_field),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _sse_produced(produce):
+    queue = asyncio.Queue()
+    task = asyncio.ensure_future(produce(lambda field, index, item: queue.put_nowait(
+        {"field": field, "index": index, "item": item})))
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+    try:
+        while (event := await queue.get()) is not None:
+            yield sse_event("item", event)
+        yield sse_event("result", task.result())
+    except Exception as e:
+        yield sse_event("error", {"success": False, "error": str(e)})
+    finally:
+        # Client ngắt kết nối giữa chừng: dừng các lời gọi model còn lại
+        if not task.done():
+            task.cancel()
+
+
+def stream_items_response(produce) -> StreamingResponse:
+    """
+    Tạo response SSE khi các phần tử được tạo ra từ nhiều lời gọi model song song (không theo thứ tự).
+    produce(emit) là coroutine gọi emit(field, index, item) cho mỗi phần tử xong và trả về kết quả cuối.
+    """
+    return StreamingResponse(
+        _sse_produced(produce),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,292 @@
+"""
+Registry môn học dùng chung cho mọi endpoint.
+Toàn bộ prompt, ví dụ JSON và rubric text được dựng sẵn một lần khi import,
+handler chỉ cần tra cứu một SubjectEntry bất biến.
+Thêm môn học mới: chỉ cần bổ sung một mục vào _SUBJECT_DEFINITIONS (kể cả tiêu chí rubric).
+"""
+import json
+from dataclasses import dataclass
+from types import MappingProxyType
+
+# Dữ liệu riêng của từng môn (nguồn duy nhất); các system prompt dùng chung mẫu nên được sinh từ "name"
+_SUBJECT_DEFINITIONS = {
+    "math": {
+        "name": "Toán",
+        "rubric_name": "Toán",
+        "rubric": [
+            {"name": "Đáp án đúng", "weight": 90},
+            {"name": "Kỹ năng tính toán", "weight": 10}
+        ],
+        "question_type": "toán học",
+        "grading_prompt": "Bạn là giáo viên Toán THCS. Hãy chấm điểm bài làm toán dựa trên các bước giải và kết quả cuối cùng.",
+        "question_example": {
+            "question": "Cho A = {1,2,3} và B = {2,3,4}. Tìm A giao B.",
+            "answer": "A giao B là tập hợp các phần tử thuộc cả A và B. Các phần tử chung là 2 và 3. Vậy A giao B = {2,3}.",
+            "difficulty": "easy"
+        },
+        "feedback_example": {
+            "exercise_question": "Giải phương trình: 2x + 5 = 15",
+            "improve_suggestion": "Em cần rèn luyện thêm kỹ năng chuyển vế và tính toán cẩn thận hơn."
+        }
+    },
+    "van": {
+        "name": "Ngữ văn",
+        "rubric_name": "Ngữ văn",
+        "rubric": [
+            {"name": "Đọc hiểu văn bản", "weight": 30},
+            {"name": "Viết (cấu trúc, lập luận)", "weight": 40},
+            {"name": "Diễn đạt & dùng từ", "weight": 20},
+            {"name": "Chính tả, ngữ pháp", "weight": 10}
+        ],
+        "question_type": "văn học",
+        "grading_prompt": "Bạn là giáo viên Ngữ văn THCS. Hãy chấm điểm bài làm văn dựa trên nội dung, lập luận và diễn đạt.",
+        "question_example": {
+            "question": "Phân tích hình ảnh người lái đò trong tác phẩm 'Người lái đò sông Đà' của Nguyễn Tuân.",
+            "answer": "Người lái đò là hình ảnh người lao động chân chất, giản dị. Tác giả miêu tả ông qua ngoại hình, cử chỉ và lời nói, thể hiện sức mạnh và tình yêu nghề nghiệp. Hình ảnh này ca ngợi vẻ đẹp của người lao động Việt Nam.",
+            "difficulty": "medium"
+        },
+        "feedback_example": {
+            "exercise_question": "Nêu cảm nhận của em về nhân vật trong đoạn trích đã học.",
+            "improve_suggestion": "Em cần phân biệt rõ nội dung và nghệ thuật trong bài phân tích."
+        }
+    },
+    "english": {
+        "name": "Tiếng Anh",
+        "rubric_name": "Tiếng Anh",
+        "rubric": [
+            {"name": "Từ vựng – ngữ pháp", "weight": 30},
+            {"name": "Nghe", "weight": 20},
+            {"name": "Nói", "weight": 20},
+            {"name": "Đọc – Viết", "weight": 30}
+        ],
+        "question_type": "tiếng Anh",
+        "grading_prompt": "Bạn là giáo viên Tiếng Anh THCS. Hãy chấm điểm bài làm tiếng Anh dựa trên ngữ pháp, từ vựng và ý tưởng.",
+        "question_example": {
+            "question": "Fill in the blank: She _____ to school every day. (go/goes)",
+            "answer": "Đáp án: goes. Giải thích: Chủ ngữ 'She' là ngôi thứ 3 số ít nên động từ phải thêm 's/es'. Do đó ta dùng 'goes'.",
+            "difficulty": "easy"
+        },
+        "feedback_example": {
+            "exercise_question": "Rewrite the sentence using past perfect tense: She finished her homework before dinner.",
+            "improve_suggestion": "Em cần ôn lại cấu trúc thì quá khứ hoàn thành và cách sử dụng trong ngữ cảnh."
+        }
+    },
+    "physics": {
+        "name": "Vật lý",
+        "rubric_name": "Vật lí",
+        "rubric": [
+            {"name": "Hiểu khái niệm, định luật", "weight": 35},
+            {"name": "Vận dụng giải bài tập", "weight": 35},
+            {"name": "Thí nghiệm – quan sát", "weight": 20},
+            {"name": "Trình bày", "weight": 10}
+        ],
+        "question_type": "vật lý",
+        "grading_prompt": "Bạn là giáo viên Vật lý THCS. Hãy chấm điểm bài làm vật lý dựa trên phương pháp giải và kết quả.",
+        "question_example": {
+            "question": "Một vật chuyển động đều với vận tốc 36 km/h trong 2 giờ. Tính quãng đường vật đi được.",
+            "answer": "Quãng đường = vận tốc × thời gian = 36 km/h × 2h = 72 km. Vậy quãng đường vật đi được là 72 km.",
+            "difficulty": "easy"
+        },
+        "feedback_example": {
+            "exercise_question": "Tính lực ma sát khi một vật có khối lượng 5kg trượt trên mặt phẳng ngang với hệ số ma sát 0.3.",
+            "improve_suggestion": "Em cần nắm vững công thức tính lực ma sát và đơn vị đo lường."
+        }
+    },
+    "chemistry": {
+        "name": "Hóa học",
+        "rubric_name": "Hóa học",
+        "rubric": [
+            {"name": "Kiến thức hóa học", "weight": 40},
+            {"name": "Phương trình, tính toán", "weight": 30},
+            {"name": "Thực hành – an toàn", "weight": 20},
+            {"name": "Trình bày", "weight": 10}
+        ],
+        "question_type": "hóa học",
+        "grading_prompt": "Bạn là giáo viên Hóa học THCS. Hãy chấm điểm bài làm hóa học dựa trên các phản ứng và tính toán.",
+        "question_example": {
+            "question": "Viết phương trình hóa học của phản ứng giữa natri (Na) và nước (H₂O).",
+            "answer": "Phương trình: 2Na + 2H₂O → 2NaOH + H₂. Giải thích: Natri là kim loại kiềm hoạt động mạnh, phản ứng với nước tạo dung dịch bazơ natri hydroxit và giải phóng khí hydro.",
+            "difficulty": "medium"
+        },
+        "feedback_example": {
+            "exercise_question": "Cân bằng phương trình phản ứng: Fe + O₂ → Fe₂O₃",
+            "improve_suggestion": "Em cần rèn luyện kỹ năng cân bằng phương trình hóa học và hiểu rõ quy tắc hóa trị."
+        }
+    },
+    "biology": {
+        "name": "Sinh học",
+        "rubric_name": "Sinh học",
+        "rubric": [
+            {"name": "Hiểu kiến thức sinh học", "weight": 40},
+            {"name": "Vận dụng thực tiễn", "weight": 25},
+            {"name": "Quan sát – phân tích", "weight": 25},
+            {"name": "Thuật ngữ khoa học", "weight": 10}
+        ],
+        "question_type": "sinh học",
+        "grading_prompt": "Bạn là giáo viên Sinh học THCS. Hãy chấm điểm bài làm sinh học dựa trên kiến thức và phân tích.",
+        "question_example": {
+            "question": "Nêu chức năng chính của hệ tuần hoàn ở động vật có xương sống.",
+            "answer": "Hệ tuần hoàn có các chức năng: 1) Vận chuyển oxy và chất dinh dưỡng đến các tế bào, 2) Đưa CO₂ và chất thải ra khỏi cơ thể, 3) Điều hòa thân nhiệt, 4) Bảo vệ cơ thể chống bệnh tật.",
+            "difficulty": "easy"
+        },
+        "feedback_example": {
+            "exercise_question": "Giải thích quá trình quang hợp ở thực vật và vai trò của diệp lục.",
+            "improve_suggestion": "Em cần hiểu rõ các giai đoạn quang hợp và mối liên hệ giữa chúng."
+        }
+    },
+    "geography": {
+        "name": "Địa lý",
+        "rubric_name": "Địa lí",
+        "rubric": [
+            {"name": "Kiến thức địa lí", "weight": 35},
+            {"name": "Bản đồ – biểu đồ", "weight": 30},
+            {"name": "Phân tích số liệu", "weight": 25},
+            {"name": "Trình bày", "weight": 10}
+        ],
+        "question_type": "địa lý",
+        "grading_prompt": "Bạn là giáo viên Địa lý THCS. Hãy chấm điểm bài làm địa lý dựa trên hiểu biết về địa hình và khí hậu.",
+        "question_example": {
+            "question": "Nêu đặc điểm khí hậu nhiệt đới gió mùa ở Việt Nam.",
+            "answer": "Khí hậu nhiệt đới gió mùa có đặc điểm: 1) Nhiệt độ cao quanh năm (trung bình >20°C), 2) Có 2 mùa rõ rệt: mùa mưa và mùa khô, 3) Lượng mưa lớn tập trung vào mùa hè, 4) Chịu ảnh hưởng của gió mùa Đông Bắc và Tây Nam.",
+            "difficulty": "easy"
+        },
+        "feedback_example": {
+            "exercise_question": "Phân tích đặc điểm khí hậu nhiệt đới gió mùa ở miền Nam Việt Nam.",
+            "improve_suggestion": "Em cần nắm vững các yếu tố ảnh hưởng đến khí hậu và cách phân tích bản đồ khí hậu."
+        }
+    },
+    "history": {
+        "name": "Lịch sử",
+        "rubric_name": "Lịch sử",
+        "rubric": [
+            {"name": "Sự kiện – mốc thời gian", "weight": 40},
+            {"name": "Phân tích – nhận xét", "weight": 30},
+            {"name": "Liên hệ thực tế", "weight": 20},
+            {"name": "Trình bày", "weight": 10}
+        ],
+        "question_type": "lịch sử",
+        "grading_prompt": "Bạn là giáo viên Lịch sử THCS. Hãy chấm điểm bài làm lịch sử dựa trên sự kiện và phân tích lịch sử.",
+        "question_example": {
+            "question": "Nêu ý nghĩa lịch sử của chiến thắng Bạch Đằng năm 938.",
+            "answer": "Ý nghĩa: 1) Đánh bại quân Nam Hán, kết thúc 1000 năm Bắc thuộc, 2) Mở ra thời kỳ độc lập tự chủ cho dân tộc Việt Nam, 3) Khẳng định ý chí tự chủ và năng lực quân sự của dân tộc, 4) Ngô Quyền trở thành vua đầu tiên của nước Việt Nam độc lập.",
+            "difficulty": "medium"
+        },
+        "feedback_example": {
+            "exercise_question": "Phân tích ý nghĩa của cuộc khởi nghĩa Hai Bà Trưng trong lịch sử dân tộc.",
+            "improve_suggestion": "Em cần nắm rõ mốc thời gian và nguyên nhân - kết quả của các sự kiện lịch sử."
+        }
+    },
+    "civics": {
+        "name": "Giáo dục Công dân",
+        "rubric_name": "Giáo dục công dân",
+        "rubric": [
+            {"name": "Đạo đức – pháp luật", "weight": 40},
+            {"name": "Xử lý tình huống", "weight": 30},
+            {"name": "Thái độ, hành vi", "weight": 20},
+            {"name": "Trình bày", "weight": 10}
+        ],
+        "question_type": "giáo dục công dân",
+        "grading_prompt": "Bạn là giáo viên Giáo dục Công dân THCS. Hãy chấm điểm bài làm GDCD dựa trên quyền và nghĩa vụ công dân.",
+        "question_example": {
+            "question": "Nêu quyền và nghĩa vụ cơ bản của công dân Việt Nam.",
+            "answer": "Quyền: 1) Quyền bình đẳng, 2) Quyền tự do ngôn luận, 3) Quyền bầu cử và ứng cử, 4) Quyền được học tập. Nghĩa vụ: 1) Tuân thủ pháp luật, 2) Bảo vệ Tổ quốc, 3) Nộp thuế, 4) Giữ gìn môi trường.",
+            "difficulty": "easy"
+        },
+        "feedback_example": {
+            "exercise_question": "Trình bày các quyền và nghĩa vụ cơ bản của công dân theo Hiến pháp 2013.",
+            "improve_suggestion": "Em cần hiểu rõ sự khác biệt giữa quyền và nghĩa vụ công dân trong các tình huống cụ thể."
+        }
+    },
+    "informatics": {
+        "name": "Tin học",
+        "rubric_name": "Tin học",
+        "rubric": [
+            {"name": "Kiến thức tin học", "weight": 30},
+            {"name": "Thao tác máy tính", "weight": 40},
+            {"name": "Tư duy thuật toán", "weight": 20},
+            {"name": "Ý thức sử dụng CNTT", "weight": 10}
+        ],
+        "question_type": "tin học",
+        "grading_prompt": "Bạn là giáo viên Tin học THCS. Hãy chấm điểm bài làm tin học dựa trên code và logic.",
+        "question_example": {
+            "question": "Viết chương trình Python tính tổng hai số a và b.",
+            "answer": "Code:\na = int(input('Nhập số a: '))\nb = int(input('Nhập số b: '))\ntong = a + b\nprint('Tổng =', tong)\n\nGiải thích: Chương trình nhận 2 số từ người dùng, cộng lại và in kết quả.",
+            "difficulty": "easy"
+        },
+        "feedback_example": {
+            "exercise_question": "Viết chương trình nhập vào số nguyên n và in ra tổng các số từ 1 đến n.",
+            "improve_suggestion": "Em cần rèn luyện tư duy thuật toán và cách sử dụng vòng lặp hiệu quả."
+        }
+    }
+}
+
+
+@dataclass(frozen=True)
+class SubjectEntry:
+    key: str  # Khóa tiếng Anh: math, van, english, ...
+    name: str  # Tên hiển thị trong prompt: Toán, Vật lý, ...
+    rubric_name: str  # Tên rubric: Toán, Vật lí, ...
+    question_type: str
+    grading_prompt: str
+    question_system_prompt: str
+    practice_system_prompt: str
+    analysis_system_prompt: str
+    test_grading_system_prompt: str
+    question_example_json: str
+    feedback_example_json: str
+    rubric_criteria: tuple
+    rubric_text: str  # Khối "Tiêu chí chấm điểm (Rubric)"
+    assessment_rubric_text: str  # Khối "Tiêu chí đánh giá (Rubric)"
+
+
+def _render_rubric_text(title: str, rubric_criteria) -> str:
+    if not rubric_criteria:
+        return ""
+    rubric_text = f"\n\n{title}:\n"
+    for criterion in rubric_criteria:
+        rubric_text += f"- {criterion['name']}: {criterion['weight']}%\n"
+    return rubric_text
+
+
+def _build_entry(key: str, definition: dict) -> SubjectEntry:
+    name = definition["name"]
+    rubric_name = definition["rubric_name"]
+    rubric_criteria = tuple(MappingProxyType(dict(c)) for c in definition.get("rubric", ()))
+    return SubjectEntry(
+        key=key,
+        name=name,
+        rubric_name=rubric_name,
+        question_type=definition["question_type"],
+        grading_prompt=definition["grading_prompt"],
+        question_system_prompt=f"Bạn là giáo viên {name} THCS. CHỈ trả về JSON, không có text khác.",
+        practice_system_prompt=f"Bạn là giáo viên {name} THCS chuyên tạo câu hỏi luyện tập. Hãy luôn tạo đầy đủ số lượng câu hỏi theo yêu cầu.",
+        analysis_system_prompt=f"Bạn là giáo viên {name} THCS chuyên phân tích năng lực học sinh. CHỈ trả về JSON, không có text khác.",
+        test_grading_system_prompt=f"Bạn là giáo viên {name} THCS chuyên chấm điểm bài tập. CHỈ trả về JSON, không có text khác.",
+        question_example_json=json.dumps(definition["question_example"], ensure_ascii=False),
+        feedback_example_json=json.dumps(definition["feedback_example"], ensure_ascii=False),
+        rubric_criteria=rubric_criteria,
+        rubric_text=_render_rubric_text("Tiêu chí chấm điểm (Rubric)", rubric_criteria),
+        assessment_rubric_text=_render_rubric_text("Tiêu chí đánh giá (Rubric)", rubric_criteria),
+    )
+
+
+SUBJECTS = MappingProxyType({
+    key: _build_entry(key, definition) for key, definition in _SUBJECT_DEFINITIONS.items()
+})
+
+SUPPORTED_SUBJECTS = ", ".join(SUBJECTS.keys())
+
+# Bí danh -> khóa tiếng Anh: khóa, tên hiển thị và tên rubric (không phân biệt hoa thường)
+_SUBJECT_ALIASES = MappingProxyType({
+    alias.casefold(): entry.key
+    for entry in SUBJECTS.values()
+    for alias in (entry.key, entry.name, entry.rubric_name)
+})
+
+
+def resolve_subject(subject: str) -> SubjectEntry | None:
+    """
+    Tra cứu môn học theo khóa tiếng Anh hoặc tên tiếng Việt; None nếu không hỗ trợ.
+    """
+    key = _SUBJECT_ALIASES.get(subject.strip().casefold())
+    return SUBJECTS[key] if key is not None else None
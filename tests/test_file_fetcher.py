@@ -0,0 +1,123 @@
+import asyncio
+import unicodedata
+
+import httpx
+import pytest
+
+from bench.fake_file_host import FakeFileHost
+from file_fetcher import FileFetcher, FileTooLargeError, detect_encoding
+
+# "Điểm" trong cp1258 (dấu thanh là ký tự tổ hợp 0xD2)
+_LEGACY = b"\xd0i\xea\xd2m"
+
+
+def _fetch(urls: list[str], **kwargs) -> list:
+    """
+    Tải lần lượt các URL bằng cùng một FileFetcher; phần tử là FetchedFile hoặc exception.
+    """
+    async def run():
+        fetcher = FileFetcher(**kwargs)
+        results = []
+        try:
+            for url in urls:
+                try:
+                    results.append(await fetcher.fetch(url))
+                except Exception as e:
+                    results.append(e)
+        finally:
+            await fetcher.aclose()
+        return results
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("content_length", [True, False])
+def test_max_bytes(content_length):
+    files = {"/small.txt": (b"x" * 100, "text/plain"), "/big.txt": (b"x" * 5000, "text/plain")}
+    with FakeFileHost(files, content_length=content_length) as host:
+        small, big = _fetch([host.url("/small.txt"), host.url("/big.txt")], max_bytes=1000)
+    assert small.content == b"x" * 100
+    assert isinstance(big, FileTooLargeError)
+
+
+def test_etag_revalidation():
+    with FakeFileHost({"/a.txt": ("x = 5".encode(), "text/plain; charset=utf-8")}) as host:
+        first, second = _fetch([host.url("/a.txt"), host.url("/a.txt")], cache_ttl=0)
+    assert first.etag and second is first
+    assert [status for _, _, status in host.requests] == [200, 304]
+
+
+def test_cache_within_ttl_and_after_expiry():
+    with FakeFileHost({"/a.txt": (b"v1", "text/plain")}) as host:
+        url = host.url("/a.txt")
+
+        async def run():
+            fetcher = FileFetcher(cache_ttl=0.2)
+            try:
+                first = await fetcher.fetch(url)
+                cached = await fetcher.fetch(url)
+                host.add_file("/a.txt", b"v2", "text/plain")
+                await asyncio.sleep(0.3)
+                return first, cached, await fetcher.fetch(url)
+            finally:
+                await fetcher.aclose()
+
+        first, cached, expired = asyncio.run(run())
+    assert cached is first
+    assert expired.content == b"v2"
+    assert [status for _, _, status in host.requests] == [200, 200]
+
+
+def test_changed_file_is_downloaded_again():
+    with FakeFileHost({"/a.txt": (b"v1", "text/plain")}) as host:
+        url = host.url("/a.txt")
+
+        async def run():
+            fetcher = FileFetcher(cache_ttl=0)
+            try:
+                await fetcher.fetch(url)
+                host.add_file("/a.txt", b"v2", "text/plain")
+                return await fetcher.fetch(url)
+            finally:
+                await fetcher.aclose()
+
+        assert asyncio.run(run()).content == b"v2"
+
+
+def test_oversized_files_are_not_cached():
+    with FakeFileHost({"/a.txt": (b"x" * 500, "text/plain")}) as host:
+        _fetch([host.url("/a.txt"), host.url("/a.txt")], cache_max_file_bytes=100)
+    assert [status for _, _, status in host.requests] == [200, 200]
+
+
+def test_not_found():
+    with FakeFileHost() as host:
+        result, = _fetch([host.url("/missing.txt")])
+    assert isinstance(result, httpx.HTTPStatusError)
+
+
+@pytest.mark.parametrize("content, content_type, expected", [
+    (_LEGACY, "text/plain; charset=windows-1258", "cp1258"),
+    ("Điểm".encode("utf-16"), "text/plain; charset=utf-16", "utf-16"),
+    # charset không hợp lệ: bỏ qua, dò tiếp
+    ("Điểm".encode("utf-8"), "text/plain; charset=khong-co", "utf-8"),
+    ("Điểm".encode("utf-8-sig"), "text/plain", "utf-8-sig"),
+    ("Điểm".encode("utf-16"), "text/plain", "utf-16"),
+    ("Điểm".encode("utf-8"), "text/plain", "utf-8"),
+    (_LEGACY, "text/plain", "cp1258"),
+    (b"", "", "utf-8"),
+])
+def test_detect_encoding(content, content_type, expected):
+    assert detect_encoding(content, content_type) == expected
+
+
+def test_fetch_decodes_text():
+    files = {
+        "/utf8.txt": ("Đúng rồi".encode("utf-8"), "text/plain"),
+        "/legacy.txt": (b"\xd0\xfang r\xf4\xcci", "text/plain"),
+        "/declared.txt": ("Đúng rồi".encode("utf-16"), "text/plain; charset=utf-16"),
+    }
+    with FakeFileHost(files) as host:
+        results = _fetch([host.url(path) for path in files])
+    assert [unicodedata.normalize("NFC", result.text) for result in results] == ["Đúng rồi"] * 3
+    assert [result.encoding for result in results] == ["utf-8", "cp1258", "utf-16"]
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from image_ingest import CloudinaryImageHost, FakeImageHost, ImageIngestor
+from response_cache import SQLiteCacheBackend
+
+SOURCE_URL = "https://example.com/bai-lam.jpg"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteCacheBackend(path=str(tmp_path / "images.sqlite3"), table="hosted_images")
+
+
+def _ingest(ingestor: ImageIngestor, *urls: str) -> list:
+    async def run():
+        return [await ingestor.ingest(url) for url in urls]
+
+    return asyncio.run(run())
+
+
+def test_hosted_url_passes_through(store):
+    host = FakeImageHost()
+    hosted_url = FakeImageHost.BASE_URL + "abc.jpg"
+    result, = _ingest(ImageIngestor(host, store), hosted_url)
+    assert (result.status, result.url, result.source_url) == ("passthrough", hosted_url, hosted_url)
+    assert host.uploads == []
+
+
+def test_upload_then_cached(store):
+    host = FakeImageHost()
+    first, second = _ingest(ImageIngestor(host, store), SOURCE_URL, SOURCE_URL)
+    assert first.status == "uploaded" and first.url.startswith(FakeImageHost.BASE_URL)
+    assert second.status == "cached" and second.url == first.url
+    assert host.uploads == [SOURCE_URL]
+
+
+def test_cache_survives_new_ingestor(tmp_path):
+    path = str(tmp_path / "images.sqlite3")
+    host = FakeImageHost()
+    first, = _ingest(ImageIngestor(host, SQLiteCacheBackend(path=path, table="hosted_images")), SOURCE_URL)
+    again, = _ingest(ImageIngestor(host, SQLiteCacheBackend(path=path, table="hosted_images")), SOURCE_URL)
+    assert (again.status, again.url) == ("cached", first.url)
+    assert len(host.uploads) == 1
+
+
+def test_expired_entry_is_uploaded_again(tmp_path):
+    host = FakeImageHost()
+    ingestor = ImageIngestor(host, SQLiteCacheBackend(path=str(tmp_path / "images.sqlite3"), ttl=-1,
+                                                      table="hosted_images"))
+    statuses = [result.status for result in _ingest(ingestor, SOURCE_URL, SOURCE_URL)]
+    assert statuses == ["uploaded", "uploaded"]
+
+
+def test_without_store_always_uploads():
+    host = FakeImageHost()
+    statuses = [result.status for result in _ingest(ImageIngestor(host), SOURCE_URL, SOURCE_URL)]
+    assert statuses == ["uploaded", "uploaded"]
+    assert host.uploads == [SOURCE_URL, SOURCE_URL]
+
+
+def test_empty_upload_url_is_an_error(store):
+    class BrokenHost(FakeImageHost):
+        def upload(self, source_url: str) -> str:
+            return ""
+
+    with pytest.raises(RuntimeError):
+        _ingest(ImageIngestor(BrokenHost(), store), SOURCE_URL)
+
+
+@pytest.mark.parametrize("url, hosted", [
+    ("https://res.cloudinary.com/demo/image/upload/a.jpg", True),
+    ("http://res.cloudinary.com/demo/image/upload/a.jpg", False),
+    ("https://res.cloudinary.com.evil.test/a.jpg", False),
+    ("https://example.com/res.cloudinary.com/a.jpg", False),
+])
+def test_cloudinary_is_hosted(url, hosted):
+    assert CloudinaryImageHost().is_hosted(url) is hosted
@@ -0,0 +1,86 @@
+import asyncio
+import socket
+
+import httpx
+import pytest
+from pydantic import BaseModel
+
+from jobs import JobHandler, JobQueue, JobStore, check_callback_url, pin_callback_url
+
+
+def _resolve_to(monkeypatch, *addresses):
+    def getaddrinfo(host, port, *args, **kwargs):
+        family = socket.AF_INET6 if ":" in addresses[0] else socket.AF_INET
+        return [(family, socket.SOCK_STREAM, 6, "", (address, port or 0)) for address in addresses]
+
+    monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+
+
+@pytest.mark.parametrize("addresses, allowed", [
+    (("93.184.216.34",), True),
+    (("127.0.0.1",), False),
+    (("10.0.0.5",), False),
+    (("169.254.169.254",), False),
+    (("93.184.216.34", "192.168.1.1"), False),
+    (("::ffff:127.0.0.1",), False),
+])
+def test_check_callback_url(monkeypatch, addresses, allowed):
+    _resolve_to(monkeypatch, *addresses)
+    reason = asyncio.run(check_callback_url("https://hooks.example.com/done", frozenset()))
+    assert (reason is None) is allowed
+
+
+def test_allowed_hosts():
+    assert asyncio.run(check_callback_url("http://10.0.0.5/cb", frozenset({"10.0.0.5"}))) is None
+    assert asyncio.run(check_callback_url("http://other.test/cb", frozenset({"10.0.0.5"}))) is not None
+    assert asyncio.run(check_callback_url("ftp://hooks.example.com/cb", frozenset())) is not None
+
+
+@pytest.mark.parametrize("url, address, expected_url, host", [
+    ("https://hooks.example.com/done?x=1", "93.184.216.34", "https://93.184.216.34/done?x=1", "hooks.example.com"),
+    ("http://u:p@hooks.example.com:8080/done", "93.184.216.34", "http://u:p@93.184.216.34:8080/done",
+     "hooks.example.com:8080"),
+    ("https://hooks.example.com/done", "2606:2800::1", "https://[2606:2800::1]/done", "hooks.example.com"),
+])
+def test_pin_callback_url(url, address, expected_url, host):
+    pinned, headers, extensions = pin_callback_url(url, address)
+    assert pinned == expected_url and headers == {"Host": host}
+    assert extensions == ({"sni_hostname": "hooks.example.com"} if url.startswith("https") else {})
+
+
+def test_pin_callback_url_without_address():
+    assert pin_callback_url("https://hooks.example.com/done", None) == ("https://hooks.example.com/done", {}, {})
+
+
+class EchoRequest(BaseModel):
+    text: str = ""
+
+
+def test_callback_goes_to_checked_address(monkeypatch, tmp_path):
+    # Request gửi thẳng tới IP vừa kiểm tra nên HTTP client không phân giải DNS lần nữa (tránh DNS rebinding)
+    _resolve_to(monkeypatch, "93.184.216.34")
+    received = []
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        received.append((str(request.url), request.headers["host"], request.extensions.get("sni_hostname")))
+        return httpx.Response(200)
+
+    async def echo(request):
+        return {"success": True}
+
+    async def run():
+        queue = JobQueue(JobStore(str(tmp_path / "jobs.sqlite3")), {"echo": JobHandler(EchoRequest, echo)}, poll=0.05,
+                         transport=httpx.MockTransport(handle), callback_hosts=frozenset())
+        queue.start()
+        try:
+            await queue.submit("echo", {}, "https://hooks.example.com/done")
+            for _ in range(100):
+                if queue.callbacks_sent or queue.callbacks_failed:
+                    break
+                await asyncio.sleep(0.02)
+        finally:
+            await queue.stop()
+            queue.close()
+
+    asyncio.run(run())
+    assert received == [("https://93.184.216.34/done", "hooks.example.com", "hooks.example.com")]
@@ -0,0 +1,103 @@
+import pytest
+
+from objective_grader import (
+    CHOICE, NUMERIC, SHORT_ANSWER, TRUE_FALSE, grade_objective_question, infer_kind, match_answer, parse_quantity,
+)
+
+
+@pytest.mark.parametrize("student, solution, expected", [
+    ("2,5", "2.5", True),
+    ("2.5", "2,5", True),
+    ("x = -3/4", "-0.75", True),
+    ("1000", "1000.0", True),
+    # Dấu tách hàng nghìn không rõ: để model đánh giá
+    ("1.000", "1000", None),
+    ("1,000", "1000", None),
+    ("1000", "1.000", None),
+    ("1.000", "1", None),
+    # Cả hai cách đọc đều sai / đều đúng thì luật kết luận được
+    ("2.000", "1000", False),
+    ("1.000.000", "1000000", True),
+    ("3", "4", False),
+])
+def test_separators(student, solution, expected):
+    assert match_answer(NUMERIC, student, solution) is expected
+
+
+@pytest.mark.parametrize("student, solution, expected", [
+    ("300 cm", "3 m", True),
+    ("3 m", "300 cm", True),
+    ("3 m", "3 cm", False),
+    ("2 kg", "2000 g", True),
+    ("1,5 giờ", "90 phút", True),
+    ("12 cm", "12", True),
+    ("10%", "0.1", None),
+    ("3 kg", "3 m", None),
+    ("5 quả", "5 cái", None),
+])
+def test_units(student, solution, expected):
+    assert match_answer(NUMERIC, student, solution) is expected
+
+
+@pytest.mark.parametrize("student, solution, expected", [
+    ("0.540", "0.54", True),
+    # Học sinh làm tròn thô hơn đáp án: đề có thể yêu cầu làm tròn
+    ("3.1416", "3.14159", None),
+    ("0.33", "1/3", None),
+    ("0.5", "0.54", None),
+    ("0.54", "0.5", None),
+    ("0.7", "0.54", False),
+    ("3.14159", "3.14159", True),
+])
+def test_precision(student, solution, expected):
+    assert match_answer(NUMERIC, student, solution) is expected
+
+
+@pytest.mark.parametrize("student, solution, expected", [
+    ("B", "b", True),
+    ("(B)", "B", True),
+    ("b.", "B", True),
+    ("Đáp án: C", "C", True),
+    ("chọn A", "B", False),
+    ("Hà Nội", "B", None),
+])
+def test_option_letters(student, solution, expected):
+    assert match_answer(CHOICE, student, solution) is expected
+
+
+@pytest.mark.parametrize("student, solution, expected", [
+    ("Đúng", "dung", True),
+    ("ĐÚNG", "true", True),
+    ("Sai", "Đúng", False),
+    ("có lẽ", "Đúng", None),
+])
+def test_true_false(student, solution, expected):
+    assert match_answer(TRUE_FALSE, student, solution) is expected
+
+
+def test_short_answer_falls_back_to_model():
+    assert match_answer(SHORT_ANSWER, "Thủ đô", "Hà Nội") is None
+    assert match_answer(SHORT_ANSWER, " Hà Nội. ", "hà nội") is True
+
+
+def test_parse_quantity():
+    assert parse_quantity("12 cm") == (12.0, "cm")
+    assert parse_quantity("10%") == (10.0, "%")
+    assert parse_quantity("abc") is None
+
+
+def test_infer_kind():
+    assert infer_kind("Trắc nghiệm", "A") == CHOICE
+    assert infer_kind(None, "B") == CHOICE
+    assert infer_kind(None, "Đúng") == TRUE_FALSE
+    assert infer_kind(None, "2,5") == NUMERIC
+    assert infer_kind("Tự luận", "2,5") is None
+
+
+def test_grade_objective_question():
+    graded = grade_objective_question(1, {"questionType": "numeric", "solution": "3 m", "studentAnswer": "300 cm",
+                                          "grade": 2})
+    assert graded["is_correct"] is True and graded["student_score"] == 2 and graded["graded_by"] == "rule"
+    unanswered = grade_objective_question(2, {"solution": "A", "studentAnswer": "", "grade": 1})
+    assert unanswered["is_correct"] is False and unanswered["student_score"] == 0
+    assert grade_objective_question(3, {"solution": "1.000", "studentAnswer": "1000", "grade": 1}) is None
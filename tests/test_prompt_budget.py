@@ -0,0 +1,55 @@
+import time
+
+from prompt_budget import PROMPT_MAX_CHARS_PER_TOKEN, PromptBudget, count_tokens, fit_text, share_budget
+
+
+def test_short_text_is_unchanged():
+    fitted = fit_text("x = 5", 100)
+    assert fitted.text == "x = 5" and not fitted.compacted
+
+
+def test_whitespace_padding_is_compacted_before_any_cut():
+    # Dài gấp nhiều lần ngưỡng cắt nhanh nhưng chủ yếu là khoảng trắng: gộp xong là vừa, không mất nội dung
+    words = [f"y{i}" for i in range(40)]
+    text = (" " * 2000).join(words)
+    assert len(text) > 100 * PROMPT_MAX_CHARS_PER_TOKEN
+    fitted = fit_text(text, 100)
+    assert fitted.steps == ["whitespace"]
+    assert fitted.text == " ".join(words)
+
+
+def test_repeated_lines_are_compacted_before_any_cut():
+    line = "Trường THCS Nguyễn Du - Đề kiểm tra giữa kỳ"
+    text = "\n".join([line, "Câu 1: x = 2"] + [line] * 500 + ["Kết luận: đúng"])
+    fitted = fit_text(text, 100)
+    assert "precut" not in fitted.steps and "head_tail" not in fitted.steps
+    assert fitted.text.endswith("Kết luận: đúng") and fitted.text.count(line) == 1
+
+
+def test_long_text_keeps_head_and_tail_within_budget():
+    text = " ".join(f"từ{i}" for i in range(200_000))
+    fitted = fit_text(text, 200)
+    assert fitted.steps == ["precut", "head_tail"]
+    assert fitted.tokens <= 200 and count_tokens(fitted.text) <= 200
+    assert fitted.text.startswith("từ0 ") and fitted.text.endswith("từ199999")
+    assert "lược bớt" in fitted.text
+    assert fitted.original_tokens > 10 * fitted.tokens
+
+
+def test_large_text_is_fast():
+    text = "Bài làm của em rất dài.\n" * 200_000
+    start = time.perf_counter()
+    fit_text(text + "x" * 5_000_000, 1000)
+    assert time.perf_counter() - start < 5
+
+
+def test_share_budget():
+    assert share_budget([10, 500, 1000], 600) == [10, 295, 295]
+    assert share_budget([10, 20], 600) == [10, 20]
+
+
+def test_fit_many_records_compacted_fields():
+    budget = PromptBudget(100)
+    short, long = budget.fit_many(["a", "b"], ["ngắn", " ".join(f"w{i}" for i in range(5000))])
+    assert short == "ngắn" and count_tokens(long) <= 100
+    assert [entry["field"] for entry in budget.report()["compacted"]] == ["b"]
@@ -0,0 +1,36 @@
+import asyncio
+
+from singleflight import SingleFlight, coalesce_key
+
+
+def _key(content: str) -> str:
+    return coalesce_key({"model": "m", "messages": [{"role": "user", "content": content}]})
+
+
+def test_trailing_whitespace_and_line_endings_share_a_key():
+    assert _key("x = 2\r\ny = 3  \n") == _key("x = 2\ny = 3")
+    assert _key("x = 2\t\n") == _key("x = 2\n")
+
+
+def test_indentation_and_inner_spaces_change_the_key():
+    a = "def f(x):\n    if x:\n        return 1\n    return 2"
+    b = "def f(x):\n    if x:\n        return 1\n        return 2"
+    assert _key(a) != _key(b)
+    assert _key("  x = 2") != _key("x = 2")
+    assert _key("print('a  b')") != _key("print('a b')")
+
+
+def test_duplicate_calls_run_once():
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"ok": True}
+
+    async def run():
+        flight = SingleFlight()
+        return await asyncio.gather(*(flight.do("k", call) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1 and results == [{"ok": True}] * 5